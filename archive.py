@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+import struct
+import threading
+
+ARCHIVE_FLUSH_INTERVAL = 0.5
+GAME_LIST_LIMIT = 20
+GAME_LIST_MAX = 100
+
+# One move is two bytes, the row (with the stone in the top bit) and the
+# column, followed by two bytes of time since the previous move in
+# hundredths of a second, capped at about eleven minutes.
+_MOVE = struct.Struct('!BBH')
+MAX_MOVE_TIME = 0xFFFF
+
+SUMMARY_COLUMNS = ('id', 'room_id', 'name', 'black', 'white', 'black_name', 'white_name',
+                   'winner', 'size', 'started', 'ended', 'move_count')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    room_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    black TEXT NOT NULL,
+    white TEXT NOT NULL,
+    black_name TEXT NOT NULL,
+    white_name TEXT NOT NULL,
+    winner TEXT,
+    size INTEGER NOT NULL,
+    started REAL,
+    ended REAL NOT NULL,
+    move_count INTEGER NOT NULL,
+    moves BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_room ON games (room_id, ended);
+CREATE INDEX IF NOT EXISTS games_black ON games (black, ended);
+CREATE INDEX IF NOT EXISTS games_white ON games (white, ended);
+CREATE INDEX IF NOT EXISTS games_ended ON games (ended);
+'''
+
+
+def encode_move(r, c, stone, elapsed):
+    return _MOVE.pack((stone - 1) << 7 | r, c, min(MAX_MOVE_TIME, max(0, round(elapsed * 100))))
+
+
+def decode_moves(data):
+    # Yields (r, c, stone, seconds since the previous move).
+    for row, c, elapsed in _MOVE.iter_unpack(data):
+        yield row & 0x7F, c, (row >> 7) + 1, elapsed / 100
+
+
+class Archive:
+    # Finished games in a SQLite database, one row per game holding the
+    # players, result, times and the encoded move list. Lookups use the
+    # primary key or the indexes on room, player and end time, so they read
+    # a few pages however many games are stored and nothing is loaded up
+    # front. record() only queues the game; a background writer inserts
+    # each batch in one transaction from a worker thread. Shards share the
+    # database file (WAL mode, and writers wait for each other's locks).
+    def __init__(self, path, flush_interval=ARCHIVE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._wakeup = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def record(self, game):
+        self._pending.append(game)
+        if self._wakeup is not None and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                await self._wakeup.wait()
+                await asyncio.sleep(self.flush_interval)
+                self._wakeup.clear()
+                batch, self._pending = self._pending, []
+                if batch:
+                    await loop.run_in_executor(None, self._write, batch)
+        finally:
+            if self._pending:
+                self._write(self._pending)
+
+    def _write(self, batch):
+        rows = [(game['room_id'], game['name'], game['black'], game['white'], game['black_name'],
+                 game['white_name'], game['winner'], game['size'], game['started'], game['ended'],
+                 len(game['moves']) // _MOVE.size, game['moves']) for game in batch]
+        with self._lock, self._db:
+            self._db.executemany('INSERT INTO games (room_id, name, black, white, black_name, white_name, winner, '
+                                 'size, started, ended, move_count, moves) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def get_game(self, game_id):
+        rows = self._query(f"SELECT {', '.join(SUMMARY_COLUMNS)}, moves FROM games WHERE id = ?", (game_id,))
+        return dict(zip(SUMMARY_COLUMNS + ('moves',), rows[0])) if rows else None
+
+    def find_games(self, room_id=None, user_id=None, before=None, limit=GAME_LIST_LIMIT):
+        # Newest first, optionally only games that ended before a time (for
+        # paging). For a player the black and white indexes are each read
+        # newest first and merged, so neither is scanned in full.
+        columns = ', '.join(SUMMARY_COLUMNS)
+        conditions = []
+        params = []
+        if before is not None:
+            conditions.append('ended < ?')
+            params.append(before)
+        if room_id is not None:
+            conditions.append('room_id = ?')
+            params.append(room_id)
+            if user_id is not None:
+                conditions.append('? IN (black, white)')
+                params.append(user_id)
+        elif user_id is not None:
+            selects = []
+            for column in ('black', 'white'):
+                where = ' AND '.join(conditions + [f'{column} = ?'])
+                selects.append(f"SELECT * FROM (SELECT {columns} FROM games WHERE {where} ORDER BY ended DESC LIMIT ?)")
+            sql = ' UNION ALL '.join(selects) + ' ORDER BY ended DESC LIMIT ?'
+            params = params + [user_id, limit] + params + [user_id, limit, limit]
+            return [dict(zip(SUMMARY_COLUMNS, row)) for row in self._query(sql, params)]
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+        sql = f"SELECT {columns} FROM games {where}ORDER BY ended DESC LIMIT ?"
+        return [dict(zip(SUMMARY_COLUMNS, row)) for row in self._query(sql, params + [limit])]
+
+    async def get(self, game_id):
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_game, game_id)
+
+    async def find(self, room_id=None, user_id=None, before=None, limit=GAME_LIST_LIMIT):
+        return await asyncio.get_running_loop().run_in_executor(None, self.find_games, room_id, user_id, before, limit)
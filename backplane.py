@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+from broker import PUBLISH, SUBSCRIBE, UNSUBSCRIBE, WILL, frame, read_frame
+
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 5.0
+CLUSTER_CHANNEL = 'cluster'
+
+
+def node_channel(node):
+    return f'node.{node}'
+
+
+def room_channel(room_id):
+    return f'room.{room_id}'
+
+
+class Backplane:
+    # One server's link to the others through a broker (broker.py), with
+    # the interface of cluster.Cluster so lobby updates, sessions and
+    # ratings are shared the same way. A node owns the rooms created on it
+    # and is known by the URL players are redirected to for them.
+    #
+    # Channels:
+    # - cluster: events for every node, as {'node': sender, 'event': ...}
+    # - node.<url>: events for one node, in the same envelope
+    # - room.<room_id>: what the owner sends the room's spectators, bare,
+    #   published only while some node is watching
+    def __init__(self, host, port, url, rooms):
+        self.broker = (host, port)
+        self.node = url
+        # This node's rooms, by id (the server's GAME_ROOMS).
+        self.rooms = rooms
+        # Rooms known to be owned by other nodes.
+        self.owners = {}
+        self.channels = {CLUSTER_CHANNEL, node_channel(url)}
+        self.writer = None
+
+    def owns(self, room_id):
+        return room_id in self.rooms
+
+    def can_host(self, room_id):
+        return room_id not in self.rooms and room_id not in self.owners
+
+    def url_of(self, room_id):
+        # None for a room no node is known to own.
+        return self.owners.get(room_id)
+
+    def publish(self, event):
+        self._write(PUBLISH, CLUSTER_CHANNEL, {'node': self.node, 'event': event})
+
+    def send(self, node, event):
+        self._write(PUBLISH, node_channel(node), {'node': self.node, 'event': event})
+
+    def publish_room(self, room_id, message):
+        self._write(PUBLISH, room_channel(room_id), message)
+
+    def watch(self, room_id):
+        self.channels.add(room_channel(room_id))
+        self._write(SUBSCRIBE, room_channel(room_id))
+
+    def unwatch(self, room_id):
+        self.channels.discard(room_channel(room_id))
+        self._write(UNSUBSCRIBE, room_channel(room_id))
+
+    def _write(self, op, channel, data=None):
+        # Anything sent while the broker is unreachable is lost; the other
+        # nodes have dropped this one by then and catch up on its hello.
+        if self.writer is None:
+            return
+        payload = json.dumps(data, separators=(',', ':')).encode() if data is not None else b''
+        self.writer.write(frame(op, channel.encode(), payload))
+
+    def start(self, on_event):
+        asyncio.get_running_loop().create_task(self.run(on_event))
+
+    async def run(self, on_event):
+        # Stays connected for good, reconnecting with backoff. on_event gets
+        # {'type': 'connected'} after every (re)connection and, on a lost
+        # connection, a room_update removing every room of the other nodes
+        # then {'type': 'disconnected'}.
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*self.broker)
+            except OSError as e:
+                print(f"Broker {self.broker[0]}:{self.broker[1]} unreachable ({e}); retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            self.writer = writer
+            self._write(WILL, CLUSTER_CHANNEL, {'node': self.node, 'event': {'type': 'node_down', 'node': self.node}})
+            for channel in self.channels:
+                self._write(SUBSCRIBE, channel)
+            self.publish({'type': 'hello', 'node': self.node})
+            print(f"Connected to broker {self.broker[0]}:{self.broker[1]} as {self.node}")
+            on_event({'type': 'connected'})
+            try:
+                while True:
+                    op, channel, payload = await read_frame(reader)
+                    if op == PUBLISH:
+                        self.receive(channel.decode(), json.loads(payload), on_event)
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+                print(f"Lost the broker ({e or type(e).__name__}); reconnecting")
+            self.writer = None
+            writer.close()
+            self.node_down(None, on_event)
+            on_event({'type': 'disconnected'})
+
+    def receive(self, channel, data, on_event):
+        if channel.startswith('room.'):
+            on_event({'type': 'room_event', 'room_id': channel[5:], 'message': data})
+            return
+        node, event = data['node'], data['event']
+        if event['type'] == 'room_update':
+            for info in event['rooms']:
+                self.owners[info['room_id']] = node
+            for room_id in event['removed']:
+                self.owners.pop(room_id, None)
+        elif event['type'] == 'node_down':
+            self.node_down(event['node'], on_event)
+        on_event(event)
+
+    def node_down(self, node, on_event):
+        # Forget the rooms of node, or of every other node for None.
+        removed = [room_id for room_id, owner in self.owners.items() if node is None or owner == node]
+        for room_id in removed:
+            del self.owners[room_id]
+        if removed:
+            on_event({'type': 'room_update', 'rooms': [], 'removed': removed})
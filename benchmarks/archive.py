@@ -0,0 +1,82 @@
+"""Game archive size and lookup cost.
+
+Writes --games random finished games (between 9 and 120 moves, players
+drawn from --players user ids) through Archive in batches, then reopens the
+database and times lookups of random games by id, the latest games of
+random players and the latest games overall. Peak memory of the process is
+reported after the lookups.
+
+    python -m benchmarks.archive [--games 1000000] [--players 10000] [--path /tmp/bench-archive.db]
+"""
+import argparse
+import os
+import random
+import resource
+import time
+
+from archive import Archive, encode_move
+
+BATCH = 5000
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+def random_game(rng, players, ended):
+    black, white = rng.sample(range(players), 2)
+    moves = bytearray()
+    cells = rng.sample(range(225), rng.randint(9, 120))
+    for i, cell in enumerate(cells):
+        moves += encode_move(cell // 15, cell % 15, 1 + i % 2, rng.expovariate(1 / 4))
+    return {
+        'room_id': f'{rng.getrandbits(30):06x}', 'name': 'bench',
+        'black': f'u{black}', 'white': f'u{white}', 'black_name': f'U{black}', 'white_name': f'U{white}',
+        'winner': f'u{black}', 'size': 15, 'started': ended - 300, 'ended': ended, 'moves': bytes(moves)
+    }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--path', default='/tmp/bench-archive.db')
+    args = parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    rng = random.Random(1)
+    archive = Archive(args.path)
+    write_time = 0
+    move_bytes = 0
+    for start in range(0, args.games, BATCH):
+        batch = [random_game(rng, args.players, 1.7e9 + i) for i in range(start, min(args.games, start + BATCH))]
+        move_bytes += sum(len(game['moves']) for game in batch)
+        elapsed, _ = timed(archive._write, batch)
+        write_time += elapsed
+    archive._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    size = os.path.getsize(args.path)
+    print(f"write    {args.games / write_time:8.0f} games/s  {size / 2**20:7.1f} MiB  "
+          f"{size / args.games:5.0f} bytes/game ({move_bytes / args.games:.0f} of them moves)")
+
+    archive = Archive(args.path)
+    for label, query in (
+            ('by id', lambda: archive.get_game(rng.randint(1, args.games))),
+            ('by player', lambda: archive.find_games(user_id=f'u{rng.randrange(args.players)}')),
+            ('latest', lambda: archive.find_games())):
+        times = [timed(query)[0] for _ in range(args.lookups)]
+        print(f"{label:9} p50 {percentile(times, 0.5) * 1e6:7.1f} us  p99 {percentile(times, 0.99) * 1e6:7.1f} us")
+    print(f"peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
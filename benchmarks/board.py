@@ -0,0 +1,124 @@
+"""Compare the bitboard win check against the original list-of-lists walk.
+
+Run from the repository root:
+
+    python -m benchmarks.board
+"""
+import random
+import sys
+import time
+
+from board import Board
+
+
+def legacy_check_win(board, r, c, stone):
+    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
+    for dr, dc in directions:
+        count = 1
+        line = [(r, c)]
+
+        for i in range(1, 5):
+            nr, nc = r + dr * i, c + dc * i
+            if 0 <= nr < 15 and 0 <= nc < 15 and board[nr][nc] == stone:
+                count += 1
+                line.append((nr, nc))
+            else:
+                break
+
+        for i in range(1, 5):
+            nr, nc = r - dr * i, c - dc * i
+            if 0 <= nr < 15 and 0 <= nc < 15 and board[nr][nc] == stone:
+                count += 1
+                line.append((nr, nc))
+            else:
+                break
+
+        if count >= 5:
+            return line
+    return None
+
+
+def random_games(count, seed=1):
+    rng = random.Random(seed)
+    cells = [(r, c) for r in range(15) for c in range(15)]
+    games = []
+    for _ in range(count):
+        order = cells[:]
+        rng.shuffle(order)
+        games.append(order)
+    return games
+
+
+def run_legacy(games):
+    moves = 0
+    for order in games:
+        board = [[0] * 15 for _ in range(15)]
+        stone = 1
+        for r, c in order:
+            board[r][c] = stone
+            moves += 1
+            if legacy_check_win(board, r, c, stone):
+                break
+            stone = 3 - stone
+    return moves
+
+
+def run_bitboard(games):
+    moves = 0
+    for order in games:
+        board = Board()
+        stone = 1
+        for r, c in order:
+            board.place(r, c, stone)
+            moves += 1
+            if board.check_win(r, c, stone):
+                break
+            stone = 3 - stone
+    return moves
+
+
+def verify(games):
+    for order in games:
+        legacy = [[0] * 15 for _ in range(15)]
+        board = Board()
+        stone = 1
+        for r, c in order:
+            legacy[r][c] = stone
+            board.place(r, c, stone)
+            expected = legacy_check_win(legacy, r, c, stone)
+            assert board.check_win(r, c, stone) == expected, (order, r, c)
+            assert board.to_rows() == legacy
+            if expected:
+                break
+            stone = 3 - stone
+
+
+def deep_size(board):
+    if isinstance(board, list):
+        return sys.getsizeof(board) + sum(sys.getsizeof(row) for row in board)
+    return sys.getsizeof(board) + sys.getsizeof(board.black) + sys.getsizeof(board.white)
+
+
+def main():
+    games = random_games(2000)
+    verify(games[:200])
+
+    for name, fn in (('legacy', run_legacy), ('bitboard', run_bitboard)):
+        start = time.perf_counter()
+        moves = fn(games)
+        elapsed = time.perf_counter() - start
+        print(f"{name:9} {moves} moves in {elapsed:.3f}s -> {moves / elapsed / 1000:.1f}k moves/s, "
+              f"{elapsed / moves * 1e6:.2f} us/move")
+
+    full = Board()
+    legacy = [[0] * 15 for _ in range(15)]
+    for r in range(15):
+        for c in range(15):
+            stone = 1 + (r + c) % 2
+            full.place(r, c, stone)
+            legacy[r][c] = stone
+    print(f"memory    legacy {deep_size(legacy)} bytes, bitboard {deep_size(full)} bytes (full board)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Messages decoded and dispatched per second on one core.
+
+Decodes three sets of client frames with server.DISPATCH.decode (type
+prefix, size limits, validation into Message objects) and, as a baseline,
+with plain json.loads, which is all the old decoding did before its if/elif
+chain:
+
+- moves: move frames as clients send them
+- mixed: mostly moves, with chat, sync, list_rooms, reconnect and join_room
+- garbage: malformed JSON, unknown types, wrong field types and frames far
+  over their type's size limit
+
+Then feeds move frames through server.handle_frame, the full path from a
+frame to GameRoom.handle_move, with players that have no connection.
+
+    python -m benchmarks.dispatch [--rounds 20]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import server
+from messages import InvalidMessage
+
+# A fixed pattern that fills the board without five in a row.
+CELLS = [(r, c) for r in range(15) for c in range(15) if (r // 2 + c) % 4 < 2]
+
+
+def move_frames():
+    return [json.dumps({'type': 'move', 'move': {'r': r, 'c': c}}) for r, c in CELLS]
+
+
+def mixed_frames(rng):
+    others = [
+        {'type': 'chat', 'message': 'good game, well played'},
+        {'type': 'sync', 'last_seq': 42},
+        {'type': 'list_rooms', 'game_state': 'WAITING', 'prefix': 'fri'},
+        {'type': 'reconnect', 'user_id': 'player123', 'token': 'a1B2c3D4e5F6g7H8', 'room_id': 'abc123', 'last_seq': 17},
+        {'type': 'join_room', 'room_id': 'abc123', 'user_id': 'player456', 'user_name': 'Bob'}
+    ]
+    frames = move_frames()
+    frames += [json.dumps(rng.choice(others)) for _ in range(len(frames) // 2)]
+    rng.shuffle(frames)
+    return frames
+
+
+def garbage_frames():
+    return [
+        '{"type": "move", "move": {"r": 7, "c": ' + ' ' * 2000 + '8}}',
+        json.dumps({'type': 'chat', 'message': 'x' * 3000, 'pad': list(range(200))}),
+        json.dumps({'type': 'list_rooms', 'prefix': ['a'] * 500}),
+        json.dumps({'type': 'no_such_type', 'data': list(range(300))}),
+        json.dumps({'type': 'move', 'move': {'r': 'seven', 'c': 8}}),
+        json.dumps({'type': 'join_room', 'room_id': 12345}),
+        '{"type": "move", "move": {"r": 7, ',
+        'not json at all',
+        json.dumps(list(range(1000))),
+    ]
+
+
+def rate(decode, frames, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            try:
+                decode(frame)
+            except (InvalidMessage, ValueError):
+                pass
+    return rounds * len(frames) / (time.perf_counter() - start)
+
+
+async def dispatch_rate(rounds):
+    room = server.GAME_ROOMS['bench'] = server.GameRoom('bench', 'bench')
+    sockets = {}
+    for user_id, stone in (('a', 1), ('b', 2)):
+        room.players[user_id] = server.Player(user_id, user_id, stone)
+        sockets[user_id] = object()
+        server.ALL_CLIENTS[sockets[user_id]] = {'room_id': 'bench', 'user_id': user_id}
+    room.game_state = 'IN_PROGRESS'
+    frames = move_frames()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        room.board = room.rule.new_board()
+        room.current_turn_uid = 'a'
+        for frame in frames:
+            await server.handle_frame(sockets[room.current_turn_uid], frame)
+    elapsed = time.perf_counter() - start
+    assert room.game_state == 'IN_PROGRESS', 'the pattern produced a win'
+    room.cancel_move_timer()
+    server.GAME_ROOMS.clear()
+    server.ALL_CLIENTS.clear()
+    return rounds * len(frames) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    sets = {
+        'moves': move_frames(),
+        'mixed': mixed_frames(random.Random(1)),
+        'garbage': garbage_frames() * 20
+    }
+    print(f"{'frames':8} {'json.loads':>12} {'decode':>12}")
+    for name, frames in sets.items():
+        baseline = rate(json.loads, frames, args.rounds * 10)
+        decoded = rate(server.DISPATCH.decode, frames, args.rounds * 10)
+        print(f"{name:8} {baseline:10.0f}/s {decoded:10.0f}/s")
+    print(f"moves decoded and dispatched to GameRoom.handle_move: {asyncio.run(dispatch_rate(args.rounds)):.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Bot engine speed.
+
+search: runs Position.search on middlegame positions (reached by short
+        self-play from seeded random openings) with a fixed time budget and
+        reports nodes per second and the depth completed.
+sync:   the cost of bringing the engine's position up to date with the
+        server board after one more stone, against building a fresh
+        Position from the board.
+
+    python -m benchmarks.engine [--positions 6] [--plies 16] [--time 2.0]
+"""
+import argparse
+import random
+import time
+
+import engine
+from board import Board
+
+
+def middlegame(rng, plies):
+    board = Board()
+    position = engine.Position()
+    for ply in range(plies):
+        stone = 1 + ply % 2
+        if ply < 3:
+            r, c = 7 + rng.randint(-2, 2), 7 + rng.randint(-2, 2)
+            while not board.is_empty(r, c):
+                r, c = 7 + rng.randint(-2, 2), 7 + rng.randint(-2, 2)
+        else:
+            r, c = divmod(position.search(stone, time.time() + 0.05, 3), board.size)
+        board.place(r, c, stone)
+        position.make(r * board.size + c, stone)
+        if board.check_win(r, c, stone):
+            return None
+    # Skip positions decided by a four on the board; the search answers
+    # those without searching.
+    if position.fours[1] or position.fours[2]:
+        return None
+    return board
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--positions', type=int, default=6)
+    parser.add_argument('--plies', type=int, default=16)
+    parser.add_argument('--time', type=float, default=2.0, help='search budget per position in seconds')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    boards = []
+    while len(boards) < args.positions:
+        board = middlegame(rng, args.plies)
+        if board:
+            boards.append(board)
+
+    total_nodes = total_time = 0
+    for i, board in enumerate(boards):
+        position = engine.Position()
+        position.sync(board.black, board.white, board.stride)
+        stone = 1 + board.stones % 2
+        start = time.perf_counter()
+        cell = position.search(stone, time.time() + args.time)
+        elapsed = time.perf_counter() - start
+        total_nodes += position.nodes
+        total_time += elapsed
+        print(f"position {i}  {board.stones} stones  move {divmod(cell, board.size)}  depth {position.depth:2}  "
+              f"{position.nodes:7} nodes  {position.nodes / elapsed:8.0f} nodes/s  tt {len(position.tt)}")
+    print(f"search   {total_nodes / total_time:8.0f} nodes/s over {len(boards)} positions")
+
+    rounds = 200
+    sync_time = rebuild_time = 0
+    for board in boards:
+        position = engine.Position()
+        position.sync(board.black, board.white, board.stride)
+        r, c = divmod(next(cell for cell in range(225) if position.cells[cell] == 0 and position.near[cell]), board.size)
+        after = Board()
+        after.black, after.white = board.black, board.white
+        after.place(r, c, 1 + board.stones % 2)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            position.sync(after.black, after.white, after.stride)
+            sync_time += time.perf_counter() - start
+            position.unmake()
+            position.synced = (board.black, board.white)
+            start = time.perf_counter()
+            engine.Position().sync(after.black, after.white, after.stride)
+            rebuild_time += time.perf_counter() - start
+    count = rounds * len(boards)
+    print(f"sync     {sync_time / count * 1e6:8.1f} us per move incremental  "
+          f"{rebuild_time / count * 1e6:8.1f} us rebuilding the position")
+
+
+if __name__ == '__main__':
+    main()
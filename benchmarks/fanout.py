@@ -0,0 +1,137 @@
+"""Broadcast one room's messages to 1,000 spectators.
+
+Compares the old per-recipient path (json.dumps + one coroutine per socket
+under asyncio.gather) with server.fan_out. The spectators run in a child
+process so their reads do not count against the server's CPU time.
+
+    python -m benchmarks.fanout [--spectators 1000] [--rounds 50]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+import websockets
+
+import server
+
+PORT = 8791
+
+
+async def legacy_broadcast(clients, message):
+    async def send(ws):
+        try:
+            await ws.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    await asyncio.gather(*[send(ws) for ws in clients], return_exceptions=True)
+
+
+async def fan_out_broadcast(clients, message):
+    server.fan_out(clients, message)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def spectators(count, port):
+    # Child process: one connection per spectator plus a stalled one that
+    # never reads. Reports the latency of the last delivery of each message.
+    conns = [await websockets.connect(f'ws://localhost:{port}') for _ in range(count)]
+    stalled = await websockets.connect(f'ws://localhost:{port}', max_queue=1)
+    latest = {}
+
+    async def read(ws):
+        async for frame in ws:
+            message = json.loads(frame)
+            if message['type'] == 'done':
+                return
+            key = (message['mode'], message['seq'])
+            latency = time.monotonic() - message['t']
+            latest[key] = max(latest.get(key, 0), latency)
+
+    await asyncio.gather(*[read(ws) for ws in conns])
+    results = {}
+    for (mode, _), latency in latest.items():
+        results.setdefault(mode, []).append(latency)
+    print(json.dumps(results))
+    await stalled.close()
+
+
+async def run(args):
+    connected = []
+    all_connected = asyncio.Event()
+
+    async def handler(ws):
+        connected.append(ws)
+        if len(connected) == args.spectators + 1:
+            all_connected.set()
+        await ws.wait_closed()
+
+    async with websockets.serve(handler, 'localhost', PORT, max_queue=None, compression=None):
+        child = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'benchmarks.fanout', '--child',
+            '--spectators', str(args.spectators), stdout=asyncio.subprocess.PIPE)
+        await all_connected.wait()
+
+        # Fill the stalled spectator's buffers so that any broadcast which
+        # waits on it would block.
+        stalled = connected[-1]
+        filler = 'x' * 4096
+
+        async def fill():
+            while True:
+                await stalled.send(filler)
+        try:
+            await asyncio.wait_for(fill(), 2)
+        except asyncio.TimeoutError:
+            pass
+
+        cpu = {}
+        wall = {}
+        for mode, broadcast in (('legacy', legacy_broadcast), ('fan_out', fan_out_broadcast)):
+            cpu[mode], wall[mode] = [], []
+            for seq in range(args.rounds):
+                message = {'type': 'move', 'player_id': 'player123', 'r': 7, 'c': 7,
+                           'stone': 1, 'seq': seq, 'mode': mode, 't': time.monotonic()}
+                c0, w0 = time.process_time(), time.perf_counter()
+                try:
+                    await asyncio.wait_for(broadcast(connected, message), 1)
+                except asyncio.TimeoutError:
+                    pass
+                cpu[mode].append(time.process_time() - c0)
+                wall[mode].append(time.perf_counter() - w0)
+                await asyncio.sleep(0.25)
+
+        server.fan_out(connected[:-1], {'type': 'done'})
+        output, _ = await child.communicate()
+        latency = json.loads(output)
+
+    print(f"{args.spectators} spectators + 1 stalled spectator, {args.rounds} moves per mode")
+    for mode in ('legacy', 'fan_out'):
+        lat = latency.get(mode, [])
+        delivered = f"{len(lat)}/{args.rounds} delivered"
+        lat_text = (f"last-recipient latency p50 {percentile(lat, 0.5) * 1e3:7.2f} ms "
+                    f"p99 {percentile(lat, 0.99) * 1e3:7.2f} ms") if lat else "no deliveries"
+        print(f"{mode:8} cpu {statistics.mean(cpu[mode]) * 1e3:7.3f} ms/broadcast  "
+              f"call {statistics.mean(wall[mode]) * 1e3:7.2f} ms  {lat_text}  ({delivered})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spectators', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--child', action='store_true')
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(spectators(args.spectators, PORT))
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
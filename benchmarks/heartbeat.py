@@ -0,0 +1,133 @@
+"""Dead-peer detection time and the idle cost of keeping connections alive.
+
+Runs server.py with the app-level heartbeat (--heartbeat, every connection
+pinged from one scheduler timer) and with --heartbeat 0, which leaves it to
+the websockets keepalive (a task per connection, pinging every 20 s and
+giving up 20 s after an unanswered ping). For each:
+
+- connects --connections idle clients from a separate process, each
+  answering pings, and reports the server's RSS per connection and its CPU
+  time over --idle seconds
+- seats two players, stops one reading from its socket as a half-open
+  connection would look, and times until the other is told it disconnected
+
+    python -m benchmarks.heartbeat [--connections 2000] [--idle 20] [--interval 5]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+from gameclient import GameClient
+
+PORT = 8791
+URL = f'ws://localhost:{PORT}'
+
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def idle_client(ready):
+    async with websockets.connect(URL, ping_interval=None) as ws:
+        ready.append(ws)
+        async for frame in ws:
+            message = json.loads(frame)
+            if message['type'] == 'ping':
+                await ws.send(json.dumps({'type': 'pong', 'id': message['id']}))
+
+
+def run_idle_clients(count, conn):
+    async def main():
+        ready = []
+        tasks = []
+        for _ in range(count):
+            tasks.append(asyncio.ensure_future(idle_client(ready)))
+            if len(tasks) % 100 == 0:
+                await asyncio.sleep(0.05)
+        while len(ready) < count:
+            await asyncio.sleep(0.05)
+        conn.send('connected')
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        for task in tasks:
+            task.cancel()
+    asyncio.run(main())
+
+
+async def detection_time(heartbeat, timeout):
+    a = await GameClient(URL, 'alive').connect()
+    b = await GameClient(URL, 'frozen').connect()
+    room_id = (await a.create_room('heartbeat')).room_id
+    await b.join(room_id)
+    await a.wait_for('game_state', timeout=5)
+    # A player that has never answered a ping is not judged by the
+    # heartbeat; one that has been connected a while has.
+    if heartbeat:
+        while a.rtt is None or b.rtt is None:
+            await a.wait_for('ping', timeout=heartbeat * 2)
+    else:
+        await asyncio.sleep(2)
+    b.ws.transport.pause_reading()
+    started = time.monotonic()
+    await a.wait_for('chat', check=lambda e: 'disconnected' in e.message, timeout=timeout)
+    elapsed = time.monotonic() - started
+    await a.close()
+    b.ws.transport.abort()
+    return elapsed
+
+
+def measure(heartbeat, args):
+    server = subprocess.Popen([sys.executable, 'server.py', '--port', str(PORT), '--heartbeat', str(heartbeat)],
+                              stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        base_rss = rss_kb(server.pid)
+        parent_conn, child_conn = multiprocessing.Pipe()
+        clients = multiprocessing.Process(target=run_idle_clients, args=(args.connections, child_conn))
+        clients.start()
+        parent_conn.recv()
+        time.sleep(1)
+        rss = rss_kb(server.pid)
+        cpu = cpu_seconds(server.pid)
+        time.sleep(args.idle)
+        cpu = cpu_seconds(server.pid) - cpu
+        parent_conn.send('done')
+        clients.join()
+        detected = asyncio.run(detection_time(heartbeat, args.timeout))
+    finally:
+        server.terminate()
+        server.wait()
+    return (rss - base_rss) * 1024 / args.connections, cpu, detected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--idle', type=float, default=20, help='seconds of idle CPU time to measure')
+    parser.add_argument('--interval', type=float, default=5, help='--heartbeat interval for the app-level run')
+    parser.add_argument('--timeout', type=float, default=90, help='give up waiting for a detection after this long')
+    args = parser.parse_args()
+
+    for name, heartbeat in ((f'heartbeat {args.interval}s', args.interval), ('websockets keepalive', 0)):
+        per_connection, cpu, detected = measure(heartbeat, args)
+        print(f"{name:22} {per_connection:6.0f} bytes/connection  idle cpu {cpu:5.2f}s over {args.idle:.0f}s "
+              f"with {args.connections} connections  half-open peer detected after {detected:5.1f}s")
+
+
+if __name__ == '__main__':
+    main()
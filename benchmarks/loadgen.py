@@ -0,0 +1,275 @@
+"""Load generator: headless bots playing full games against a running server.
+
+Each table seats two players and some spectators, all gameclient.GameClient
+instances in this one process. The first player creates a room, the second
+joins, and both play random legal moves (or the moves of --script) until the
+game ends, then the table starts a new game. Players chat and drop and
+reconnect with their token at the given rates, and spectators chat among
+themselves.
+
+Prints one JSON document with move round-trip latency (move sent until the
+server echoes it), messages per second, reconnect latency, games played,
+errors and, with --server-pid, the server's RSS and CPU use.
+
+    python server.py &
+    python -m benchmarks.loadgen [--url ws://localhost:8765] [--tables 100]
+        [--spectators 2] [--duration 30] [--server-pid PID] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import websockets
+
+import protocol
+from gameclient import GameClient, GameError
+
+
+class Run:
+    def __init__(self, args):
+        self.args = args
+        self.deadline = None
+        self.clients = 0
+        self.sent = 0
+        self.received = 0
+        self.moves = 0
+        self.games = 0
+        self.chats = 0
+        self.errors = 0
+        self.move_rtts = []
+        self.reconnect_times = []
+        self.script = None
+        if args.script:
+            with open(args.script) as f:
+                self.script = [tuple(move) for move in json.load(f)]
+
+    def measuring(self):
+        return time.perf_counter() < self.deadline
+
+
+class Bot(GameClient):
+    # A GameClient that counts what it sends and receives.
+    def __init__(self, run, user_id, rng):
+        args = run.args
+        super().__init__(args.url, user_id, encoding=args.encoding, on_event=Bot.received,
+                         compression=None, open_timeout=30)
+        self.run = run
+        self.rng = rng
+        self.connected = False
+
+    async def connect(self):
+        await super().connect()
+        self.connected = True
+        self.run.clients += 1
+        return self
+
+    async def close(self):
+        if self.connected:
+            self.connected = False
+            self.run.clients -= 1
+            await super().close()
+
+    async def send(self, message):
+        if self.run.measuring():
+            self.run.sent += 1
+        await super().send(message)
+
+    async def received(self, event):
+        if self.run.measuring():
+            self.run.received += 1
+        if self.is_spectator and self.rng.random() < self.run.args.chat_rate / 10:
+            await self.spectator_chat('nice')
+            self.run.chats += 1
+
+    def pick_move(self):
+        free = [(r, c) for r, row in enumerate(self.board) for c, stone in enumerate(row) if not stone]
+        played = len(self.board) ** 2 - len(free)
+        script = self.run.script
+        if script and played < len(script) and not self.board[script[played][0]][script[played][1]]:
+            return script[played]
+        return self.rng.choice(free) if free else None
+
+    async def play(self):
+        args = self.run.args
+        while self.run.measuring() and await self.wait_turn():
+            if args.think:
+                await asyncio.sleep(args.think)
+            # Dropped on our own turn, the game cannot end while we are
+            # away: after our move the opponent's winning reply may beat the
+            # close to the server, and the seat is gone by the time we return.
+            if self.rng.random() < args.reconnect_rate:
+                await self.drop_and_reconnect()
+            move = self.pick_move()
+            if move is None:
+                # Board full; the server has no draws.
+                return
+            # Move round trip: sent until the server echoes it.
+            start = time.perf_counter()
+            await self.move(*move)
+            if self.run.measuring():
+                self.run.move_rtts.append(time.perf_counter() - start)
+                self.run.moves += 1
+            if self.rng.random() < args.chat_rate:
+                await self.chat('gg')
+                self.run.chats += 1
+
+    async def drop_and_reconnect(self):
+        start = time.perf_counter()
+        await self.close()
+        await self.connect()
+        await self.reconnect()
+        if self.run.measuring():
+            self.run.reconnect_times.append(time.perf_counter() - start)
+
+    async def watch(self):
+        if self.game_state != 'FINISHED':
+            await self.wait_for('game_over', 'room_closed')
+
+
+async def play_game(run, tag, rng):
+    black = Bot(run, f'bot{tag}b', rng)
+    white = Bot(run, f'bot{tag}w', rng)
+    spectators = [Bot(run, f'bot{tag}s{i}', rng) for i in range(run.args.spectators)]
+    try:
+        await black.connect()
+        room = await black.create_room(f'load {tag}')
+        await white.connect()
+        await white.join(room.room_id)
+        for bot in spectators:
+            await bot.connect()
+            await bot.spectate(room.room_id)
+
+        await asyncio.gather(black.play(), white.play(), *(bot.watch() for bot in spectators))
+        if black.game_state == 'FINISHED' and run.measuring():
+            run.games += 1
+    except (GameError, OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        if run.measuring():
+            run.errors += 1
+            print(f"table {tag}: {e!r}", file=sys.stderr)
+    finally:
+        for bot in [black, white] + spectators:
+            await bot.close()
+
+
+async def table(run, index):
+    rng = random.Random(index)
+    # Spread the initial connections over the ramp-up period.
+    await asyncio.sleep(rng.random() * run.args.ramp)
+    game = 0
+    while run.measuring():
+        await play_game(run, f'{index}-{game}', rng)
+        game += 1
+
+
+def read_proc(pid):
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return int(status['VmRSS'][0]), int(status['VmHWM'][0]), cpu
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+
+
+def latency(values):
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.50),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': percentile(values, 1.0)
+    }
+
+
+async def run_load(args):
+    run = Run(args)
+    pid = args.server_pid
+    start_proc = read_proc(pid) if pid else None
+    start = time.perf_counter()
+    run.deadline = start + args.duration
+
+    tasks = [asyncio.ensure_future(table(run, i)) for i in range(args.tables)]
+    peak_clients = 0
+    rss_samples = []
+    while run.measuring():
+        await asyncio.sleep(min(1, max(0, run.deadline - time.perf_counter())))
+        peak_clients = max(peak_clients, run.clients)
+        if pid:
+            rss_samples.append(read_proc(pid)[0])
+    elapsed = time.perf_counter() - start
+    end_proc = read_proc(pid) if pid else None
+
+    # Whatever is still blocked on the server at the deadline is abandoned.
+    await asyncio.sleep(1)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    result = {
+        'url': args.url,
+        'encoding': args.encoding,
+        'tables': args.tables,
+        'spectators_per_table': args.spectators,
+        'duration_s': round(elapsed, 3),
+        'peak_clients': peak_clients,
+        'games': run.games,
+        'moves': run.moves,
+        'moves_per_s': round(run.moves / elapsed, 1),
+        'chats': run.chats,
+        'messages_sent': run.sent,
+        'messages_received': run.received,
+        'messages_per_s': round((run.sent + run.received) / elapsed, 1),
+        'move_rtt': latency(run.move_rtts),
+        'reconnect': latency(run.reconnect_times),
+        'errors': run.errors
+    }
+    if pid:
+        result['server'] = {
+            'pid': pid,
+            'rss_start_kb': start_proc[0],
+            'rss_end_kb': end_proc[0],
+            'rss_max_sampled_kb': max(rss_samples, default=end_proc[0]),
+            'rss_peak_kb': end_proc[1],
+            'cpu_percent': round((end_proc[2] - start_proc[2]) / elapsed * 100, 1)
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='ws://localhost:8765')
+    parser.add_argument('--tables', type=int, default=100, help='concurrent games')
+    parser.add_argument('--spectators', type=int, default=2, help='spectators per game')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run, including the ramp-up')
+    parser.add_argument('--ramp', type=float, default=2, help='seconds over which tables start')
+    parser.add_argument('--think', type=float, default=0.01, help='seconds before each move')
+    parser.add_argument('--chat-rate', type=float, default=0.05, help='chance of a chat message per move')
+    parser.add_argument('--reconnect-rate', type=float, default=0.002, help='chance of a reconnect per move')
+    parser.add_argument('--script', help='JSON list of [row, col] moves to play before random ones')
+    parser.add_argument('--compact', dest='encoding', action='store_const', const=protocol.COMPACT, default=protocol.JSON)
+    parser.add_argument('--server-pid', type=int, help='report RSS and CPU of this server process')
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args))
+    document = json.dumps(result, indent=2)
+    print(document)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+
+
+if __name__ == '__main__':
+    main()
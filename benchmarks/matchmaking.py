@@ -0,0 +1,98 @@
+"""Quick match with thousands of players queueing at once.
+
+burst:  --queued players join together; times the first MATCH_INTERVAL
+        batch, which pairs almost all of them.
+steady: players then arrive at --rate per second on a simulated clock;
+        reports the CPU time per batch, how long players waited and the
+        rating gap of the pairs made.
+
+Ratings are drawn around 1500 (sd 300).
+
+    python -m benchmarks.matchmaking [--queued 1000 10000 50000] [--rate 500] [--batches 1500]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from matchmaking import MATCH_INTERVAL, Matchmaker
+
+
+class SimulatedLoop(asyncio.SelectorEventLoop):
+    now = 0.0
+
+    def time(self):
+        return self.now
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+async def simulate(loop, queued, rate, batches, rng):
+    waits = []
+    gaps = []
+
+    def on_match(first, second):
+        waits.extend(loop.now - entry['queued_at'] for entry in (first, second))
+        gaps.append(abs(first['rating'] - second['rating']))
+
+    matchmaker = Matchmaker(on_match)
+    arrivals = 0
+
+    def arrive(count):
+        nonlocal arrivals
+        for _ in range(count):
+            matchmaker.enqueue(object(), f'u{arrivals}', 'bot', round(rng.gauss(1500, 300)))
+            arrivals += 1
+
+    arrive(queued)
+    loop.now += MATCH_INTERVAL
+    start = time.process_time()
+    burst_pairs = len(matchmaker.match())
+    burst_time = time.process_time() - start
+
+    waits.clear()
+    gaps.clear()
+    batch_times = []
+    due = 0.0
+    for _ in range(batches):
+        due += rate * MATCH_INTERVAL
+        arrive(int(due))
+        due -= int(due)
+        loop.now += MATCH_INTERVAL
+        start = time.process_time()
+        matchmaker.match()
+        batch_times.append(time.process_time() - start)
+
+    return {
+        'burst_pairs': burst_pairs,
+        'burst_ms': burst_time * 1000,
+        'batch_ms': sum(batch_times) / len(batch_times) * 1000,
+        'waits': waits,
+        'gaps': gaps
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queued', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--rate', type=float, default=500, help='arrivals per second after the burst')
+    parser.add_argument('--batches', type=int, default=1500)
+    args = parser.parse_args()
+
+    for queued in args.queued:
+        loop = SimulatedLoop()
+        asyncio.set_event_loop(loop)
+        result = loop.run_until_complete(simulate(loop, queued, args.rate, args.batches, random.Random(1)))
+        loop.close()
+        waits, gaps = result['waits'], result['gaps']
+        print(f"{queued:6} queued  burst batch {result['burst_ms']:7.2f} ms for {result['burst_pairs']} pairs  "
+              f"steady batch {result['batch_ms']:5.3f} ms  "
+              f"wait p50 {percentile(waits, 0.5):4.1f}s p99 {percentile(waits, 0.99):4.1f}s  "
+              f"gap p50 {percentile(gaps, 0.5):3.0f} p99 {percentile(gaps, 0.99):3.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Memory held per room.
+
+Creates --rooms rooms in server.GAME_ROOMS, a third of each kind: waiting
+with one player, in progress after --moves moves and finished with a five
+after nine moves. Moves go through GameRoom.handle_move with players that
+have no connection, so each room holds what it would on a live server (move
+history, sync events, move timer). Reports the process's resident memory
+per room for the whole mix, and the Python heap per room of each kind
+measured with tracemalloc over --sample rooms.
+
+    python -m benchmarks.memory [--rooms 100000] [--moves 20] [--sample 1000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import tracemalloc
+
+import server
+
+KINDS = ('waiting', 'playing', 'finished')
+# A fixed pattern without five in a row, and a quick win for black.
+DRAW_CELLS = [(r, c) for r in range(15) for c in range(15) if (r // 2 + c) % 4 < 2]
+WIN_CELLS = [(7, 3), (8, 3), (7, 4), (8, 4), (7, 5), (8, 5), (7, 6), (8, 6), (7, 7)]
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def seat(room, user_id, stone):
+    room.players[user_id] = server.Player(user_id, f'Player {user_id}', stone, token=os.urandom(8).hex())
+
+
+async def make_room(i, kind, moves):
+    room_id = f'{i:06x}'
+    room = server.GAME_ROOMS[room_id] = server.GameRoom(room_id, f'Room {i}')
+    seat(room, f'u{2 * i}', 1)
+    if kind == 'waiting':
+        room.broadcast_room_info()
+        return room
+    seat(room, f'u{2 * i + 1}', 2)
+    await room.start_game()
+    cells = WIN_CELLS if kind == 'finished' else DRAW_CELLS[:moves]
+    for r, c in cells:
+        await room.handle_move(room.current_turn_uid, r, c)
+    return room
+
+
+async def measure(rooms, moves, sample):
+    for i in range(2000):
+        await make_room(i, KINDS[i % 3], moves)
+    server.GAME_ROOMS.clear()
+
+    per_kind = {}
+    for k, kind in enumerate(KINDS):
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(sample):
+            await make_room(10**7 * (k + 1) + i, kind, moves)
+        gc.collect()
+        per_kind[kind] = (tracemalloc.get_traced_memory()[0] - before) / sample
+        tracemalloc.stop()
+    server.GAME_ROOMS.clear()
+    gc.collect()
+
+    before = rss()
+    for i in range(rooms):
+        await make_room(i, KINDS[i % 3], moves)
+    gc.collect()
+    total = (rss() - before) / rooms
+    assert sum(room.game_state == 'FINISHED' for room in server.GAME_ROOMS.values()) == rooms // 3
+    for room in server.GAME_ROOMS.values():
+        room.cancel_move_timer()
+    return total, per_kind
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=100000)
+    parser.add_argument('--moves', type=int, default=20)
+    parser.add_argument('--sample', type=int, default=1000)
+    args = parser.parse_args()
+
+    total, per_kind = asyncio.run(measure(args.rooms, args.moves, args.sample))
+    for kind in KINDS:
+        print(f"{kind:8} {per_kind[kind]:8.0f} bytes/room (python heap)")
+    print(f"all      {total:8.0f} bytes/room resident over {args.rooms} rooms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Instrumentation overhead on the move path.
+
+Feeds move frames to server.handle_frame, the path every frame a client
+sends takes (decode, dispatch, GameRoom.handle_move), with server.METRICS
+unset (the default) and enabled, and reports the cost per move of each.
+Players have no connection, so only the server's own work is timed.
+
+    python -m benchmarks.metrics [--moves 200000]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import server
+
+
+async def play(moves):
+    room = server.GAME_ROOMS['bench'] = server.GameRoom('bench', 'bench')
+    # Stand-ins for the players' websockets; nothing is sent to them.
+    sockets = {}
+    for user_id, stone in (('a', 1), ('b', 2)):
+        room.players[user_id] = server.Player(user_id, user_id, stone)
+        sockets[user_id] = object()
+        server.ALL_CLIENTS[sockets[user_id]] = {'room_id': 'bench', 'user_id': user_id}
+    room.game_state = 'IN_PROGRESS'
+    room.current_turn_uid = 'a'
+    # A fixed pattern that fills the board without five in a row.
+    cells = [(r, c) for r in range(15) for c in range(15) if (r // 2 + c) % 4 < 2]
+    frames = [json.dumps({'type': 'move', 'move': {'r': r, 'c': c}}) for r, c in cells]
+
+    start = time.perf_counter()
+    for i in range(moves):
+        if i % len(frames) == 0:
+            room.board = room.rule.new_board()
+            room.current_turn_uid = 'a'
+        await server.handle_frame(sockets[room.current_turn_uid], frames[i % len(frames)])
+    elapsed = time.perf_counter() - start
+    room.cancel_move_timer()
+    server.GAME_ROOMS.clear()
+    server.ALL_CLIENTS.clear()
+    assert room.game_state == 'IN_PROGRESS', 'the pattern produced a win'
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--moves', type=int, default=200000)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ('disabled', 'enabled', 'disabled', 'enabled'):
+        server.METRICS = None
+        if mode == 'enabled':
+            server.enable_metrics()
+        elapsed = asyncio.run(play(args.moves))
+        results[mode] = min(results.get(mode, elapsed), elapsed)
+    for mode, elapsed in results.items():
+        print(f"metrics {mode:8} {elapsed / args.moves * 1e6:6.2f} us/move")
+    print(f"overhead {(results['enabled'] - results['disabled']) / args.moves * 1e6:6.2f} us/move when enabled")
+
+
+if __name__ == '__main__':
+    main()
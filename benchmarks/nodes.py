@@ -0,0 +1,216 @@
+"""Several server.py instances on one machine, linked by broker.py.
+
+Starts the broker and --nodes servers with --broker, then checks that they
+behave as one server:
+
+- a room created on the first node is listed by the lobby of every node
+- a player joining it through another node is redirected to the first
+- spectators on every node see every move, the game_state and game_over,
+  and spectator chat sent from any node, and finish with the players' board
+- the room's spectator count includes the spectators on other nodes
+- when the first node is killed, the other nodes drop its room and close
+  it for their spectators
+
+and reports how long after the players each spectator saw the moves.
+
+    python -m benchmarks.nodes [--nodes 3] [--games 3] [--spectators 2]
+"""
+import argparse
+import asyncio
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from gameclient import GameClient
+
+BROKER_PORT = 8780
+TIMEOUT = 10
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+def start(*command):
+    return subprocess.Popen([sys.executable, *command], stdout=subprocess.DEVNULL)
+
+
+def wait_listening(port):
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def eventually(check, what):
+    deadline = time.monotonic() + TIMEOUT
+    while not check():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.02)
+
+
+async def listed(client, room_id):
+    rooms = (await client.list_rooms()).rooms
+    return next((room for room in rooms if room['room_id'] == room_id), None)
+
+
+async def until_listed(client, room_id, check, what):
+    # Lobby changes reach other nodes within a lobby update interval or so.
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        info = await listed(client, room_id)
+        if check(info):
+            return
+        if time.monotonic() > deadline:
+            raise AssertionError(f"{what}: {info}")
+        await asyncio.sleep(0.05)
+
+
+async def play_game(urls, game, spectators_per_node, rng, seen, lobbies):
+    # One game: black on the first node, white through the last (and
+    # redirected), spectators on every node.
+    black = await GameClient(urls[0], f'black{game}').connect()
+    white = await GameClient(urls[-1], f'white{game}').connect()
+    room_id = (await black.create_room(f'nodes-{game}')).room_id
+
+    for node, lobby in enumerate(lobbies):
+        await until_listed(lobby, room_id, bool, f"room {room_id} missing from node {node}'s lobby")
+
+    await white.join(room_id)
+    assert white.ws.remote_address[1] == int(urls[0].rsplit(':', 1)[1]), "the joining player was not redirected"
+
+    def on_event(client, event):
+        now = time.perf_counter()
+        events = event.events if event.type == 'sync' else [event.data] if event.type == 'move' else []
+        for move in events:
+            if move['type'] == 'move':
+                seen.setdefault((game, move['seq']), []).append((client.node, now))
+
+    spectators = []
+    for node, url in enumerate(urls):
+        for i in range(spectators_per_node):
+            spectator = GameClient(url, f'spec{game}-{node}-{i}', on_event=on_event)
+            spectator.node = node
+            await spectator.connect()
+            await spectator.spectate(room_id)
+            spectators.append(spectator)
+
+    expected = len(spectators)
+    await eventually(lambda: all(s.game_state == 'IN_PROGRESS' for s in spectators), 'spectators to see the game start')
+    for node, lobby in enumerate(lobbies):
+        await until_listed(lobby, room_id, lambda info: info and info['spectator_count'] == expected,
+                           f"node {node} does not list {expected} spectators")
+
+    # Spectator chat from the last node reaches the spectators of every node.
+    chat = f'hello from node {len(urls) - 1}'
+    waits = [s.wait_for('spectator_chat', check=lambda e: e.message == chat, timeout=TIMEOUT) for s in spectators]
+    await spectators[-1].spectator_chat(chat)
+    await asyncio.gather(*waits)
+
+    cells = [(r, c) for r in range(15) for c in range(15)]
+    rng.shuffle(cells)
+    sent = {}
+    player, other = (black, white) if black.current_turn == black.user_id else (white, black)
+    while await player.wait_turn(timeout=TIMEOUT):
+        r, c = cells.pop()
+        started = time.perf_counter()
+        echo = await player.move(r, c)
+        if echo.type == 'move':
+            sent[(game, echo.seq)] = started
+        player, other = other, player
+    await eventually(lambda: black.game_state == white.game_state == 'FINISHED', 'the game to end for both players')
+
+    await eventually(lambda: all(s.game_state == 'FINISHED' for s in spectators), 'spectators to see game_over')
+    for s in spectators:
+        assert s.board == black.board, f"spectator on node {s.node} ended with a different board"
+    for client in spectators + [black, white]:
+        await client.close()
+    return sent, room_id
+
+
+async def kill_owner(owner, urls, room_id, lobbies):
+    # Spectators on the other nodes of a room of the killed node.
+    watchers = []
+    for node, url in enumerate(urls[1:], 1):
+        await until_listed(lobbies[node], room_id, bool, f"room {room_id} missing from node {node}'s lobby")
+        watcher = await GameClient(url, f'watcher{node}').connect()
+        await watcher.spectate(room_id)
+        watchers.append(watcher)
+    closed = [w.wait_for('room_closed', timeout=TIMEOUT) for w in watchers]
+    owner.kill()
+    owner.wait()
+    await asyncio.gather(*closed)
+    for node, lobby in enumerate(lobbies[1:], 1):
+        await until_listed(lobby, room_id, lambda info: info is None, f"node {node} still lists the dead node's room")
+    for watcher in watchers:
+        await watcher.close()
+
+
+async def run(urls, nodes, args):
+    rng = random.Random(1)
+    lobbies = [await GameClient(url, f'lobby{node}').connect() for node, url in enumerate(urls)]
+    seen = {}
+    sent = {}
+    for game in range(args.games):
+        game_sent, _ = await play_game(urls, game, args.spectators, rng, seen, lobbies)
+        sent.update(game_sent)
+        print(f"game {game}: {len(game_sent)} moves seen by {args.spectators * len(urls)} spectators on {len(urls)} nodes")
+
+    lags = {}
+    for key, started in sent.items():
+        for node, at in seen.get(key, ()):
+            lags.setdefault(node, []).append(at - started)
+    for node in sorted(lags):
+        where = 'owner' if node == 0 else 'remote'
+        print(f"  spectators on node {node} ({where:6}) lag p50 {percentile(lags[node], 0.5) * 1000:6.1f} ms "
+              f"p99 {percentile(lags[node], 0.99) * 1000:6.1f} ms")
+
+    # A room left waiting on the first node, watched from the others.
+    host = await GameClient(urls[0], 'host').connect()
+    room_id = (await host.create_room('doomed')).room_id
+    await kill_owner(nodes[0], urls, room_id, lobbies)
+    print(f"node 0 killed: its room was closed for spectators on the other {len(urls) - 1} node(s) and dropped from their lobbies")
+    await host.close()
+    for lobby in lobbies:
+        await lobby.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--games', type=int, default=3)
+    parser.add_argument('--spectators', type=int, default=2, help='spectators per node per game')
+    args = parser.parse_args()
+    assert args.nodes >= 2, "needs at least two nodes"
+
+    broker = start('broker.py', '--port', str(BROKER_PORT))
+    nodes = []
+    try:
+        wait_listening(BROKER_PORT)
+        ports = [BROKER_PORT + 1 + i for i in range(args.nodes)]
+        for port in ports:
+            nodes.append(start('server.py', '--port', str(port), '--broker', f'localhost:{BROKER_PORT}'))
+        for port in ports:
+            wait_listening(port)
+        # Let every node connect to the broker and say hello.
+        time.sleep(0.5)
+        asyncio.run(run([f'ws://localhost:{port}' for port in ports], nodes, args))
+        print("ok")
+    finally:
+        for process in nodes + [broker]:
+            process.terminate()
+        for process in nodes + [broker]:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
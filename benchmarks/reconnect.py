@@ -0,0 +1,102 @@
+"""Reconnect storm: 10,000 disconnected players across 5,000 rooms.
+
+Every player reconnects without a room_id at once, as after a server blip.
+Compares the user-to-room session index with the old linear scan of
+GAME_ROOMS, then runs the full handle_reconnection path for every user.
+
+    python -m benchmarks.reconnect [--rooms 5000]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import server
+
+
+class FakeConnection:
+    subprotocol = None
+    transport = None
+    remote_address = ('127.0.0.1', 0)
+
+    async def send(self, frame):
+        pass
+
+
+def legacy_find_room_by_user_id(user_id):
+    for room_id, room in server.GAME_ROOMS.items():
+        if user_id in room.players:
+            player = room.players[user_id]
+            if room.game_state == 'IN_PROGRESS' and (player.ws is None or player.reconnect_timer):
+                return room_id, room
+            elif player.token:
+                return room_id, room
+    return None, None
+
+
+async def populate(rooms):
+    users = []
+    for i in range(rooms):
+        room_id = f'r{i:05}'
+        room = server.GameRoom(room_id, f'Room {i}')
+        server.GAME_ROOMS[room_id] = room
+        for seat in range(2):
+            ws = FakeConnection()
+            user_id = f'u{i:05}_{seat}'
+            server.ALL_CLIENTS[ws] = {'room_id': None, 'user_id': None}
+            server.set_client_room(ws, room_id, user_id)
+            await room.add_player(ws, user_id, user_id)
+            users.append(user_id)
+    for room in server.GAME_ROOMS.values():
+        for user_id in list(room.players):
+            await room.handle_client_disconnect(room.players[user_id].ws, user_id)
+    return users
+
+
+async def run(args):
+    # The server logs every join, disconnect and reconnect; keep it off the
+    # benchmark output.
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        users = await populate(args.rooms)
+    print(f"{len(users)} disconnected players in {len(server.GAME_ROOMS)} rooms "
+          f"(setup {time.perf_counter() - start:.2f}s)")
+
+    for name, find in (('legacy scan', legacy_find_room_by_user_id), ('session index', server.find_room_by_user_id)):
+        sample = users if name != 'legacy scan' else users[::args.legacy_stride]
+        start = time.perf_counter()
+        for user_id in sample:
+            room_id, room = find(user_id)
+            assert room is not None and user_id in room.players
+        elapsed = time.perf_counter() - start
+        print(f"{name:14} {len(sample):6} lookups in {elapsed:.3f}s -> "
+              f"{elapsed / len(sample) * 1e6:9.2f} us/lookup, {elapsed / len(sample) * len(users):.2f}s for all users")
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for user_id in users:
+            ws = FakeConnection()
+            server.ALL_CLIENTS[ws] = {'room_id': None, 'user_id': None}
+            room_id, room = server.find_room_by_user_id(user_id)
+            server.set_client_room(ws, room_id, user_id)
+            await room.handle_reconnection(ws, user_id)
+    elapsed = time.perf_counter() - start
+    reconnected = sum(1 for room in server.GAME_ROOMS.values() for p in room.players.values() if p.ws)
+    print(f"full reconnect {reconnected} players in {elapsed:.3f}s -> {len(users) / elapsed:.0f} reconnects/s")
+
+    for room in server.GAME_ROOMS.values():
+        room.cancel_move_timer()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=5000)
+    parser.add_argument('--legacy-stride', type=int, default=10,
+                        help='only time every Nth user with the linear scan')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
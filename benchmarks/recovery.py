@@ -0,0 +1,120 @@
+"""Crash recovery time for a journal holding 100,000 moves.
+
+Writes a journal of games in progress, then times server.recover_rooms
+replaying it from scratch and again from a snapshot taken after the last
+event, and checks both rebuild the same boards.
+
+    python -m benchmarks.recovery [--moves 100000] [--games 1000]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import server
+from board import Board
+from journal import Journal
+
+
+def write_journal(path, moves, games, rng):
+    # Random games, each stopped before it is won so every room is still in
+    # progress when the server "crashes".
+    events = []
+    boards = {}
+    for i in range(games):
+        room_id = f'r{i:05}'
+        boards[room_id] = [Board(), 1]
+        events.append({'e': 'create', 'room_id': room_id, 'name': room_id})
+        for seat in ('a', 'b'):
+            user_id = f'{seat}{i}'
+            events.append({'e': 'join', 'room_id': room_id, 'user_id': user_id, 'user_name': user_id, 'token': user_id})
+
+    room_ids = list(boards)
+    written = 0
+    while written < moves:
+        room_id = rng.choice(room_ids)
+        board, stone = boards[room_id]
+        r, c = rng.randrange(board.size), rng.randrange(board.size)
+        if not board.is_empty(r, c):
+            continue
+        board.place(r, c, stone)
+        if board.check_win(r, c, stone):
+            # Take the winning stone back and try another cell.
+            bit = 1 << (r * board.stride + c)
+            if stone == 1:
+                board.black ^= bit
+            else:
+                board.white ^= bit
+            board.stones -= 1
+            continue
+        boards[room_id][1] = 3 - stone
+        events.append({'e': 'move', 'room_id': room_id, 'r': r, 'c': c})
+        written += 1
+
+    journal = Journal(path)
+    with open(path, 'w') as f:
+        journal._file = f
+        journal._write(events, None)
+    return {room_id: (board.black, board.white) for room_id, (board, stone) in boards.items()}
+
+
+async def recover(path):
+    server.GAME_ROOMS.clear()
+    server.USER_SESSIONS.clear()
+    server.TOKEN_SESSIONS.clear()
+    journal = Journal(path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.recover_rooms(journal)
+    elapsed = time.perf_counter() - start
+    for room in server.GAME_ROOMS.values():
+        for player in room.players.values():
+            if player.reconnect_timer:
+                player.reconnect_timer.cancel()
+        room.cancel_move_timer()
+    return elapsed
+
+
+def check(expected):
+    actual = {room_id: (room.board.black, room.board.white) for room_id, room in server.GAME_ROOMS.items()}
+    assert actual == expected, 'recovered boards differ from the games written'
+
+
+async def run(moves, games):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'games.journal')
+        expected = write_journal(path, moves, games, rng)
+        size = os.path.getsize(path)
+
+        elapsed = await recover(path)
+        check(expected)
+        print(f"journal only      {elapsed * 1000:8.1f} ms  ({size / 1e6:.1f} MB, {moves / elapsed:,.0f} moves/s)")
+
+        # What the writer does every JOURNAL_COMPACT_RECORDS records.
+        journal = Journal(path, server.journal_snapshot)
+        journal._file = open(path, 'a')
+        journal._write([], server.journal_snapshot())
+        journal._file.close()
+        size = os.path.getsize(path + '.snapshot')
+
+        elapsed = await recover(path)
+        check(expected)
+        print(f"snapshot + empty  {elapsed * 1000:8.1f} ms  ({size / 1e6:.1f} MB snapshot)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--moves', type=int, default=100000)
+    parser.add_argument('--games', type=int, default=1000)
+    args = parser.parse_args()
+    print(f"{args.moves} moves across {args.games} games in progress")
+    asyncio.run(run(args.moves, args.games))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""list_rooms with 10,000 rooms.
+
+full:    the old reply, every room's info in one room_list message.
+cold:    one page from directory.RoomDirectory, cache dropped before each query.
+cached:  the same page served from the pre-encoded page cache.
+churn:   one room changes between queries, as in a busy lobby.
+
+Also pages through every filter and checks the result against a plain scan.
+
+    python -m benchmarks.rooms [--rooms 10000] [--queries 2000]
+"""
+import argparse
+import json
+import random
+import time
+
+import protocol
+from directory import ROOM_STATES, RoomDirectory
+
+
+class FakeRoom:
+    def __init__(self, room_id, rng):
+        self.room_id = room_id
+        self.info = {}
+        self.shuffle(rng)
+
+    def shuffle(self, rng):
+        state = rng.choice(ROOM_STATES)
+        players = 2 if state == 'IN_PROGRESS' else rng.randint(0, 2 if state == 'FINISHED' else 1)
+        self.info = {
+            'room_id': self.room_id,
+            'name': rng.choice(['casual', 'ranked', 'friends', 'open']) + f' {rng.randrange(100)}',
+            'player_count': players,
+            'spectator_count': rng.randrange(5),
+            'player_names': [f'p{i}' for i in range(players)],
+            'game_state': state
+        }
+
+    def get_room_info(self):
+        return dict(self.info)
+
+
+def expected(rooms, state, free_seat, prefix):
+    return sorted(room.room_id for room in rooms.values()
+                  if (state is None or room.info['game_state'] == state)
+                  and (not free_seat or room.info['player_count'] < 2)
+                  and room.info['name'].startswith(prefix))
+
+
+def walk(directory, state, free_seat, prefix):
+    ids, cursor = [], None
+    while True:
+        page = json.loads(directory.page(state, free_seat, prefix, cursor, 37))
+        ids.extend(room['room_id'] for room in page['rooms'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def timed(queries, query):
+    start = time.perf_counter()
+    for i in range(queries):
+        query(i)
+    return (time.perf_counter() - start) / queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    directory = RoomDirectory(protocol.encode)
+    rooms = {}
+    for i in range(args.rooms):
+        room = FakeRoom(f'{rng.getrandbits(32):08x}', rng)
+        rooms[room.room_id] = room
+        directory.room_changed(room)
+    room_list = list(rooms.values())
+
+    # Correctness, including after changes that land inside cached pages.
+    for round in range(3):
+        for state in (None,) + ROOM_STATES:
+            for free_seat in (False, True):
+                for prefix in ('', 'ranked 1'):
+                    assert walk(directory, state, free_seat, prefix) == expected(rooms, state, free_seat, prefix)
+        for room in rng.sample(room_list, 200):
+            room.shuffle(rng)
+            directory.room_changed(room)
+        for room in rng.sample(room_list, 50):
+            del rooms[room.room_id]
+            room_list.remove(room)
+            directory.room_removed(room.room_id)
+
+    def full(i):
+        protocol.encode({'type': 'room_list', 'rooms': [room.get_room_info() for room in room_list]})
+
+    def cold(i):
+        directory._pages.clear()
+        directory.page('WAITING', True)
+
+    def cached(i):
+        directory.page('WAITING', True)
+
+    def churn(i):
+        room = room_list[i % len(room_list)]
+        room.shuffle(rng)
+        directory.room_changed(room)
+        directory.page('WAITING', True)
+
+    size = len(protocol.encode({'type': 'room_list', 'rooms': [room.get_room_info() for room in room_list]}))
+    page_size = len(directory.page('WAITING', True))
+    print(f"{len(room_list)} rooms, full list {size / 1e6:.2f} MB, one page {page_size / 1e3:.1f} kB")
+    for name, query in (('full', full), ('cold', cold), ('cached', cached), ('churn', churn)):
+        queries = max(1, args.queries // 100) if name == 'full' else args.queries
+        print(f"{name:7} {timed(queries, query) * 1e6:10.1f} us/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Compare the cost per move of each rule against today's Board.check_win.
+
+Plays the same random games on 15x15 and 19x19 boards with:
+
+- check_win: Board.check_win called directly, as handle_move did before
+  rules existed
+- freestyle, exact, renju: through the room's rule object, as handle_move
+  does now; renju also asks forbidden() before every black move and skips
+  forbidden cells (its time includes classifying each line shape the first
+  time it is seen)
+
+Exact five is checked against a plain walk along each line, and the renju
+restrictions against a few known positions, before timing.
+
+    python -m benchmarks.rules [--games 1000]
+"""
+import argparse
+import random
+import time
+
+from board import Board
+from rules import RULES, _SHAPES
+
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def walk_exact_win(rows, r, c, stone):
+    size = len(rows)
+    for dr, dc in DIRECTIONS:
+        count = 1
+        for sign in (1, -1):
+            nr, nc = r + sign * dr, c + sign * dc
+            while 0 <= nr < size and 0 <= nc < size and rows[nr][nc] == stone:
+                count += 1
+                nr, nc = nr + sign * dr, nc + sign * dc
+        if count == 5:
+            return True
+    return False
+
+
+def random_games(count, size, seed=1):
+    rng = random.Random(seed)
+    cells = [(r, c) for r in range(size) for c in range(size)]
+    games = []
+    for _ in range(count):
+        order = cells[:]
+        rng.shuffle(order)
+        games.append(order)
+    return games
+
+
+def verify_exact(games, size):
+    for order in games:
+        board = Board(size)
+        rows = [[0] * size for _ in range(size)]
+        stone = 1
+        for r, c in order:
+            board.place(r, c, stone)
+            rows[r][c] = stone
+            won = board.check_exact_win(r, c, stone)
+            assert bool(won) == walk_exact_win(rows, r, c, stone), (order, r, c)
+            if won:
+                assert len(won) == 5
+                break
+            stone = 3 - stone
+
+
+def verify_renju():
+    renju = RULES['renju']
+    # (black stones, white stones, black's move, expected)
+    cases = [
+        ([(7, 5), (7, 6), (5, 7), (6, 7)], [], (7, 7), 'double three'),
+        ([(7, 5), (7, 6), (5, 7), (6, 7)], [(7, 4), (7, 8)], (7, 7), None),
+        ([(7, 4), (7, 5), (7, 6), (4, 7), (5, 7), (6, 7)], [], (7, 7), 'double four'),
+        ([(7, 4), (7, 5), (7, 6), (5, 7), (6, 7)], [], (7, 7), None),
+        ([(7, 1), (7, 3), (7, 5), (7, 7)], [], (7, 4), 'double four'),
+        ([(7, 2), (7, 3), (7, 4), (7, 6), (7, 7)], [], (7, 5), 'overline'),
+        ([(7, 3), (7, 4), (7, 5), (7, 6), (4, 4), (5, 5), (6, 6)], [], (7, 7), None),
+        ([(0, 1), (0, 2), (1, 0), (2, 0)], [], (0, 0), None),
+    ]
+    for black, white, (r, c), expected in cases:
+        board = renju.new_board()
+        for r0, c0 in black:
+            board.place(r0, c0, 1)
+        for r0, c0 in white:
+            board.place(r0, c0, 2)
+        assert renju.forbidden(board, r, c, 1) == expected, (black, white, expected)
+
+
+def run_check_win(games, size):
+    moves = 0
+    for order in games:
+        board = Board(size)
+        stone = 1
+        for r, c in order:
+            board.place(r, c, stone)
+            moves += 1
+            if board.check_win(r, c, stone):
+                break
+            stone = 3 - stone
+    return moves
+
+
+def run_rule(rule):
+    def run(games, size):
+        moves = 0
+        for order in games:
+            board = rule.new_board(size)
+            stone = 1
+            for r, c in order:
+                if rule.restricts_moves and rule.forbidden(board, r, c, stone):
+                    continue
+                board.place(r, c, stone)
+                moves += 1
+                if rule.check_win(board, r, c, stone):
+                    break
+                stone = 3 - stone
+        return moves
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1000)
+    args = parser.parse_args()
+
+    verify_renju()
+    for size in (15, 19):
+        verify_exact(random_games(100, size, seed=2), size)
+
+    runs = [('check_win', run_check_win)] + [(name, run_rule(rule)) for name, rule in RULES.items()]
+    for size in (15, 19):
+        games = random_games(args.games, size)
+        print(f"{size}x{size}")
+        for name, run in runs:
+            start = time.perf_counter()
+            moves = run(games, size)
+            elapsed = time.perf_counter() - start
+            print(f"  {name:10} {moves:7} moves {elapsed / moves * 1e6:6.2f} us/move")
+    print(f"renju line shapes classified: {len(_SHAPES)}")
+
+
+if __name__ == '__main__':
+    main()
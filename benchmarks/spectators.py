@@ -0,0 +1,146 @@
+"""Player latency in a room with a large audience.
+
+For each --delays value, starts server.py with that --spectator-delay, seats
+two players and connects --spectators spectators from a separate process.
+The players then alternate --moves moves, --pace seconds apart. Reports the players' round trip
+(one player sends a move until the other sees it), how long after the move
+the spectators saw it, frames per spectator per move and the server's CPU
+time. A delay of 0 writes spectators in the same pass as the players.
+
+    python -m benchmarks.spectators [--spectators 2000] [--moves 200] [--pace 0.02] [--delays 0 0.1]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+PORT = 8790
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def next_message(ws, *types, **fields):
+    while True:
+        message = json.loads(await ws.recv())
+        if message['type'] in types and all(message.get(k) == v for k, v in fields.items()):
+            return message
+
+
+async def watch(url, room_id, count, conn):
+    seen = {}
+    frames = 0
+
+    async def spectator(i):
+        ws = await websockets.connect(url, max_queue=None)
+        await ws.send(json.dumps({'type': 'spectate_room', 'room_id': room_id, 'user_id': f's{i}', 'user_name': f's{i}'}))
+        await next_message(ws, 'game_state')
+        return ws
+
+    async def read(ws):
+        nonlocal frames
+        async for frame in ws:
+            now = time.time()
+            frames += 1
+            message = json.loads(frame)
+            events = message['events'] if message['type'] == 'sync' else [message]
+            for event in events:
+                if event['type'] == 'move':
+                    seen.setdefault(event['seq'], []).append(now)
+
+    connections = []
+    for start in range(0, count, 200):
+        connections += await asyncio.gather(*(spectator(i) for i in range(start, min(count, start + 200))))
+    readers = [asyncio.ensure_future(read(ws)) for ws in connections]
+    conn.send('ready')
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    for ws in connections:
+        await ws.close()
+    await asyncio.gather(*readers, return_exceptions=True)
+    conn.send((seen, frames))
+
+
+def run_spectators(url, room_id, count, conn):
+    asyncio.run(watch(url, room_id, count, conn))
+
+
+async def play(url, spectators, moves, pace, server_pid):
+    black = await websockets.connect(url)
+    white = await websockets.connect(url)
+    await black.send(json.dumps({'type': 'create_room', 'name': 'featured', 'user_id': 'black', 'user_name': 'Black'}))
+    room_id = (await next_message(black, 'join_success'))['room_id']
+    await white.send(json.dumps({'type': 'join_room', 'room_id': room_id, 'user_id': 'white', 'user_name': 'White'}))
+    await next_message(white, 'game_state')
+
+    conn, child_conn = multiprocessing.get_context('spawn').Pipe()
+    process = multiprocessing.get_context('spawn').Process(target=run_spectators, args=(url, room_id, spectators, child_conn))
+    process.start()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, conn.recv)
+
+    # A pattern that never makes five in a row.
+    cells = [(r, c) for r in range(15) for c in range(15) if (r // 2 + c) % 4 < 2][:moves]
+    sent = {}
+    rtts = []
+    cpu = cpu_seconds(server_pid)
+    for i, (r, c) in enumerate(cells):
+        mover, other = (black, white) if i % 2 == 0 else (white, black)
+        started = time.perf_counter()
+        sent_at = time.time()
+        await mover.send(json.dumps({'type': 'move', 'move': {'r': r, 'c': c}}))
+        # Both players see every move; wait for this one on the other side.
+        message = await next_message(other, 'move', r=r, c=c)
+        rtts.append(time.perf_counter() - started)
+        sent[message['seq']] = sent_at
+        await asyncio.sleep(pace)
+    cpu = cpu_seconds(server_pid) - cpu
+    await asyncio.sleep(1)
+
+    conn.send('done')
+    seen, frames = await loop.run_in_executor(None, conn.recv)
+    process.join()
+    for ws in (black, white):
+        await ws.close()
+    lags = [t - sent[seq] for seq, times in seen.items() if seq in sent for t in times]
+    return rtts, lags, frames / spectators / len(cells), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spectators', type=int, default=2000)
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--pace', type=float, default=0.02, help='seconds between moves')
+    parser.add_argument('--delays', type=float, nargs='+', default=[0, 0.1])
+    args = parser.parse_args()
+
+    url = f'ws://localhost:{PORT}'
+    for delay in args.delays:
+        server = subprocess.Popen([sys.executable, 'server.py', '--port', str(PORT), '--spectator-delay', str(delay)],
+                                  stdout=subprocess.DEVNULL)
+        try:
+            time.sleep(1)
+            rtts, lags, frames, cpu = asyncio.run(play(url, args.spectators, args.moves, args.pace, server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"delay {delay:4}s  player rtt p50 {percentile(rtts, 0.5) * 1000:6.2f} ms p99 {percentile(rtts, 0.99) * 1000:6.2f} ms  "
+              f"spectator lag p50 {percentile(lags, 0.5) * 1000:6.1f} ms p99 {percentile(lags, 0.99) * 1000:6.1f} ms  "
+              f"{frames:4.2f} frames/spectator/move  server cpu {cpu:5.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Event loop wakeups with 10,000 active move timers.
+
+legacy:    one task per room sleeping one second at a time (the old
+           move_timer_logic), cancelled and recreated on every move.
+scheduler: server.Scheduler owning every move deadline, re-armed on every move.
+clocks:    per-player game clocks (clock.TimeControl, 300+5): each move is
+           charged from timestamps, re-arms the flag timer and builds both
+           clocks for the turn_change; nothing runs between moves.
+
+Each room makes a move every few seconds. Reports event loop iterations and
+timer callbacks per second, and the CPU spent.
+
+    python -m benchmarks.timers [--rooms 10000] [--seconds 10]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from clock import TimeControl
+from scheduler import Scheduler
+
+MOVE_TIMER_DURATION = 30
+
+
+class CountingLoop(asyncio.SelectorEventLoop):
+    iterations = 0
+
+    def _run_once(self):
+        self.iterations += 1
+        super()._run_once()
+
+
+class LegacyRoom:
+    wakeups = 0
+
+    def __init__(self):
+        self.task = None
+
+    async def move_timer_logic(self):
+        try:
+            for i in range(MOVE_TIMER_DURATION, -1, -1):
+                LegacyRoom.wakeups += 1
+                await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            pass
+
+    def on_move(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = asyncio.ensure_future(self.move_timer_logic())
+
+
+class WheelRoom:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.timer = None
+
+    def expired(self):
+        self.timer = None
+
+    def on_move(self):
+        if self.timer:
+            self.timer.cancel()
+        self.timer = self.scheduler.call_later(MOVE_TIMER_DURATION, self.expired)
+
+
+class ClockRoom:
+    control = TimeControl('300+5')
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.timer = None
+        self.clocks = [self.control.new_clock(), self.control.new_clock()]
+        self.turn = 0
+        self.turn_started = time.monotonic()
+
+    def flag_fell(self):
+        self.timer = None
+
+    def on_move(self):
+        now = time.monotonic()
+        if self.timer:
+            self.timer.cancel()
+            self.clocks[self.turn] = self.control.charge(self.clocks[self.turn], now - self.turn_started) or self.control.new_clock()
+            self.turn = 1 - self.turn
+        self.turn_started = now
+        self.views = [self.control.view(clock) for clock in self.clocks]
+        self.timer = self.scheduler.call_later(self.control.left(self.clocks[self.turn]), self.flag_fell)
+
+
+async def drive(rooms, seconds, rng):
+    # Moves arrive at random, on average one per room every few seconds.
+    for room in rooms:
+        room.on_move()
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    moves = 0
+    while loop.time() < end:
+        await asyncio.sleep(0.01)
+        for room in rng.sample(rooms, max(1, len(rooms) // 500)):
+            room.on_move()
+            moves += 1
+    return moves
+
+
+def run(mode, rooms, seconds):
+    loop = CountingLoop()
+    asyncio.set_event_loop(loop)
+    scheduler = Scheduler()
+    if mode == 'legacy':
+        room_list = [LegacyRoom() for _ in range(rooms)]
+    elif mode == 'clocks':
+        room_list = [ClockRoom(scheduler) for _ in range(rooms)]
+    else:
+        room_list = [WheelRoom(scheduler) for _ in range(rooms)]
+
+    cpu = time.process_time()
+    moves = loop.run_until_complete(drive(room_list, seconds, random.Random(1)))
+    cpu = time.process_time() - cpu
+    iterations = loop.iterations
+    for room in room_list:
+        if mode == 'legacy' and room.task:
+            room.task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+
+    if mode == 'legacy':
+        callbacks = LegacyRoom.wakeups
+    else:
+        callbacks = scheduler.wakeups
+    print(f"{mode:9} {moves / seconds:8.0f} moves/s  {iterations / seconds:8.0f} loop iterations/s  "
+          f"{callbacks / seconds:8.0f} timer wakeups/s  cpu {cpu / seconds:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    print(f"{args.rooms} rooms with an active move timer, {args.seconds:.0f}s per mode")
+    for mode in ('legacy', 'scheduler', 'clocks'):
+        run(mode, args.rooms, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
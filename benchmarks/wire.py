@@ -0,0 +1,78 @@
+"""Bandwidth and CPU cost of the JSON and compact wire encodings.
+
+Replays the server messages of a full game as seen by one spectator and
+reports total bytes and encode/decode time for each encoding.
+
+    python -m benchmarks.wire
+"""
+import random
+import time
+
+import protocol
+from board import Board
+
+
+def game_messages(seed=7):
+    rng = random.Random(seed)
+    board = Board()
+    players = {'player123': 'Alice', 'player456': 'Bob'}
+    uids = list(players)
+    seq = 0
+    messages = []
+
+    def snapshot(state, turn):
+        return {'type': 'game_state', 'board': board.to_rows(), 'current_turn': turn,
+                'game_state': state, 'players': players, 'win_line': [], 'seq': seq}
+
+    messages.append(snapshot('IN_PROGRESS', uids[0]))
+    cells = [(r, c) for r in range(15) for c in range(15)]
+    rng.shuffle(cells)
+    for i, (r, c) in enumerate(cells[:120]):
+        stone = 1 + i % 2
+        board.place(r, c, stone)
+        seq += 1
+        messages.append({'type': 'move', 'player_id': uids[i % 2], 'r': r, 'c': c, 'stone': stone, 'seq': seq})
+        seq += 1
+        messages.append({'type': 'turn_change', 'current_turn': uids[(i + 1) % 2], 'seq': seq})
+        if i % 10 == 0:
+            messages.append({'type': 'chat', 'sender': 'Alice', 'message': 'good move'})
+    messages.append(snapshot('FINISHED', None))
+    return messages
+
+
+def measure(messages, encoding, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        frames = [protocol.encode(m, encoding) for m in messages]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            protocol.decode(frame)
+    decode_time = time.perf_counter() - start
+
+    size = sum(len(f.encode() if isinstance(f, str) else f) for f in frames)
+    return size, encode_time / rounds, decode_time / rounds
+
+
+def main():
+    messages = game_messages()
+    rounds = 200
+    baseline = None
+    print(f"{len(messages)} messages per game (one spectator)")
+    for encoding in (protocol.JSON, protocol.COMPACT):
+        size, enc, dec = measure(messages, encoding, rounds)
+        baseline = baseline or size
+        print(f"{encoding:15} {size:7} bytes ({size / baseline:5.1%})  "
+              f"encode {enc * 1e3:6.3f} ms  decode {dec * 1e3:6.3f} ms per game")
+
+    moves = [m for m in messages if m['type'] in ('move', 'turn_change')]
+    for encoding in (protocol.JSON, protocol.COMPACT):
+        size, enc, dec = measure(moves, encoding, rounds)
+        print(f"  move/turn only {encoding:15} {size / len(moves):5.1f} bytes/msg  "
+              f"{enc / len(moves) * 1e6:5.2f} us encode  {dec / len(moves) * 1e6:5.2f} us decode")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+BOARD_SIZE = 15
+MIN_BOARD_SIZE = 9
+MAX_BOARD_SIZE = 25
+WIN_LENGTH = 5
+# Boards that keep cells (see Board.line) can read this many cells each
+# side of a point along any direction.
+LINE_REACH = 5
+# Off the board, in cells.
+BLOCKED = 3
+
+# Each stone colour is kept as one integer bitboard. Rows are laid out with a
+# stride of size + 1 so the spare column acts as a guard bit: horizontal and
+# diagonal shifts can never wrap a run from one row into the next.
+_WINDOW_MASKS = {}
+
+
+def _window_masks(size):
+    masks = _WINDOW_MASKS.get(size)
+    if masks is not None:
+        return masks
+
+    stride = size + 1
+    shifts = (1, stride, stride + 1, stride - 1)
+    masks = []
+    for r in range(size):
+        for c in range(size):
+            idx = r * stride + c
+            per_direction = []
+            for d in shifts:
+                mask = 0
+                for k in range(WIN_LENGTH):
+                    start = idx - k * d
+                    if start >= 0:
+                        mask |= 1 << start
+                per_direction.append(mask)
+            masks.append(tuple(per_direction))
+        masks.append(None)
+    _WINDOW_MASKS[size] = masks
+    return masks
+
+
+_BLANK_CELLS = {}
+
+
+def _blank_cells(size):
+    # The playable cells empty, everything around them BLOCKED: the guard
+    # column and a margin of LINE_REACH rows and columns.
+    cells = _BLANK_CELLS.get(size)
+    if cells is None:
+        stride = size + 1
+        margin = LINE_REACH * (stride + 1)
+        cells = bytearray([BLOCKED]) * (2 * margin + size * stride)
+        for r in range(size):
+            start = margin + r * stride
+            cells[start:start + size] = bytes(size)
+        cells = _BLANK_CELLS[size] = bytes(cells)
+    return cells
+
+
+class Board:
+    __slots__ = ('size', 'stride', 'black', 'white', 'stones', 'cells', '_masks', '_shifts')
+
+    def __init__(self, size=BOARD_SIZE, cells=False):
+        self.size = size
+        self.stride = size + 1
+        self.black = 0
+        self.white = 0
+        self.stones = 0
+        # With cells=True the board also keeps one byte per cell (0, 1, 2 or
+        # BLOCKED) in the bitboard layout plus a margin, so that line() is
+        # a single slice. Only rules that look at whole lines need it.
+        self.cells = bytearray(_blank_cells(size)) if cells else None
+        self._masks = _window_masks(size)
+        self._shifts = (1, self.stride, self.stride + 1, self.stride - 1)
+
+    @property
+    def shifts(self):
+        # Bit distance between neighbours along a row, a column and the two
+        # diagonals.
+        return self._shifts
+
+    def load(self, black, white):
+        self.black, self.white = black, white
+        self.stones = bin(black | white).count('1')
+        if self.cells is not None:
+            self.cells[:] = _blank_cells(self.size)
+            margin = LINE_REACH * (self.stride + 1)
+            for stone, bits in ((1, black), (2, white)):
+                while bits:
+                    low = bits & -bits
+                    self.cells[margin + low.bit_length() - 1] = stone
+                    bits ^= low
+
+    def in_bounds(self, r, c):
+        return 0 <= r < self.size and 0 <= c < self.size
+
+    def get(self, r, c):
+        bit = 1 << (r * self.stride + c)
+        if self.black & bit:
+            return 1
+        if self.white & bit:
+            return 2
+        return 0
+
+    def is_empty(self, r, c):
+        return not (self.black | self.white) >> (r * self.stride + c) & 1
+
+    def place(self, r, c, stone):
+        bit = 1 << (r * self.stride + c)
+        if stone == 1:
+            self.black |= bit
+        else:
+            self.white |= bit
+        self.stones += 1
+        if self.cells is not None:
+            self.cells[LINE_REACH * (self.stride + 1) + r * self.stride + c] = stone
+
+    def line(self, r, c, d):
+        # The 2 * LINE_REACH + 1 cells centred on (r, c) along shift d
+        # (one of shifts), as bytes. Needs cells=True.
+        i = LINE_REACH * (self.stride + 1) + r * self.stride + c
+        return bytes(self.cells[i - LINE_REACH * d:i + LINE_REACH * d + 1:d])
+
+    def check_win(self, r, c, stone):
+        bits = self.black if stone == 1 else self.white
+        idx = r * self.stride + c
+        masks = self._masks[idx]
+
+        for i, d in enumerate(self._shifts):
+            runs = bits & (bits >> d)
+            runs &= runs >> (2 * d)
+            runs &= bits >> (4 * d)
+            if runs & masks[i]:
+                return self._line(bits, r, c, d)
+        return None
+
+    def check_exact_win(self, r, c, stone):
+        # Like check_win, but only exactly five in a row counts: a run of
+        # five is kept only if the cells just before and after it are not
+        # the same colour, so overlines never win.
+        bits = self.black if stone == 1 else self.white
+        idx = r * self.stride + c
+        masks = self._masks[idx]
+
+        for i, d in enumerate(self._shifts):
+            runs = bits & (bits >> d)
+            runs &= runs >> (2 * d)
+            runs &= bits >> (4 * d)
+            runs &= ~(bits << d | bits >> (5 * d))
+            if runs & masks[i]:
+                return self._line(bits, r, c, d)
+        return None
+
+    def _line(self, bits, r, c, d):
+        # Same ordering as the original walk: the placed stone, up to four
+        # stones forward, then up to four stones backward.
+        stride = self.stride
+        idx = r * stride + c
+        line = [(r, c)]
+        for sign in (1, -1):
+            for k in range(1, WIN_LENGTH):
+                n = idx + sign * k * d
+                if n < 0 or not (bits >> n) & 1:
+                    break
+                line.append(divmod(n, stride))
+        return line
+
+    def to_rows(self):
+        black, white, stride = self.black, self.white, self.stride
+        rows = []
+        for r in range(self.size):
+            row = []
+            for c in range(self.size):
+                n = r * stride + c
+                if (black >> n) & 1:
+                    row.append(1)
+                elif (white >> n) & 1:
+                    row.append(2)
+                else:
+                    row.append(0)
+            rows.append(row)
+        return rows
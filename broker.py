@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import struct
+
+# Frames in both directions: op, channel length, payload length, then the
+# channel and the payload. The broker never looks inside payloads.
+HEADER = struct.Struct('!BHI')
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+PUBLISH = 3
+# A frame the broker publishes for a connection once it has gone, so the
+# others learn that its node is down.
+WILL = 4
+MAX_PAYLOAD = 1024 * 1024
+# A subscriber with more than this waiting to be written is disconnected
+# rather than buffered for without limit; its node reconnects and
+# fetches what it needs again.
+SUBSCRIBER_BUFFER_LIMIT = 4 * 1024 * 1024
+
+
+def frame(op, channel, payload=b''):
+    return HEADER.pack(op, len(channel), len(payload)) + channel + payload
+
+
+async def read_frame(reader):
+    op, channel_length, payload_length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if payload_length > MAX_PAYLOAD:
+        raise ConnectionError(f"frame of {payload_length} bytes")
+    body = await reader.readexactly(channel_length + payload_length)
+    return op, body[:channel_length], body[channel_length:]
+
+
+class Broker:
+    # Channel -> subscribed connections. A published frame goes as it came
+    # to every subscriber of its channel except the publisher, in the order
+    # each publisher sent them.
+    def __init__(self, buffer_limit=SUBSCRIBER_BUFFER_LIMIT):
+        self.buffer_limit = buffer_limit
+        self.channels = {}
+
+    def publish(self, channel, data, sender=None):
+        for writer in self.channels.get(channel, ()):
+            if writer is sender or writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() > self.buffer_limit:
+                print(f"Dropping slow subscriber {writer.get_extra_info('peername')}")
+                writer.close()
+                continue
+            writer.write(data)
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        will = None
+        try:
+            while True:
+                op, channel, payload = await read_frame(reader)
+                if op == PUBLISH:
+                    self.publish(channel, frame(PUBLISH, channel, payload), writer)
+                elif op == SUBSCRIBE:
+                    self.channels.setdefault(channel, set()).add(writer)
+                    subscribed.add(channel)
+                elif op == UNSUBSCRIBE:
+                    self.unsubscribe(channel, writer)
+                    subscribed.discard(channel)
+                elif op == WILL:
+                    will = (channel, frame(PUBLISH, channel, payload))
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error):
+            pass
+        finally:
+            for channel in subscribed:
+                self.unsubscribe(channel, writer)
+            writer.close()
+            if will:
+                self.publish(*will)
+
+    def unsubscribe(self, channel, writer):
+        writers = self.channels.get(channel)
+        if writers:
+            writers.discard(writer)
+            if not writers:
+                del self.channels[channel]
+
+
+async def serve(host, port, buffer_limit):
+    broker = Broker(buffer_limit)
+    server = await asyncio.start_server(broker.handle, host, port)
+    print(f"Broker listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pub/sub broker linking Gomoku servers started with --broker')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--buffer-limit', type=int, default=SUBSCRIBER_BUFFER_LIMIT, metavar='BYTES',
+                        help='disconnect a subscriber with more than this waiting to be sent (default %(default)s)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.buffer_limit))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
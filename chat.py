@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+CHAT_RATE = 1.0
+CHAT_BURST = 5
+CHAT_BATCH_INTERVAL = 0.05
+
+
+class ChatLimiter:
+    # One token bucket per sender: up to burst messages at once, refilled at
+    # rate messages per second. A bucket is a [tokens, last update] pair.
+    # Buckets that have filled up again hold no information and are dropped
+    # once per refill period, so the table only holds recent senders.
+    def __init__(self, rate=CHAT_RATE, burst=CHAT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self._pruned = time.monotonic()
+
+    def allow(self, key, now=None):
+        if now is None:
+            now = time.monotonic()
+        if now - self._pruned > self.burst / self.rate:
+            self.prune(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def prune(self, now):
+        self._pruned = now
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+
+
+class ChatBatcher:
+    # Chat for a room arriving within interval of the first queued message
+    # goes out together as one chat_batch frame; a message on its own is
+    # sent as it is. Player chat and spectator chat are queued apart since
+    # they go to different audiences: send(room, kind, message) delivers a
+    # flushed message, kind being 'chat' or 'spectator_chat'.
+    def __init__(self, send, interval=CHAT_BATCH_INTERVAL):
+        self.send = send
+        self.interval = interval
+        self._pending = {}
+        self._flush_handle = None
+
+    def push(self, room, message):
+        if not self.interval:
+            self.send(room, message['type'], message)
+            return
+        key = (room, message['type'])
+        queue = self._pending.get(key)
+        if queue is None:
+            queue = self._pending[key] = []
+        queue.append(message)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.interval, self.flush)
+
+    def flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        for (room, kind), messages in pending.items():
+            if len(messages) == 1:
+                self.send(room, kind, messages[0])
+            else:
+                self.send(room, kind, {'type': 'chat_batch', 'messages': messages})
@@ -1,403 +1,543 @@
 import asyncio
-import json
 import websockets
 import sys
+import time
 
-STATE = {
-    'room_id': None,
-    'user_id': None,
-    'user_name': None,
-    'token': None,
-    'is_player': False,
-    'is_spectator': False,
-    'my_stone': 0,
-    'board': [],
-    'current_turn': None,
-    'game_state': 'LOBBY'
+import protocol
+from board import BOARD_SIZE
+from clock import TIME_CONTROL_PATTERN, clock_text
+from gameclient import GameClient, GameError
+from rules import DEFAULT_RULE, OPENINGS, RULES
+from terminal import STONE_CHARS, Screen, stdin_lines
+
+# Filters accepted by the 'list' command.
+LIST_FILTERS = {
+    'waiting': {'game_state': 'WAITING'},
+    'playing': {'game_state': 'IN_PROGRESS'},
+    'finished': {'game_state': 'FINISHED'},
+    'open': {'free_seat': True}
 }
 
+# Wire encoding requested from the server; pass --compact for binary frames.
+ENCODING = protocol.COMPACT if '--compact' in sys.argv[1:] else protocol.JSON
+# With --tui the board stays on screen and only changed cells are redrawn.
+SCREEN = Screen(sys.stdout) if '--tui' in sys.argv[1:] else None
+
+def say(*args, **kwargs):
+    # All output goes through here: printed, or added to the message log
+    # of the full-screen view with --tui.
+    if SCREEN:
+        SCREEN.log(" ".join(str(arg) for arg in args))
+    else:
+        print(*args, **kwargs)
+
 def print_board(board):
     if not board:
         return
-        
-    print("\n   " + " ".join([f"{i:2}" for i in range(15)]))
-    print("  +" + "--"*15 + "-")
+    # Built as one string so the board is a single write.
+    size = len(board)
+    lines = ["", "   " + " ".join(f"{i:2}" for i in range(size)), "  +" + "--" * size + "-"]
     for r_idx, row in enumerate(board):
-        print(f"{r_idx:2}|", end=" ")
-        for cell in row:
-            if cell == 1:
-                char = 'B'
-            elif cell == 2:
-                char = 'W'
-            else:
-                char = '.'
-            print(f"{char} ", end="")
-        print()
-    print()
+        lines.append(f"{r_idx:2}| " + "".join(f"{STONE_CHARS[cell]} " for cell in row))
+    print("\n".join(lines) + "\n")
+
+def show_board(client):
+    if SCREEN:
+        SCREEN.board(client.board)
+    else:
+        print_board(client.board)
+
+def status_line(client):
+    parts = [f"{client.user_name} ({client.user_id})"]
+    if client.room_id:
+        parts.append(f"Room {client.room_id}")
+    if client.board and client.players:
+        parts.append(" vs ".join(client.players.values()))
+    parts.append(client.game_state)
+    if client.game_state == 'IN_PROGRESS' and client.current_turn:
+        parts.append(f"To move: {client.players.get(client.current_turn, client.current_turn)}")
+    if client.clocks:
+        parts.append(" ".join(f"{client.players.get(uid, uid)} {format_clock(client.clock(uid))}" for uid in client.clocks))
+    if client.rtt is not None:
+        parts.append(f"{client.rtt} ms")
+    return "  |  ".join(parts)
+
+def list_query(args):
+    query = {}
+    if args and args[0] in LIST_FILTERS:
+        query.update(LIST_FILTERS[args[0]])
+        args = args[1:]
+    if args:
+        query['prefix'] = " ".join(args)
+    return query
+
+def format_clock(clock):
+    periods = f" +{clock['periods']}" if clock['periods'] else ""
+    return clock_text(clock['time'] / 1000) + periods
+
+def room_options(args):
+    # 'create <name> [size] [rule] [opening] [time]': the trailing words
+    # that are a board size, a rule, an opening or a time control are
+    # options, the rest the name.
+    options = {}
+    while args:
+        word = args[-1]
+        if word.isdigit() and 'size' not in options:
+            options['size'] = int(word)
+        elif word in RULES and 'rule' not in options:
+            options['rule'] = word
+        elif word in OPENINGS and 'opening' not in options:
+            options['opening'] = word
+        elif TIME_CONTROL_PATTERN.match(word) and 'time_control' not in options:
+            options['time_control'] = word
+        else:
+            break
+        args = args[:-1]
+    return " ".join(args), options
+
+def room_variant(room):
+    # How a room differs from a standard freestyle 15x15 game, if at all.
+    parts = []
+    if room.get('size', BOARD_SIZE) != BOARD_SIZE:
+        parts.append(f"{room['size']}x{room['size']}")
+    if room.get('rule', DEFAULT_RULE) != DEFAULT_RULE:
+        parts.append(room['rule'])
+    if room.get('opening'):
+        parts.append(room['opening'])
+    if room.get('time_control'):
+        parts.append(room['time_control'])
+    return f" [{' '.join(parts)}]" if parts else ""
 
-def display_prompt():
-    if STATE['game_state'] == 'LOBBY':
+def opening_hint(client):
+    # What the swap2 opening is waiting for, or None.
+    if not client.phase or client.game_state != 'IN_PROGRESS':
+        return None
+    name = "You" if client.my_turn else client.players.get(client.current_turn, client.current_turn)
+    if client.phase == 'place3':
+        return f"Opening: {name} place(s) three stones (black, white, black) with 'move <r> <c>'."
+    if client.phase == 'place2':
+        return f"Opening: {name} place(s) two more stones (white, black) with 'move <r> <c>'."
+    if not client.my_turn:
+        return f"Opening: {name} is choosing a colour."
+    if client.phase == 'choose':
+        return "Opening: type 'choose black', 'choose white' or 'choose place2' (place two more stones and let your opponent choose)."
+    return "Opening: type 'choose black' or 'choose white'. White moves next."
+
+def display_prompt(client):
+    if client.game_state == 'LOBBY':
         prompt = "[Lobby] > "
-    elif STATE['game_state'] == 'WAITING':
-        prompt = f"[Room: {STATE['room_id']} - Waiting] > "
-    elif STATE['game_state'] == 'IN_PROGRESS':
-        if STATE['is_player'] and STATE['current_turn'] == STATE['user_id']:
+    elif client.game_state == 'WAITING':
+        prompt = f"[Room: {client.room_id} - Waiting] > "
+    elif client.game_state == 'IN_PROGRESS':
+        if client.my_turn:
             prompt = "[Your Turn] > "
         else:
-            prompt = f"[Game: {STATE['room_id']}] > "
-    elif STATE['game_state'] == 'FINISHED':
-        prompt = f"[Game Over: {STATE['room_id']}] > "
+            prompt = f"[Game: {client.room_id}] > "
+    elif client.game_state == 'FINISHED':
+        prompt = f"[Game Over: {client.room_id}] > "
+    elif client.game_state == 'REPLAY':
+        prompt = f"[Replay: {client.room_id}] > "
     else:
         prompt = "> "
-        
-    print(f"\n{prompt}", end="")
-    sys.stdout.flush()
 
-async def listen_to_server(ws):
-    async for message in ws:
-        try:
-            data = json.loads(message)
-            msg_type = data.get('type')
-
-            if msg_type == 'room_list':
-                print("\n[Available Rooms]")
-                if not data['rooms']:
-                    print("  No rooms available. Type 'create <room_name>' to start.")
-                for room in data['rooms']:
-                    print(f"  - {room['name']} ({room['room_id']}) [{room['player_count']}/2 Players, {room['spectator_count']} Specs] ({room['game_state']})")
-            
-            elif msg_type == 'room_update':
-                room = data['room']
-                print(f"\n[Room Update] {room['name']} ({room['room_id']}) [{room['player_count']}/2 Players, {room['spectator_count']} Specs] ({room['game_state']})")
-
-            elif msg_type == 'room_removed':
-                print(f"\n[Room Removed] Room {data['room_id']} has been closed.")
-
-            elif msg_type == 'join_success':
-                STATE['room_id'] = data['room_id']
-                STATE['token'] = data['token']
-                STATE['is_player'] = True
-                STATE['is_spectator'] = False
-                STATE['my_stone'] = data['your_stone']
-                STATE['game_state'] = 'WAITING'
-                stone_name = 'Black (B)' if STATE['my_stone'] == 1 else 'White (W)'
-                print(f"\nJoined room {data['room_id']}. You are {stone_name}.")
-                print("Waiting for another player...")
-            
-            elif msg_type == 'spectate_success':
-                STATE['room_id'] = data['room_id']
-                STATE['is_player'] = False
-                STATE['is_spectator'] = True
-                STATE['game_state'] = 'SPECTATING'
-                print(f"\nSpectating room {data['room_id']}.")
-
-            elif msg_type == 'reconnect_success':
-                if STATE.get('room_id') != data['room_id']:
-                    STATE['room_id'] = data['room_id']
-                    STATE['is_player'] = True
-                    STATE['is_spectator'] = False
-                    STATE['my_stone'] = data['your_stone']
-                    print(f"\nReconnected successfully to room {data['room_id']}.")
-
-            elif msg_type == 'game_state':
-                STATE['board'] = data['board']
-                STATE['current_turn'] = data['current_turn']
-                STATE['game_state'] = data['game_state']
-                print("\n--- Game State Update ---")
-                player_names = " vs ".join(data['players'].values())
-                print(f"Players: {player_names}")
-                print_board(STATE['board'])
-                if data['game_state'] == 'IN_PROGRESS':
-                    turn_player_name = data['players'].get(data['current_turn'], 'Unknown')
-                    print(f"Current Turn: {turn_player_name}")
-
-            elif msg_type == 'move':
-                r, c, stone = data['r'], data['c'], data['stone']
-                STATE['board'][r][c] = stone
-                stone_char = 'B' if stone == 1 else 'W'
-                print(f"\n[Move] Player ({stone_char}) placed at ({r}, {c})")
-                print_board(STATE['board'])
-            
-            elif msg_type == 'turn_change':
-                STATE['current_turn'] = data['current_turn']
-                if STATE['is_player'] and STATE['current_turn'] == STATE['user_id']:
-                    print("\n*** It's YOUR turn! ***")
-                else:
-                    print(f"\nTurn changed. Waiting for other player...")
-                if STATE['board']:
-                    print_board(STATE['board'])
-            
-            elif msg_type == 'timer_notification':
-                if STATE['game_state'] == 'IN_PROGRESS':
-                    player_name = data.get('player_name', 'Player')
-                    time_left = data['time_left']
-                    if STATE['is_player'] and data['player'] == STATE['user_id']:
-                        print(f"\n[Timer] {time_left} seconds remaining for your turn!")
-                    else:
-                        print(f"\n[Timer] {player_name} has {time_left} seconds remaining.")
-
-            elif msg_type == 'game_over':
-                print(f"\n--- GAME OVER ---")
-                print(f"Winner: {data['winner_name']}")
-                print("\nReturning to lobby...")
-                STATE['game_state'] = 'LOBBY'
-                STATE['room_id'] = None
-                STATE['is_player'] = False
-                STATE['is_spectator'] = False
-                STATE['board'] = []
-                STATE['current_turn'] = None
-                STATE['my_stone'] = 0
-                print("You are now in the lobby. Type 'list' to see available rooms or 'help' for commands.")
-
-            elif msg_type == 'chat':
-                print(f"\n[Player Chat] {data['sender']}: {data['message']}")
-            
-            elif msg_type == 'spectator_chat':
-                print(f"\n[Spectator Chat] {data['sender']}: {data['message']}")
-
-            elif msg_type == 'error':
-                print(f"\n[Server Error] {data['message']}")
-                if 'reconnection' in data['message']:
-                    STATE['token'] = None
+    if SCREEN:
+        SCREEN.status(status_line(client))
+        SCREEN.prompt(prompt)
+    else:
+        print(f"\n{prompt}", end="")
+        sys.stdout.flush()
+
+async def show(client, event):
+    # Called by the client for every message after it has updated its state.
+    try:
+        msg_type = event.type
+
+        if msg_type == 'room_list':
+            say("\n[Available Rooms]")
+            if not event.rooms:
+                say("  No rooms available. Type 'create <room_name>' to start.")
+            for room in event.rooms:
+                say(f"  - {room['name']} ({room['room_id']}){room_variant(room)} [{room['player_count']}/2 Players, {room['spectator_count']} Specs] ({room['game_state']})")
+            if client.next_cursor:
+                say("  Type 'next' for more rooms.")
 
+        elif msg_type == 'room_update':
+            for room in event.rooms:
+                say(f"\n[Room Update] {room['name']} ({room['room_id']}){room_variant(room)} [{room['player_count']}/2 Players, {room['spectator_count']} Specs] ({room['game_state']})")
+            for room_id in event.removed:
+                say(f"\n[Room Removed] Room {room_id} has been closed.")
+
+        elif msg_type == 'join_success':
+            stone_name = 'Black (B)' if client.stone == 1 else 'White (W)'
+            say(f"\nJoined room {event.room_id}. You are {stone_name}.")
+            say("Waiting for another player...")
+
+        elif msg_type == 'spectate_success':
+            say(f"\nSpectating room {event.room_id}.")
+
+        elif msg_type == 'reconnect_success':
+            say(f"\nReconnected successfully to room {event.room_id}.")
+
+        elif msg_type == 'game_state':
+            say("\n--- Game State Update ---")
+            player_names = " vs ".join(event.players.values())
+            say(f"Players: {player_names}")
+            show_board(client)
+            if event.game_state == 'IN_PROGRESS':
+                turn_player_name = event.players.get(event.current_turn, 'Unknown')
+                say(f"Current Turn: {turn_player_name}")
+                if event.data.get('rule', DEFAULT_RULE) != DEFAULT_RULE:
+                    say(f"Rule: {event.rule}")
+                if client.time_control:
+                    say(f"Time control: {event.time_control}")
+                if client.is_player and not client.phase:
+                    say(f"You are {'Black (B)' if client.stone == 1 else 'White (W)'}.")
+            if opening_hint(client):
+                say(opening_hint(client))
+
+        elif msg_type == 'sync':
+            say(f"\n[Sync] Caught up to move sequence {client.seq}.")
+            show_board(client)
+
+        elif msg_type == 'move':
+            stone_char = 'B' if event.stone == 1 else 'W'
+            say(f"\n[Move] Player ({stone_char}) placed at ({event.r}, {event.c})")
+            show_board(client)
+
+        elif msg_type == 'turn_change':
+            if client.my_turn:
+                say("\n*** It's YOUR turn! ***")
             else:
-                print(f"\n[Server] {data}")
+                say(f"\nTurn changed. Waiting for other player...")
+            if event.data.get('clocks'):
+                say("Clocks: " + ", ".join(f"{client.players.get(uid, uid)} {format_clock(clock)}"
+                                           for uid, clock in event.clocks.items()))
+            if client.board:
+                show_board(client)
 
-        except Exception as e:
-            print(f"\nError processing message: {e}")
-            print(f"Raw message: {message}")
-            
-        display_prompt()
+        elif msg_type == 'timer_notification':
+            if client.game_state == 'IN_PROGRESS':
+                player_name = event.data.get('player_name', 'Player')
+                if client.is_player and event.player == client.user_id:
+                    say(f"\n[Timer] {event.time_left} seconds remaining for your turn!")
+                else:
+                    say(f"\n[Timer] {player_name} has {event.time_left} seconds remaining.")
+
+        elif msg_type == 'game_over':
+            say(f"\n--- GAME OVER ---")
+            say(f"Winner: {event.winner_name}")
+            say("\nReturning to lobby...")
+            await client.leave()
+            say("You are now in the lobby. Type 'list' to see available rooms or 'help' for commands.")
+
+        elif msg_type == 'room_closed':
+            say(f"\n[Room {event.room_id} was closed after a period of inactivity. You are back in the lobby.]")
+
+        elif msg_type == 'game_list':
+            say("\n[Archived Games]")
+            if not event.games:
+                say("  No games found.")
+            for game in event.games:
+                ended = time.strftime('%Y-%m-%d %H:%M', time.localtime(game['ended']))
+                winner = game['black_name'] if game['winner'] == game['black'] else game['white_name']
+                say(f"  #{game['id']} {game['black_name']} vs {game['white_name']} ({game['move_count']} moves, winner {winner}) {ended}")
+            if event.games:
+                say("  Type 'replay <id> [speed]' to watch one.")
+
+        elif msg_type == 'replay_start':
+            say(f"\n--- Replay of game #{event.game_id}: {' vs '.join(event.players.values())}, {event.moves} moves at {event.speed}x ---")
+            say("Type 'stop' to return to the lobby.")
+
+        elif msg_type == 'replay_end':
+            if not event.data.get('stopped'):
+                say(f"\n--- End of replay. Winner: {event.winner_name} ---")
+
+        elif msg_type == 'match_queued':
+            say(f"\n[Quick Match] Searching for an opponent (rating {event.rating}, {event.queued} in queue). Type 'cancel' to stop.")
+
+        elif msg_type == 'match_cancelled':
+            say("\n[Quick Match] Search cancelled.")
+
+        elif msg_type == 'rating_update':
+            rating = event.ratings.get(client.user_id)
+            if rating is not None:
+                say(f"\n[Rating] Your rating is now {rating}.")
+
+        elif msg_type == 'chat':
+            say(f"\n[Player Chat] {event.sender}: {event.message}")
+
+        elif msg_type == 'spectator_chat':
+            say(f"\n[Spectator Chat] {event.sender}: {event.message}")
+
+        elif msg_type == 'chat_batch':
+            for chat in event.messages:
+                label = 'Spectator Chat' if chat['type'] == 'spectator_chat' else 'Player Chat'
+                say(f"\n[{label}] {chat['sender']}: {chat['message']}")
+
+        elif msg_type == 'redirect':
+            say(f"\n[Redirect] Room is served by {event.url}, switched connection.")
+
+        elif msg_type == 'error':
+            say(f"\n[Server Error] {event.message}")
 
-async def handle_user_input(ws):
+        elif msg_type == 'ping':
+            # Only the status line shows the round trip; no new prompt.
+            if SCREEN:
+                SCREEN.status(status_line(client))
+            return
+
+        else:
+            say(f"\n[Server] {event.data}")
+
+    except websockets.exceptions.ConnectionClosed:
+        raise
+    except Exception as e:
+        say(f"\nError processing message: {e}")
+        say(f"Raw message: {event.data}")
+
+    display_prompt(client)
+
+async def handle_user_input(client, stdin):
     loop = asyncio.get_event_loop()
-    
+
     while True:
         try:
-            message = await loop.run_in_executor(None, sys.stdin.readline)
+            if stdin is not None:
+                message = await stdin.get()
+            else:
+                message = await loop.run_in_executor(None, sys.stdin.readline)
+            if message == '':
+                raise EOFError
+            if SCREEN:
+                SCREEN.entered()
             message = message.strip().lower()
-            
+
             if not message:
                 continue
 
             parts = message.split(' ')
             cmd = parts[0]
-            payload = {}
-            
+
             if cmd == 'help':
-                print("\n--- Commands ---")
-                print("  help         : Show this message")
-                print("  list         : List available rooms")
-                print("  create <name>: Create a new room")
-                print("  join <id>    : Join a room as a player")
-                print("  spectate <id>: Spectate a room")
-                print("  reconnect    : Reconnect to your active game session (User ID based)")
-                print("  move <r> <c> : Place your stone at (row, col)")
-                print("  chat <msg>   : Send a message to players/spectators")
-                print("  schat <msg>  : (Spectators Only) Send a message to spectators")
-                print("  board        : Show the board")
-                print("  exit         : Exit the game")
-                display_prompt()
+                say("\n--- Commands ---")
+                say("  help         : Show this message")
+                say("  list [waiting|playing|finished|open] [prefix]")
+                say("               : List rooms, optionally filtered by state, free seat or name prefix")
+                say("  next         : Show the next page of the last list")
+                say("  create <name> [size] [freestyle|exact|renju] [swap2] [time]")
+                say("               : Create a new room, optionally with a board size (9-25), rule, opening and")
+                say("                 clocks: 300+5 is 5 minutes each plus 5 s a move, 600+3x30 is 10 minutes")
+                say("                 then three 30 s byoyomi periods")
+                say("  bot <name>   : Create a room and play against the server's bot")
+                say("  quick        : Find an opponent with a similar rating")
+                say("  cancel       : Stop searching for an opponent")
+                say("  games [user] : List archived games, optionally only those of a user ID")
+                say("  replay <id> [speed]: Watch an archived game (speed 0.25-64, default 1)")
+                say("  join <id>    : Join a room as a player")
+                say("  spectate <id>: Spectate a room")
+                say("  reconnect    : Reconnect to your active game session (User ID based)")
+                say("  move <r> <c> : Place your stone at (row, col)")
+                say("  choose <black|white|place2>: Pick your colour in a swap2 opening")
+                say("  chat <msg>   : Send a message to players/spectators")
+                say("  schat <msg>  : (Spectators Only) Send a message to spectators")
+                say("  board        : Show the board")
+                say("  exit         : Exit the game")
+                display_prompt(client)
                 continue
-            
+
             if cmd == 'exit':
-                print("Disconnecting...")
-                await ws.close()
-                break
+                say("Disconnecting...")
+                await client.close()
+                return
 
-            if STATE['game_state'] == 'LOBBY':
-                if cmd == 'list':
-                    payload = {'type': 'list_rooms'}
-                elif cmd == 'create' and len(parts) > 1:
-                    payload = {'type': 'create_room', 'name': " ".join(parts[1:]), 'user_id': STATE['user_id'], 'user_name': STATE['user_name']}
-                elif cmd == 'join' and len(parts) > 1:
-                    payload = {'type': 'join_room', 'room_id': parts[1], 'user_id': STATE['user_id'], 'user_name': STATE['user_name']}
-                elif cmd == 'spectate' and len(parts) > 1:
-                    payload = {'type': 'spectate_room', 'room_id': parts[1], 'user_id': STATE['user_id'], 'user_name': STATE['user_name']}
-                elif cmd == 'reconnect':
-                    payload = {
-                        'type': 'reconnect',
-                        'user_id': STATE['user_id']
-                    }
-                    if STATE.get('room_id'):
-                        payload['room_id'] = STATE['room_id']
-                    if STATE.get('token'):
-                        payload['token'] = STATE['token']
-                else:
-                    print("Invalid lobby command. Type 'help'.")
-                    display_prompt()
-                    continue
-
-            elif STATE['is_player']:
-                if cmd == 'move' and len(parts) == 3:
-                    payload = {'type': 'move', 'move': {'r': parts[1], 'c': parts[2]}}
-                elif cmd == 'chat':
-                    payload = {'type': 'chat', 'message': " ".join(parts[1:])}
-                elif cmd == 'board':
-                    print_board(STATE['board'])
-                    display_prompt()
-                    continue
-                else:
-                    print("Invalid player command. Type 'help'.")
-                    display_prompt()
-                    continue
-            
-            elif STATE['is_spectator']:
-                if cmd == 'chat':
-                    if len(parts) < 2:
-                        print("Usage: chat <message>")
-                        display_prompt()
-                        continue
-                    payload = {'type': 'chat', 'message': " ".join(parts[1:])}
-                elif cmd == 'schat':
-                    if len(parts) < 2:
-                        print("Usage: schat <message>")
-                        display_prompt()
-                        continue
-                    payload = {'type': 'spectator_chat', 'message': " ".join(parts[1:])}
-                elif cmd == 'board':
-                    print_board(STATE['board'])
-                    display_prompt()
-                    continue
-                else:
-                    print("Invalid spectator command. Type 'help'.")
-                    display_prompt()
-                    continue
+            try:
+                if not await run_command(client, cmd, parts):
+                    display_prompt(client)
+            except GameError as e:
+                say(f"\n[Error] {e}")
+                display_prompt(client)
+            except asyncio.TimeoutError:
+                say("\nNo reply from the server.")
+                display_prompt(client)
 
-            if payload:
-                await ws.send(json.dumps(payload))
-                
+        except websockets.exceptions.ConnectionClosed:
+            return
         except (KeyboardInterrupt, EOFError):
-            print("Disconnecting...")
-            await ws.close()
-            break
+            say("Disconnecting...")
+            await client.close()
+            return
         except Exception as e:
-            print(f"Error reading input: {e}")
-            await ws.close()
-            break
+            say(f"Error reading input: {e}")
+            await client.close()
+            return
 
-async def attempt_reconnection(uri):
-    print(f"Attempting to reconnect as {STATE['user_id']}...")
-    ws = None
-    try:
-        ws = await websockets.connect(uri)
-        
-        payload = {
-            'type': 'reconnect',
-            'user_id': STATE['user_id']
-        }
-        if STATE.get('room_id'):
-            payload['room_id'] = STATE['room_id']
-        if STATE.get('token'):
-            payload['token'] = STATE['token']
-        
-        await ws.send(json.dumps(payload))
-        
-        response_str = await ws.recv()
-        response = json.loads(response_str)
-        
-        if response.get('type') == 'reconnect_success':
-            STATE['room_id'] = response['room_id']
-            STATE['is_player'] = True
-            STATE['is_spectator'] = False
-            STATE['my_stone'] = response['your_stone']
-            print(f"Reconnection successful! Reconnected to room {response['room_id']}.")
-            
-            try:
-                game_state_str = await asyncio.wait_for(ws.recv(), timeout=2.0)
-                game_state_data = json.loads(game_state_str)
-                if game_state_data.get('type') == 'game_state':
-                    STATE['board'] = game_state_data['board']
-                    STATE['current_turn'] = game_state_data['current_turn']
-                    STATE['game_state'] = game_state_data['game_state']
-                    print("\n--- Game State Restored ---")
-                    player_names = " vs ".join(game_state_data['players'].values())
-                    print(f"Players: {player_names}")
-                    print_board(STATE['board'])
-                    if game_state_data['game_state'] == 'IN_PROGRESS':
-                        turn_player_name = game_state_data['players'].get(game_state_data['current_turn'], 'Unknown')
-                        print(f"Current Turn: {turn_player_name}")
-            except asyncio.TimeoutError:
-                pass
-            except Exception as e:
-                print(f"Warning: Could not receive game state: {e}")
-            
-            return ws
+async def run_command(client, cmd, parts):
+    # Returns True if the server will answer with a message (which shows
+    # the prompt again), False if the command was handled locally.
+    if client.game_state == 'LOBBY':
+        if cmd == 'list':
+            await client.list_rooms(**list_query(parts[1:]))
+        elif cmd == 'next':
+            if await client.next_rooms() is None:
+                say("No more rooms. Type 'list' to start over.")
+                return False
+        elif cmd == 'create' and len(parts) > 1:
+            name, options = room_options(parts[1:])
+            await client.create_room(name or 'New Room', **options)
+        elif cmd == 'bot':
+            await client.create_room(" ".join(parts[1:]) or 'Bot game', bot=True)
+        elif cmd == 'join' and len(parts) > 1:
+            await client.join(parts[1])
+        elif cmd == 'spectate' and len(parts) > 1:
+            await client.spectate(parts[1])
+        elif cmd == 'reconnect':
+            await client.reconnect()
+        elif cmd == 'quick':
+            await client.quick_match()
+        elif cmd == 'cancel':
+            await client.cancel_match()
+        elif cmd == 'games':
+            await client.list_games(parts[1] if len(parts) > 1 else None)
+        elif cmd == 'replay' and len(parts) > 1 and parts[1].isdigit():
+            speed = None
+            if len(parts) > 2:
+                try:
+                    speed = float(parts[2])
+                except ValueError:
+                    say("Usage: replay <id> [speed]")
+                    return False
+            await client.replay(int(parts[1]), speed)
         else:
-            print(f"Reconnection failed: {response.get('message')}")
-            await ws.close()
-            STATE['token'] = None
-            STATE['room_id'] = None
-            STATE['is_player'] = False
-            STATE['game_state'] = 'LOBBY'
-            return None
-                
-    except Exception as e:
-        print(f"Failed to reconnect: {e}")
-        if ws:
+            say("Invalid lobby command. Type 'help'.")
+            return False
+
+    elif client.game_state == 'REPLAY':
+        if cmd == 'stop':
+            await client.stop_replay()
+        elif cmd == 'board':
+            show_board(client)
+            return False
+        else:
+            say("Watching a replay. Type 'stop' to return to the lobby.")
+            return False
+
+    elif client.is_player:
+        if cmd == 'move' and len(parts) == 3:
             try:
-                await ws.close()
-            except:
-                pass
-        return None
+                r, c = int(parts[1]), int(parts[2])
+            except ValueError:
+                say("Usage: move <row> <col>")
+                return False
+            await client.move(r, c)
+        elif cmd == 'choose' and len(parts) == 2:
+            await client.choose(parts[1])
+        elif cmd == 'chat':
+            await client.chat(" ".join(parts[1:]))
+        elif cmd == 'board':
+            show_board(client)
+            return False
+        else:
+            say("Invalid player command. Type 'help'.")
+            return False
+
+    elif client.is_spectator:
+        if cmd == 'chat':
+            if len(parts) < 2:
+                say("Usage: chat <message>")
+                return False
+            await client.chat(" ".join(parts[1:]))
+        elif cmd == 'schat':
+            if len(parts) < 2:
+                say("Usage: schat <message>")
+                return False
+            await client.spectator_chat(" ".join(parts[1:]))
+        elif cmd == 'board':
+            show_board(client)
+            return False
+        else:
+            say("Invalid spectator command. Type 'help'.")
+            return False
+
+    return True
 
 async def main():
     uri = "ws://localhost:8765"
-    
-    while True:
-        if STATE['user_id'] is None:
-            user_id = input("Enter your User ID (e.g., player123): ").strip()
-            user_name = input("Enter your Display Name (e.g., Alice): ").strip()
-            if not user_id or not user_name:
-                print("ID and Name cannot be empty.")
-                continue
-            STATE['user_id'] = user_id
-            STATE['user_name'] = user_name
 
-        ws_connection = None
+    # Typed lines are read on the event loop (see terminal.stdin_lines).
+    stdin = stdin_lines()
+    user_id = user_name = None
+    while not user_id or not user_name:
+        user_id = (await ask(stdin, "Enter your User ID (e.g., player123): ")).strip()
+        user_name = (await ask(stdin, "Enter your Display Name (e.g., Alice): ")).strip()
+        if not user_id or not user_name:
+            print("ID and Name cannot be empty.")
+
+    client = GameClient(uri, user_id, user_name, ENCODING, on_event=show)
+    if SCREEN:
+        SCREEN.start()
+    try:
+        await run_session(client, stdin)
+    finally:
+        if SCREEN:
+            SCREEN.stop()
+
+async def ask(stdin, question):
+    if stdin is None:
+        return input(question)
+    print(question, end="", flush=True)
+    line = await stdin.get()
+    if line == '':
+        raise EOFError
+    return line
+
+async def run_session(client, stdin):
+    while True:
         try:
-            if STATE['user_id']:
-                ws_connection = await attempt_reconnection(uri)
-                if not ws_connection:
-                    print("Could not reconnect, returning to lobby.")
-
-            if not ws_connection:
-                STATE['game_state'] = 'LOBBY'
-                STATE['is_player'] = False
-                STATE['is_spectator'] = False
-                STATE['room_id'] = None
-                
-                print(f"Connecting to {uri} as {STATE['user_name']} ({STATE['user_id']})...")
-                ws_connection = await websockets.connect(uri)
-                print("Connected! Type 'list' to see rooms or 'help' for commands.")
-                display_prompt()
-
-            listen_task = asyncio.create_task(listen_to_server(ws_connection))
-            input_task = asyncio.create_task(handle_user_input(ws_connection))
-            
-            await asyncio.gather(listen_task, input_task)
+            say(f"Connecting to {client.url} as {client.user_name} ({client.user_id})...")
+            await client.connect()
+
+            # A returning player (same User ID) gets their seat back.
+            say(f"Attempting to reconnect as {client.user_id}...")
+            try:
+                await client.reconnect()
+            except (GameError, asyncio.TimeoutError) as e:
+                say(f"Reconnection failed: {e}")
+                say("Could not reconnect, returning to lobby.")
+                client.reset()
+                say("Connected! Type 'list' to see rooms or 'help' for commands.")
+                display_prompt(client)
+
+            listen_task = asyncio.ensure_future(client.wait_closed())
+            input_task = asyncio.ensure_future(handle_user_input(client, stdin))
+
+            try:
+                await asyncio.gather(listen_task, input_task)
+            finally:
+                listen_task.cancel()
+                input_task.cancel()
+            break
 
         except websockets.exceptions.ConnectionClosed as e:
-            print(f"\nConnection lost (Code: {e.code}).")
-            if STATE['is_player'] and STATE['user_id'] and STATE['game_state'] == 'IN_PROGRESS':
-                print(f"Will attempt to reconnect in 5 seconds...")
+            say(f"\nConnection lost (Code: {e.code}).")
+            if client.is_player and client.game_state == 'IN_PROGRESS':
+                say(f"Will attempt to reconnect in 5 seconds...")
                 await asyncio.sleep(5)
             else:
-                print("Connection closed. Exiting.")
+                say("Connection closed. Exiting.")
                 break
-        except (ConnectionRefusedError, asyncio.TimeoutError):
-            print("Could not connect to server. Is it running?")
-            print("Retrying in 5 seconds...")
+        except (OSError, asyncio.TimeoutError):
+            say("Could not connect to server. Is it running?")
+            say("Retrying in 5 seconds...")
             await asyncio.sleep(5)
         except (KeyboardInterrupt, EOFError):
-            print("Exiting client.")
+            say("Exiting client.")
             break
         except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            say(f"An unexpected error occurred: {e}")
             break
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, EOFError):
-        print("\nClient shut down.")
\ No newline at end of file
+        print("\nClient shut down.")
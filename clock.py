@@ -0,0 +1,73 @@
+import math
+import re
+
+# Time controls, as create_room takes them and room lists show them:
+# - 'M+I' (Fischer): M seconds each, plus I seconds after every move
+# - 'M+PxS' (byoyomi): M seconds each, then P periods of S seconds; a move
+#   made within a period keeps it, letting one run out uses it up
+TIME_CONTROL_PATTERN = re.compile(r'(\d{1,5})\+(?:(\d{1,3})|(\d{1,2})x(\d{1,3}))$')
+MAX_MAIN_TIME = 4 * 60 * 60
+
+
+def clock_text(seconds):
+    seconds = max(0, int(math.ceil(seconds)))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class TimeControl:
+    # The rules of a game's clocks; one object serves a room and holds no
+    # per-player state. A player's clock is [main, periods]: main time left
+    # in seconds and byoyomi periods left, the next of them started afresh
+    # once main time is gone. The player's flag falls after
+    # main + periods * period seconds on the move.
+    #
+    # Nothing counts down while a player thinks. The room notes when the
+    # turn started (time.monotonic()) and charge() works out the clock when
+    # the move arrives, so a game costs one timer, set for the flag, per
+    # turn.
+    __slots__ = ('name', 'main', 'increment', 'periods', 'period')
+
+    def __init__(self, name):
+        match = TIME_CONTROL_PATTERN.match(name)
+        if not match or not 0 < int(match.group(1)) <= MAX_MAIN_TIME:
+            raise ValueError(f"must look like 300+5 (Fischer) or 600+3x30 (byoyomi), with 1 to {MAX_MAIN_TIME} seconds main time")
+        main, increment, periods, period = match.groups()
+        self.name = name
+        self.main = int(main)
+        self.increment = int(increment or 0)
+        self.periods = int(periods or 0)
+        self.period = int(period or 0)
+        if self.periods and not self.period:
+            raise ValueError("byoyomi periods must last at least a second")
+
+    def new_clock(self):
+        return [float(self.main), self.periods]
+
+    def left(self, clock, elapsed=0.0):
+        # Seconds until the flag falls, elapsed seconds into a turn.
+        return clock[0] + clock[1] * self.period - elapsed
+
+    def charge(self, clock, elapsed):
+        # The clock after a move made elapsed seconds into the turn, or None
+        # if the flag fell first.
+        left = self.left(clock, elapsed)
+        if left <= 0:
+            return None
+        reserve = clock[1] * self.period
+        if left > reserve:
+            return [left - reserve + self.increment, clock[1]]
+        # Into byoyomi: the period the move was made in is kept.
+        return [0.0, math.ceil(left / self.period)]
+
+    def view(self, clock, elapsed=0.0):
+        # What clients count down, elapsed seconds into a turn:
+        # {'time': ms on the current count (main time, or the period under
+        # way once it is gone), 'periods': periods still to come after it}.
+        left = self.left(clock, elapsed)
+        reserve = clock[1] * self.period
+        if left <= 0:
+            return {'time': 0, 'periods': 0}
+        if left > reserve:
+            return {'time': max(0, round((left - reserve) * 1000)), 'periods': clock[1]}
+        current = math.ceil(left / self.period)
+        return {'time': max(0, round((left - (current - 1) * self.period) * 1000)), 'periods': current - 1}
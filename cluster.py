@@ -0,0 +1,136 @@
+import asyncio
+import multiprocessing
+import pickle
+import queue
+import signal
+import sys
+import threading
+import zlib
+from multiprocessing.connection import wait
+
+
+def shard_of(room_id, shards):
+    # crc32 rather than hash(): it must agree across processes.
+    return zlib.crc32(room_id.encode()) % shards
+
+
+class RemoteRoom:
+    # Lobby view of a room owned by another shard.
+    __slots__ = ('room_id', 'info')
+
+    def __init__(self, info):
+        self.room_id = info['room_id']
+        self.info = info
+
+    def get_room_info(self):
+        return self.info
+
+
+class Sender:
+    # Writes to a pipe from a thread of its own. A pipe's buffer fills when
+    # the other end is slow to read, and a blocking send would then stall
+    # the sender: a worker's event loop, or the parent relaying to every
+    # worker, which can wait on a worker that is itself waiting on the
+    # parent. Callers queue pickled events and never block.
+    def __init__(self, conn):
+        self.conn = conn
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, data):
+        self.queue.put(data)
+
+    def close(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                self.conn.send_bytes(data)
+            except OSError:
+                # The other end has gone; its reader sees EOF.
+                return
+
+
+class Cluster:
+    # One worker's link to the other shards. Events are plain dicts sent
+    # over a multiprocessing pipe to the parent, which relays them to every
+    # other worker.
+    def __init__(self, shard, shards, conn, host, port):
+        self.shard = shard
+        self.shards = shards
+        self.conn = conn
+        self.sender = Sender(conn)
+        # Every worker accepts lobby connections on the shared port
+        # (SO_REUSEPORT) and is reachable directly on port + 1 + shard.
+        self.port = port + 1 + shard
+        self.urls = [f"ws://{host}:{port + 1 + i}" for i in range(shards)]
+        self.closed = None
+
+    def owns(self, room_id):
+        return shard_of(room_id, self.shards) == self.shard
+
+    def can_host(self, room_id):
+        return self.owns(room_id)
+
+    def url_of(self, room_id):
+        return self.urls[shard_of(room_id, self.shards)]
+
+    def publish(self, event):
+        # Pickled here, so the event loop can change the event afterwards.
+        self.sender.send(pickle.dumps(event, pickle.HIGHEST_PROTOCOL))
+
+    def start(self, on_event):
+        # closed resolves when the parent process goes away.
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+
+        def on_readable():
+            try:
+                while self.conn.poll():
+                    on_event(self.conn.recv())
+            except EOFError:
+                loop.remove_reader(self.conn.fileno())
+                if not self.closed.done():
+                    self.closed.set_result(None)
+        loop.add_reader(self.conn.fileno(), on_readable)
+
+
+def relay(conns):
+    # Events are passed on as the pickled bytes they arrived as.
+    senders = {conn: Sender(conn) for conn in conns}
+    while senders:
+        for conn in wait(list(senders)):
+            try:
+                data = conn.recv_bytes()
+            except EOFError:
+                senders.pop(conn).close()
+                continue
+            for other, sender in senders.items():
+                if other is not conn:
+                    sender.send(data)
+
+
+def run_workers(shards, target, host, port, *args):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    conns = []
+    processes = []
+    for shard in range(shards):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        # Not daemonic: a worker starts its own engine processes for bot games.
+        process = multiprocessing.Process(target=target, args=(shard, shards, child_conn, host, port) + args)
+        process.start()
+        child_conn.close()
+        conns.append(parent_conn)
+        processes.append(process)
+
+    try:
+        relay(conns)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
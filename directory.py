@@ -0,0 +1,104 @@
+import bisect
+
+ROOM_LIST_LIMIT = 50
+ROOM_LIST_MAX_LIMIT = 200
+ROOM_LIST_CACHE_SIZE = 1024
+ROOM_STATES = ('WAITING', 'IN_PROGRESS', 'FINISHED')
+
+
+def index_keys(info):
+    keys = ['all', info['game_state']]
+    if info['player_count'] < 2:
+        keys.append('free')
+    return keys
+
+
+class RoomDirectory:
+    # Sorted room_id indexes behind list_rooms: every room, one per
+    # game_state and the rooms with a free seat. Room changes are only queued
+    # and applied on the next query, so a burst of updates to one room costs
+    # a single get_room_info(). Encoded pages are cached per index and
+    # dropped when a room inside the id range they cover changes.
+    def __init__(self, encode, limit=ROOM_LIST_LIMIT, max_limit=ROOM_LIST_MAX_LIMIT,
+                 cache_size=ROOM_LIST_CACHE_SIZE):
+        self.encode = encode
+        self.limit = limit
+        self.max_limit = max_limit
+        self.cache_size = cache_size
+        self.infos = {}
+        self.indexes = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = {}
+        self._pages = {}
+
+    def room_changed(self, room):
+        self._dirty[room.room_id] = room
+
+    def room_removed(self, room_id):
+        self._dirty[room_id] = None
+
+    def _refresh(self):
+        for room_id, room in self._dirty.items():
+            old = self.infos.pop(room_id, None)
+            new = room.get_room_info() if room is not None else None
+            if new is not None:
+                self.infos[room_id] = new
+            if new == old:
+                continue
+            old_keys = index_keys(old) if old else []
+            new_keys = index_keys(new) if new else []
+            for key in old_keys:
+                if key not in new_keys:
+                    ids = self.indexes[key]
+                    del ids[bisect.bisect_left(ids, room_id)]
+            for key in new_keys:
+                if key not in old_keys:
+                    bisect.insort(self.indexes.setdefault(key, []), room_id)
+            for key in set(old_keys + new_keys):
+                self._invalidate(key, room_id)
+        self._dirty.clear()
+
+    def _invalidate(self, key, room_id):
+        pages = self._pages.get(key)
+        if not pages:
+            return
+        for page_key, (cursor, last, full, frame) in list(pages.items()):
+            if room_id > cursor and (not full or room_id <= last):
+                del pages[page_key]
+
+    def page(self, state=None, free_seat=False, prefix='', cursor=None, limit=None, encoding=None):
+        self._refresh()
+        limit = max(1, min(limit or self.limit, self.max_limit))
+        cursor = cursor or ''
+        # Walk the narrowest index and check the remaining filters per room.
+        key = state or ('free' if free_seat else 'all')
+        page_key = (free_seat, prefix, cursor, limit, encoding)
+
+        pages = self._pages.setdefault(key, {})
+        page = pages.get(page_key)
+        if page is not None:
+            self.hits += 1
+            return page[3]
+        self.misses += 1
+
+        ids = self.indexes.get(key, [])
+        rooms = []
+        last = cursor
+        for i in range(bisect.bisect_right(ids, cursor), len(ids)):
+            info = self.infos[ids[i]]
+            if free_seat and info['player_count'] >= 2:
+                continue
+            if prefix and not info['name'].startswith(prefix):
+                continue
+            rooms.append(info)
+            last = ids[i]
+            if len(rooms) == limit:
+                break
+
+        full = len(rooms) == limit
+        frame = self.encode({'type': 'room_list', 'rooms': rooms, 'next_cursor': last if full else None}, encoding)
+        if len(pages) >= self.cache_size:
+            pages.clear()
+        pages[page_key] = (cursor, last, full, frame)
+        return frame
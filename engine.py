@@ -0,0 +1,364 @@
+import os
+import random
+import signal
+import threading
+import time
+
+BOARD_SIZE = 15
+WIN_LENGTH = 5
+MAX_DEPTH = 12
+CANDIDATE_LIMIT = 12
+VCF_DEPTH = 6
+TT_LIMIT = 1 << 20
+POSITION_CACHE_SIZE = 256
+WIN_SCORE = 1000000
+# Value of a five-cell window holding k stones of one colour and none of
+# the other; a window holding both colours is dead and worth nothing.
+WINDOW_VALUES = (0, 1, 12, 150, 2000, WIN_SCORE)
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+_TABLES = {}
+
+
+def tables(size):
+    # Per board size: the cells of every five-cell window, the windows
+    # through each cell, the cells within two steps of each cell, and the
+    # Zobrist keys for (stone, cell) and for the side to move.
+    if size not in _TABLES:
+        windows = []
+        for r in range(size):
+            for c in range(size):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    er, ec = r + dr * (WIN_LENGTH - 1), c + dc * (WIN_LENGTH - 1)
+                    if 0 <= er < size and 0 <= ec < size:
+                        windows.append(tuple((r + dr * i) * size + c + dc * i for i in range(WIN_LENGTH)))
+        cell_windows = [[] for _ in range(size * size)]
+        for index, cells in enumerate(windows):
+            for cell in cells:
+                cell_windows[cell].append(index)
+        neighbours = []
+        for r in range(size):
+            for c in range(size):
+                neighbours.append([nr * size + nc
+                                   for nr in range(max(0, r - 2), min(size, r + 3))
+                                   for nc in range(max(0, c - 2), min(size, c + 3))
+                                   if (nr, nc) != (r, c)])
+        rng = random.Random(size)
+        zobrist = [None] + [[rng.getrandbits(64) for _ in range(size * size)] for _ in (1, 2)]
+        side = (0, rng.getrandbits(64), rng.getrandbits(64))
+        _TABLES[size] = (windows, cell_windows, neighbours, zobrist, side)
+    return _TABLES[size]
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Position:
+    # Engine-side board, updated incrementally: make() and unmake() adjust
+    # the stone counts of the windows through the cell, the evaluation, the
+    # Zobrist hash, the neighbour counts used for move generation and the
+    # sets of windows one or two stones short of five. A search plays and
+    # takes back moves on this one object and never copies the board.
+    __slots__ = ('size', 'cells', 'counts', 'near', 'hash', 'score', 'fours', 'threes',
+                 'moves', 'winner', 'tt', 'nodes', 'depth', 'deadline', 'synced',
+                 'windows', 'cell_windows', 'neighbours', 'zobrist', 'side')
+
+    def __init__(self, size=BOARD_SIZE):
+        self.size = size
+        self.windows, self.cell_windows, self.neighbours, self.zobrist, self.side = tables(size)
+        self.cells = [0] * (size * size)
+        self.counts = [None, [0] * len(self.windows), [0] * len(self.windows)]
+        self.near = [0] * (size * size)
+        self.hash = 0
+        # Sum of window values, positive for black.
+        self.score = 0
+        self.fours = [None, set(), set()]
+        self.threes = [None, set(), set()]
+        self.moves = []
+        self.winner = 0
+        self.tt = {}
+        self.nodes = 0
+        self.depth = 0
+        self.deadline = None
+        # The (black, white) bitboards last passed to sync().
+        self.synced = (0, 0)
+
+    def make(self, cell, stone):
+        # Every position visited is a node; the deadline is checked before
+        # anything changes so a timeout leaves the position consistent.
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and self.deadline and time.time() > self.deadline:
+            raise SearchTimeout()
+        own_counts = self.counts[stone]
+        opp_counts = self.counts[3 - stone]
+        fours = self.fours[stone]
+        threes = self.threes[stone]
+        sign = 1 if stone == 1 else -1
+        for w in self.cell_windows[cell]:
+            own = own_counts[w]
+            opp = opp_counts[w]
+            if opp == 0:
+                self.score += sign * (WINDOW_VALUES[own + 1] - WINDOW_VALUES[own])
+                if own == 2:
+                    threes.add(w)
+                elif own == 3:
+                    threes.discard(w)
+                    fours.add(w)
+                elif own == 4:
+                    fours.discard(w)
+                    self.winner = stone
+            elif own == 0:
+                # The opponent's window is dead now.
+                self.score += sign * WINDOW_VALUES[opp]
+                if opp == 3:
+                    self.threes[3 - stone].discard(w)
+                elif opp == 4:
+                    self.fours[3 - stone].discard(w)
+            own_counts[w] = own + 1
+        self.cells[cell] = stone
+        self.hash ^= self.zobrist[stone][cell]
+        near = self.near
+        for n in self.neighbours[cell]:
+            near[n] += 1
+        self.moves.append(cell)
+
+    def unmake(self):
+        cell = self.moves.pop()
+        stone = self.cells[cell]
+        own_counts = self.counts[stone]
+        opp_counts = self.counts[3 - stone]
+        fours = self.fours[stone]
+        threes = self.threes[stone]
+        sign = 1 if stone == 1 else -1
+        for w in self.cell_windows[cell]:
+            own = own_counts[w] - 1
+            own_counts[w] = own
+            opp = opp_counts[w]
+            if opp == 0:
+                self.score -= sign * (WINDOW_VALUES[own + 1] - WINDOW_VALUES[own])
+                if own == 2:
+                    threes.discard(w)
+                elif own == 3:
+                    fours.discard(w)
+                    threes.add(w)
+                elif own == 4:
+                    fours.add(w)
+            elif own == 0:
+                self.score -= sign * WINDOW_VALUES[opp]
+                if opp == 3:
+                    self.threes[3 - stone].add(w)
+                elif opp == 4:
+                    self.fours[3 - stone].add(w)
+        self.cells[cell] = 0
+        self.hash ^= self.zobrist[stone][cell]
+        near = self.near
+        for n in self.neighbours[cell]:
+            near[n] -= 1
+        self.winner = 0
+
+    def sync(self, black, white, stride):
+        # Catch up with a server Board (bitboards with the given row stride)
+        # by playing only the stones added since the last call. Returns
+        # False if a stone went missing, i.e. this is a different game.
+        old_black, old_white = self.synced
+        if old_black & ~black or old_white & ~white:
+            return False
+        self.deadline = None
+        for bits, stone in ((black & ~old_black, 1), (white & ~old_white, 2)):
+            while bits:
+                low = bits & -bits
+                r, c = divmod(low.bit_length() - 1, stride)
+                self.make(r * self.size + c, stone)
+                bits ^= low
+        self.synced = (black, white)
+        return True
+
+    def empties(self, windows):
+        cells = set()
+        for w in windows:
+            for cell in self.windows[w]:
+                if self.cells[cell] == 0:
+                    cells.add(cell)
+        return cells
+
+    def evaluate(self, stone):
+        return self.score if stone == 1 else -self.score
+
+    def move_score(self, cell, stone):
+        # Ordering heuristic: what the move builds for us plus what it
+        # takes away from the opponent.
+        own_counts = self.counts[stone]
+        opp_counts = self.counts[3 - stone]
+        attack = defence = 0
+        for w in self.cell_windows[cell]:
+            own = own_counts[w]
+            opp = opp_counts[w]
+            if opp == 0:
+                attack += WINDOW_VALUES[own + 1]
+            elif own == 0:
+                defence += WINDOW_VALUES[opp + 1]
+        return attack + defence * 9 // 10
+
+    def candidates(self, stone, first=None):
+        cells = self.cells
+        near = self.near
+        moves = [cell for cell in range(len(cells)) if cells[cell] == 0 and near[cell]]
+        if not moves:
+            return [len(cells) // 2]
+        moves.sort(key=lambda cell: self.move_score(cell, stone), reverse=True)
+        moves = moves[:CANDIDATE_LIMIT]
+        if first is not None and first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        elif first is not None and cells[first] == 0:
+            moves.insert(0, first)
+        return moves
+
+    def vcf(self, stone, depth):
+        # Victory by continuous fours: keep making fours the opponent must
+        # block until one cannot be blocked.
+        if depth == 0 or not self.threes[stone]:
+            return False
+        opp = 3 - stone
+        for cell in self.empties(self.threes[stone]):
+            self.make(cell, stone)
+            try:
+                wins = self.empties(self.fours[stone])
+                if len(wins) >= 2:
+                    return True
+                if len(wins) == 1 and not self.empties(self.fours[opp]):
+                    self.make(wins.pop(), opp)
+                    try:
+                        # A block that makes a four of its own breaks the chain.
+                        if not self.fours[opp] and self.vcf(stone, depth - 1):
+                            return True
+                    finally:
+                        self.unmake()
+            finally:
+                self.unmake()
+        return False
+
+    def negamax(self, depth, alpha, beta, stone, ply):
+        opp = 3 - stone
+
+        if self.empties(self.fours[stone]):
+            return WIN_SCORE - ply
+        threats = self.empties(self.fours[opp])
+        if len(threats) >= 2:
+            return -(WIN_SCORE - ply - 1)
+
+        key = self.hash ^ self.side[stone]
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, value, flag, tt_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER and value >= beta:
+                    return value
+                if flag == UPPER and value <= alpha:
+                    return value
+
+        if threats:
+            # Forced block; searched without using up depth.
+            moves = list(threats)
+            next_depth = depth
+        elif depth <= 0:
+            if self.vcf(stone, VCF_DEPTH):
+                return WIN_SCORE // 2 - ply
+            return self.evaluate(stone)
+        else:
+            moves = self.candidates(stone, tt_move)
+            next_depth = depth - 1
+
+        original_alpha = alpha
+        best = -WIN_SCORE * 2
+        best_move = moves[0]
+        for cell in moves:
+            self.make(cell, stone)
+            try:
+                value = -self.negamax(next_depth, -beta, -alpha, opp, ply + 1)
+            finally:
+                self.unmake()
+            if value > best:
+                best = value
+                best_move = cell
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt[key] = (depth, best, flag, best_move)
+        return best
+
+    def search(self, stone, deadline, max_depth=MAX_DEPTH):
+        # Iterative deepening until the deadline (time.time()) passes. The
+        # transposition table is kept between moves of the same game.
+        self.nodes = 0
+        self.depth = 0
+        if len(self.tt) > TT_LIMIT:
+            self.tt.clear()
+
+        wins = self.empties(self.fours[stone])
+        if wins:
+            return min(wins)
+        threats = self.empties(self.fours[3 - stone])
+        if threats:
+            return min(threats)
+
+        best = self.candidates(stone)[0]
+        key = self.hash ^ self.side[stone]
+        self.deadline = deadline
+        for depth in range(1, max_depth + 1):
+            try:
+                value = self.negamax(depth, -WIN_SCORE * 2, WIN_SCORE * 2, stone, 0)
+            except SearchTimeout:
+                break
+            best = self.tt[key][3]
+            self.depth = depth
+            if abs(value) >= WIN_SCORE // 2 - MAX_DEPTH * 2:
+                break
+        self.deadline = None
+        return best
+
+
+_POSITIONS = {}
+
+
+def init_worker(server_pid):
+    # Engine processes leave Ctrl-C to the server, which shuts the pool
+    # down, and exit on their own if the server dies without doing so.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threading.Thread(target=_watch_server, args=(server_pid,), daemon=True).start()
+
+
+def _watch_server(server_pid):
+    while os.getppid() == server_pid:
+        time.sleep(1)
+    os._exit(0)
+
+
+def search_move(game_id, black, white, stone, deadline, size=BOARD_SIZE):
+    # Runs in an engine worker process. Positions (and their transposition
+    # tables) are cached per game, so a search only has to play the stones
+    # added since this worker last saw the game.
+    position = _POSITIONS.pop(game_id, None)
+    if position is None or not position.sync(black, white, size + 1):
+        position = Position(size)
+        position.sync(black, white, size + 1)
+    _POSITIONS[game_id] = position
+    if len(_POSITIONS) > POSITION_CACHE_SIZE:
+        del _POSITIONS[next(iter(_POSITIONS))]
+
+    cell = position.search(stone, deadline)
+    r, c = divmod(cell, size)
+    return r, c, position.nodes, position.depth
@@ -0,0 +1,613 @@
+import asyncio
+import json
+
+import websockets
+
+import protocol
+from clock import TimeControl
+from rules import SWAP2_PLACING
+
+REQUEST_TIMEOUT = 10
+# Events after which whose turn it is, or whether the game is still on, may
+# have changed.
+TURN_EVENTS = ('turn_change', 'game_state', 'sync', 'game_over', 'room_closed')
+
+
+class GameError(Exception):
+    # The server refused a request, or the client refused to send one that
+    # could not succeed (a move out of turn or onto a stone).
+    pass
+
+
+class Event:
+    # A message from the server. Fields are read as attributes
+    # (event.room_id) and the decoded message is event.data.
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def type(self):
+        return self.data['type']
+
+    def __getattr__(self, name):
+        try:
+            return self.data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.data!r})'
+
+
+class RoomList(Event):
+    __slots__ = ()
+
+
+class RoomUpdate(Event):
+    __slots__ = ()
+
+
+class JoinSuccess(Event):
+    __slots__ = ()
+
+
+class SpectateSuccess(Event):
+    __slots__ = ()
+
+
+class ReconnectSuccess(Event):
+    __slots__ = ()
+
+
+class GameState(Event):
+    __slots__ = ()
+
+
+class Sync(Event):
+    __slots__ = ()
+
+
+class Move(Event):
+    __slots__ = ()
+
+
+class TurnChange(Event):
+    __slots__ = ()
+
+
+class TimerNotification(Event):
+    __slots__ = ()
+
+
+class GameOver(Event):
+    __slots__ = ()
+
+
+class RoomClosed(Event):
+    __slots__ = ()
+
+
+class GameList(Event):
+    __slots__ = ()
+
+
+class ReplayStart(Event):
+    __slots__ = ()
+
+
+class ReplayEnd(Event):
+    __slots__ = ()
+
+
+class MatchQueued(Event):
+    __slots__ = ()
+
+
+class MatchCancelled(Event):
+    __slots__ = ()
+
+
+class RatingUpdate(Event):
+    __slots__ = ()
+
+
+class Chat(Event):
+    __slots__ = ()
+
+
+class SpectatorChat(Event):
+    __slots__ = ()
+
+
+class ChatBatch(Event):
+    __slots__ = ()
+
+
+class Redirect(Event):
+    __slots__ = ()
+
+
+class ErrorMessage(Event):
+    __slots__ = ()
+
+
+class Ping(Event):
+    __slots__ = ()
+
+
+EVENT_TYPES = {
+    'room_list': RoomList,
+    'room_update': RoomUpdate,
+    'join_success': JoinSuccess,
+    'spectate_success': SpectateSuccess,
+    'reconnect_success': ReconnectSuccess,
+    'game_state': GameState,
+    'sync': Sync,
+    'move': Move,
+    'turn_change': TurnChange,
+    'timer_notification': TimerNotification,
+    'game_over': GameOver,
+    'room_closed': RoomClosed,
+    'game_list': GameList,
+    'replay_start': ReplayStart,
+    'replay_end': ReplayEnd,
+    'match_queued': MatchQueued,
+    'match_cancelled': MatchCancelled,
+    'rating_update': RatingUpdate,
+    'chat': Chat,
+    'spectator_chat': SpectatorChat,
+    'chat_batch': ChatBatch,
+    'redirect': Redirect,
+    'error': ErrorMessage,
+    'ping': Ping
+}
+
+
+def make_event(data):
+    return EVENT_TYPES.get(data.get('type'), Event)(data)
+
+
+def _expire(future):
+    if not future.done():
+        future.set_exception(asyncio.TimeoutError())
+
+
+class GameClient:
+    # One session with the server: its connection, the state of the room it
+    # is in and awaitable requests. All state is on the instance, so one
+    # event loop can run thousands of clients side by side.
+    #
+    # A single reader task per client decodes every message, applies it to
+    # the client's state (board, seq, whose turn it is), then resolves the
+    # requests waiting for it and finally calls on_event(client, event);
+    # on_event may be a coroutine function, awaited before the next message
+    # is read, so one handler can serve any number of clients.
+    # Move and turn deltas that arrive out of sequence trigger a sync
+    # request instead of being applied, and duplicates are dropped, so
+    # neither on_event nor a request ever sees them. A redirect to the
+    # worker that owns a room is followed on a new connection. Heartbeat
+    # pings are answered as they are read; rtt is the round trip in
+    # milliseconds the server measured for the last one.
+    #
+    # A request sends a message and waits, up to timeout seconds, for the
+    # reply that completes it. The server does not tag replies, so an error
+    # message fails the oldest request still waiting; the error is raised
+    # from that request as a GameError and not passed to on_event.
+    def __init__(self, url, user_id, user_name=None, encoding=protocol.JSON, on_event=None,
+                 timeout=REQUEST_TIMEOUT, **connect_options):
+        self.url = url
+        self.user_id = user_id
+        self.user_name = user_name or user_id
+        self.encoding = encoding
+        self.on_event = on_event
+        self.timeout = timeout
+        self.connect_options = connect_options
+        self.ws = None
+        self.error = None
+        self.token = None
+        self.rtt = None
+        self.list_query = None
+        self.next_cursor = None
+        self._reader = None
+        self._closing = False
+        self._waiters = []
+        self.reset()
+
+    def reset(self):
+        # Back to the lobby. The token is kept for a later reconnect.
+        self.room_id = None
+        self.is_player = False
+        self.is_spectator = False
+        self.stone = 0
+        self.board = []
+        self.current_turn = None
+        self.game_state = 'LOBBY'
+        self.seq = None
+        self.players = {}
+        self.rule = None
+        self.opening = None
+        # The swap2 phase while the opening lasts: 'place3' and 'place2'
+        # are stones to place, 'choose' and 'choose2' a colour to pick.
+        self.phase = None
+        # Timed games: the time control, and each player's clock as the
+        # server last sent it at clocks_at (loop time); clock() counts the
+        # player on turn down from there.
+        self.time_control = None
+        self.clocks = {}
+        self.clocks_at = None
+
+    def clock(self, user_id):
+        # {'time': ms, 'periods': n} for a player in a timed game, as of now.
+        clock = self.clocks.get(user_id)
+        if clock is None or user_id != self.current_turn or self.game_state != 'IN_PROGRESS':
+            return clock
+        left = clock['time'] - (asyncio.get_running_loop().time() - self.clocks_at) * 1000
+        periods = clock['periods']
+        period = self.time_control.period * 1000
+        while left <= 0 and periods:
+            left += period
+            periods -= 1
+        return {'time': max(0, round(left)), 'periods': periods}
+
+    def _set_clocks(self, clocks):
+        if clocks:
+            self.clocks = clocks
+            self.clocks_at = asyncio.get_running_loop().time()
+
+    @property
+    def my_turn(self):
+        return self.is_player and self.game_state == 'IN_PROGRESS' and self.current_turn == self.user_id
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.url, subprotocols=[self.encoding], **self.connect_options)
+        self.error = None
+        self._closing = False
+        self._reader = asyncio.ensure_future(self._read())
+        return self
+
+    async def close(self):
+        self._closing = True
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await asyncio.shield(self._reader)
+
+    async def wait_closed(self):
+        # Returns once close() is called; raises the ConnectionClosed if the
+        # server closed the connection first.
+        await asyncio.shield(self._reader)
+        if self.error:
+            raise self.error
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def send(self, message):
+        await self.ws.send(json.dumps(message))
+
+    async def _read(self):
+        try:
+            while True:
+                await self._handle(protocol.decode(await self.ws.recv()))
+        except websockets.exceptions.ConnectionClosed as e:
+            if not self._closing:
+                self.error = e
+            error = e
+        except Exception as e:
+            self.error = error = e
+            await self.ws.close()
+        for _, _, future, _ in self._waiters:
+            if not future.done():
+                future.set_exception(error)
+        self._waiters = []
+
+    async def _handle(self, data):
+        msg_type = data.get('type')
+
+        if msg_type in ('move', 'turn_change'):
+            if self.seq is None or not self.board or data['seq'] > self.seq + 1:
+                await self.send(self.sync_request())
+                return
+            if data['seq'] <= self.seq:
+                return
+            self._apply_event(data)
+
+        elif msg_type == 'sync':
+            # Spectators also get batches of moves as sync messages; a batch
+            # that starts past the next seq means frames were missed.
+            if (self.seq is None or not self.board
+                    or data['events'] and data['events'][0]['seq'] > self.seq + 1):
+                await self.send(self.sync_request())
+                return
+            for event in data['events']:
+                if event['seq'] > self.seq:
+                    self._apply_event(event)
+                    self._resolve(make_event(event))
+            self.current_turn = data['current_turn']
+            self.seq = data['seq']
+            self._set_clocks(data.get('clocks'))
+
+        elif msg_type == 'game_state':
+            self.board = data['board']
+            self.current_turn = data['current_turn']
+            self.game_state = data['game_state']
+            self.seq = data['seq']
+            self.players = data['players']
+            self.stone = data.get('stones', {}).get(self.user_id, self.stone)
+            self.rule = data.get('rule')
+            self.opening = data.get('opening')
+            self.phase = data.get('phase')
+            self.time_control = TimeControl(data['time_control']) if data.get('time_control') else None
+            self._set_clocks(data.get('clocks'))
+
+        elif msg_type == 'join_success':
+            self.reset()
+            self.room_id = data['room_id']
+            self.token = data['token']
+            self.is_player = True
+            self.stone = data['your_stone']
+            self.game_state = 'WAITING'
+
+        elif msg_type == 'spectate_success':
+            self.reset()
+            self.room_id = data['room_id']
+            self.is_spectator = True
+            self.game_state = 'SPECTATING'
+
+        elif msg_type == 'reconnect_success':
+            self.room_id = data['room_id']
+            self.is_player = True
+            self.is_spectator = False
+            self.stone = data['your_stone']
+            # The sync or game_state that follows has the rest.
+            self.game_state = 'IN_PROGRESS'
+
+        elif msg_type == 'game_over':
+            self.game_state = 'FINISHED'
+
+        elif msg_type in ('room_closed', 'replay_end'):
+            self.reset()
+
+        elif msg_type == 'replay_start':
+            self.reset()
+            self.game_state = 'REPLAY'
+            self.room_id = f"#{data['game_id']}"
+            self.board = [[0] * data['size'] for _ in range(data['size'])]
+            self.seq = 0
+            self.players = data['players']
+
+        elif msg_type == 'room_list':
+            self.next_cursor = data.get('next_cursor')
+
+        elif msg_type == 'redirect':
+            await self._follow(data)
+
+        elif msg_type == 'ping':
+            self.rtt = data['rtt']
+            await self.send({'type': 'pong', 'id': data['id']})
+
+        elif msg_type == 'error':
+            if 'reconnection' in data['message']:
+                self.token = None
+            for waiter in self._waiters:
+                future = waiter[2]
+                if waiter[3] and not future.done():
+                    future.set_exception(GameError(data['message']))
+                    return
+
+        event = make_event(data)
+        self._resolve(event)
+        if self.on_event:
+            result = self.on_event(self, event)
+            if result is not None:
+                await result
+
+    def _apply_event(self, event):
+        if event['type'] == 'move':
+            self.board[event['r']][event['c']] = event['stone']
+            # Nobody may move until the turn_change that follows. In a swap2
+            # placing phase the same player goes on, until the game_state
+            # that ends the phase.
+            if self.phase not in SWAP2_PLACING or self.stones_placed() >= SWAP2_PLACING[self.phase][0]:
+                self.current_turn = None
+        else:
+            self.current_turn = event['current_turn']
+        self._set_clocks(event.get('clocks'))
+        self.seq = event['seq']
+
+    async def _follow(self, data):
+        ws = await websockets.connect(data['url'], subprotocols=[self.encoding], **self.connect_options)
+        await ws.send(json.dumps(data['message']))
+        old, self.ws = self.ws, ws
+        await old.close()
+
+    def _resolve(self, event):
+        resolved = False
+        for types, check, future, _ in self._waiters:
+            if event.type in types and not future.done() and (check is None or check(event)):
+                future.set_result(event)
+                resolved = True
+        if resolved:
+            self._waiters = [waiter for waiter in self._waiters if not waiter[2].done()]
+
+    def _expect(self, types, check=None, request=False):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((types, check, future, request))
+        return future
+
+    async def _wait(self, future, timeout):
+        # A timer on the future itself rather than asyncio.wait_for, which
+        # costs the waiting task an extra trip through the event loop.
+        timer = None
+        if timeout is not None and not future.done():
+            timer = asyncio.get_running_loop().call_later(timeout, _expire, future)
+        try:
+            return await future
+        finally:
+            if timer:
+                timer.cancel()
+            self._waiters = [waiter for waiter in self._waiters if waiter[2] is not future]
+
+    async def request(self, message, *types, check=None):
+        # Sends message and returns the first event of one of types (that
+        # passes check).
+        future = self._expect(types, check, request=True)
+        await self.send(message)
+        return await self._wait(future, self.timeout)
+
+    async def wait_for(self, *types, check=None, timeout=None):
+        # The next event of one of types. State is updated before waiters are
+        # woken, so check the client's state first to avoid waiting for an
+        # event that has already arrived.
+        return await self._wait(self._expect(types, check), timeout)
+
+    async def wait_turn(self, timeout=None):
+        # True once it is this client's turn, False when the game is over.
+        while True:
+            if self.my_turn:
+                return True
+            if self.game_state not in ('WAITING', 'IN_PROGRESS'):
+                return False
+            await self.wait_for(*TURN_EVENTS, timeout=timeout)
+
+    def sync_request(self):
+        message = {'type': 'sync'}
+        if self.seq is not None and self.board:
+            message['last_seq'] = self.seq
+        return message
+
+    def reconnect_request(self):
+        message = {'type': 'reconnect', 'user_id': self.user_id}
+        if self.room_id:
+            message['room_id'] = self.room_id
+        if self.token:
+            message['token'] = self.token
+        if self.seq is not None and self.board:
+            message['last_seq'] = self.seq
+        return message
+
+    async def list_rooms(self, game_state=None, free_seat=False, prefix=None):
+        query = {'type': 'list_rooms'}
+        if game_state:
+            query['game_state'] = game_state
+        if free_seat:
+            query['free_seat'] = True
+        if prefix:
+            query['prefix'] = prefix
+        self.list_query = query
+        return await self.request(query, 'room_list')
+
+    async def next_rooms(self):
+        # The next page of the last list_rooms, or None after the last page.
+        if not self.next_cursor:
+            return None
+        return await self.request(dict(self.list_query, cursor=self.next_cursor), 'room_list')
+
+    async def create_room(self, name, bot=False, size=None, rule=None, opening=None, time_control=None):
+        message = {'type': 'create_room', 'name': name, 'user_id': self.user_id, 'user_name': self.user_name}
+        if bot:
+            message['bot'] = True
+        if size:
+            message['size'] = size
+        if rule:
+            message['rule'] = rule
+        if opening:
+            message['opening'] = opening
+        if time_control:
+            message['time_control'] = time_control
+        return await self.request(message, 'join_success')
+
+    async def join(self, room_id):
+        return await self.request({'type': 'join_room', 'room_id': room_id, 'user_id': self.user_id,
+                                   'user_name': self.user_name}, 'join_success')
+
+    async def spectate(self, room_id):
+        # Returns the room's game_state, which follows spectate_success.
+        return await self.request({'type': 'spectate_room', 'room_id': room_id, 'user_id': self.user_id,
+                                   'user_name': self.user_name}, 'game_state')
+
+    async def reconnect(self):
+        # Takes the seat back after a dropped connection, using the token
+        # from join_success if there is one. Returns the sync or game_state
+        # that brings the board up to date.
+        restored = self._expect(('sync', 'game_state'))
+        try:
+            await self.request(self.reconnect_request(), 'reconnect_success')
+        except BaseException:
+            if not restored.done():
+                restored.cancel()
+            raise
+        return await self._wait(restored, self.timeout)
+
+    async def move(self, r, c):
+        # Returns the server's echo of the move, or game_over for a winning
+        # move. The server ignores moves it cannot play, so those are
+        # refused here instead of waiting for a reply that never comes.
+        if not self.my_turn:
+            raise GameError("It is not your turn.")
+        if not (0 <= r < len(self.board) and 0 <= c < len(self.board)):
+            raise GameError(f"({r}, {c}) is off the board.")
+        if self.board[r][c]:
+            raise GameError(f"({r}, {c}) is already taken.")
+        if self.phase in ('choose', 'choose2'):
+            raise GameError("Choose a colour first.")
+        stone = self.next_stone()
+        return await self.request({'type': 'move', 'move': {'r': r, 'c': c}}, 'move', 'game_over',
+                                  check=lambda e: e.type == 'game_over' or (e.r, e.c, e.stone) == (r, c, stone))
+
+    def stones_placed(self):
+        return sum(cell != 0 for row in self.board for cell in row)
+
+    def next_stone(self):
+        # Stones placed in a swap2 opening alternate colours, whoever places
+        # them.
+        if self.phase:
+            return 1 + self.stones_placed() % 2
+        return self.stone
+
+    async def choose(self, choice):
+        # 'black', 'white' or, the first time, 'place2' in a swap2 opening.
+        # Returns the game_state that follows.
+        return await self.request({'type': 'choose', 'choice': choice}, 'game_state')
+
+    async def chat(self, message):
+        await self.send({'type': 'chat', 'message': message})
+
+    async def spectator_chat(self, message):
+        await self.send({'type': 'spectator_chat', 'message': message})
+
+    async def leave(self):
+        await self.send({'type': 'leave_room'})
+        self.reset()
+
+    async def sync(self):
+        return await self.request(self.sync_request(), 'sync', 'game_state')
+
+    async def quick_match(self):
+        # Returns match_queued; join_success follows once an opponent is
+        # found (see wait_for).
+        return await self.request({'type': 'quick_match', 'user_id': self.user_id, 'user_name': self.user_name},
+                                  'match_queued')
+
+    async def cancel_match(self):
+        await self.send({'type': 'cancel_match'})
+
+    async def list_games(self, user_id=None):
+        message = {'type': 'list_games'}
+        if user_id:
+            message['user_id'] = user_id
+        return await self.request(message, 'game_list')
+
+    async def replay(self, game_id, speed=None):
+        message = {'type': 'replay', 'game_id': game_id}
+        if speed is not None:
+            message['speed'] = speed
+        return await self.request(message, 'replay_start')
+
+    async def stop_replay(self):
+        await self.send({'type': 'stop_replay'})
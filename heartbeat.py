@@ -0,0 +1,117 @@
+import asyncio
+
+HEARTBEAT_INTERVAL = 5.0
+# Pings in a row a connection may leave unanswered.
+HEARTBEAT_MISSES = 2
+
+
+class Peer:
+    __slots__ = ('answered', 'rtt', 'pings', 'probe', 'probes_missed')
+
+    def __init__(self):
+        # The id of the last ping answered, None before the first pong.
+        self.answered = None
+        self.rtt = None
+        # Before the first pong: pings sent, the last probe (see Heartbeat)
+        # and how many ticks in a row it has gone unanswered.
+        self.pings = 0
+        self.probe = None
+        self.probes_missed = 0
+
+
+class Heartbeat:
+    # App-level ping/pong for every connection, driven by one recurring
+    # timer on the shared scheduler instead of a keepalive task per socket.
+    # Each interval every connection is sent {'type': 'ping', 'id': n,
+    # 'rtt': ms} and answers {'type': 'pong', 'id': n}; the time from the
+    # ping to its pong is the connection's rtt, reported in the next ping.
+    # Connections are grouped by rtt so each group shares one frame.
+    #
+    # A connection that has answered pings before and then leaves more than
+    # misses of them unanswered is handed to on_dead. One that has never
+    # answered (a client without heartbeat support) is judged by probe
+    # instead: probe(ws) sends a protocol-level ping and returns a future
+    # that is done once it is answered. Once a connection has left a ping
+    # unanswered, each tick probes it again if its last probe is done, and
+    # hands it to on_dead once a probe has gone unanswered for more than
+    # misses ticks.
+    def __init__(self, scheduler, send, on_dead, probe=None, interval=HEARTBEAT_INTERVAL, misses=HEARTBEAT_MISSES):
+        self.scheduler = scheduler
+        self.send = send
+        self.on_dead = on_dead
+        self.probe = probe
+        self.interval = interval
+        self.misses = misses
+        self.peers = {}
+        self.ping_id = 0
+        self._sent = {}
+        self._timer = None
+        self._next = None
+
+    def add(self, ws):
+        self.peers[ws] = Peer()
+
+    def remove(self, ws):
+        self.peers.pop(ws, None)
+
+    def rtt(self, ws):
+        peer = self.peers.get(ws)
+        return peer.rtt if peer else None
+
+    def start(self):
+        if self._timer is None:
+            self._next = asyncio.get_running_loop().time() + self.interval
+            self._timer = self.scheduler.call_at(self._next, self.tick)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def pong(self, ws, ping_id):
+        # The round trip in seconds, or None for an unknown or stale pong.
+        peer = self.peers.get(ws)
+        sent = self._sent.get(ping_id)
+        if peer is None or sent is None or (peer.answered is not None and ping_id <= peer.answered):
+            return None
+        peer.answered = ping_id
+        peer.rtt = asyncio.get_running_loop().time() - sent
+        return peer.rtt
+
+    def tick(self):
+        # From the last deadline rather than now, so rounding to the
+        # scheduler's tick does not stretch every interval.
+        self._next += self.interval
+        self._timer = self.scheduler.call_at(self._next, self.tick)
+        self.ping_id += 1
+        self._sent[self.ping_id] = asyncio.get_running_loop().time()
+        self._sent.pop(self.ping_id - self.misses - 1, None)
+
+        groups = {}
+        dead = []
+        for ws, peer in self.peers.items():
+            if peer.answered is not None:
+                if self.ping_id - peer.answered > self.misses:
+                    dead.append(ws)
+                    continue
+            elif self.probe and peer.pings:
+                if peer.probe is None or peer.probe.done():
+                    peer.probe = self.probe(ws)
+                    peer.probes_missed = 0
+                else:
+                    peer.probes_missed += 1
+                    if peer.probes_missed > self.misses:
+                        dead.append(ws)
+                        continue
+            if peer.answered is None:
+                peer.pings += 1
+            rtt = round(peer.rtt * 1000) if peer.rtt is not None else None
+            group = groups.get(rtt)
+            if group is None:
+                group = groups[rtt] = []
+            group.append(ws)
+        for rtt, group in groups.items():
+            self.send(group, {'type': 'ping', 'id': self.ping_id, 'rtt': rtt})
+        for ws in dead:
+            del self.peers[ws]
+            self.on_dead(ws)
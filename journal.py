@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+
+JOURNAL_FLUSH_INTERVAL = 0.05
+JOURNAL_COMPACT_RECORDS = 50000
+
+
+class Journal:
+    # Append-only log of room events, one JSON document per line. record()
+    # only appends to an in-memory batch; a background writer writes and
+    # fsyncs each batch in a worker thread. Every JOURNAL_COMPACT_RECORDS
+    # records the writer takes a snapshot of all rooms from snapshot_source,
+    # stores it next to the journal and starts a fresh journal, which keeps
+    # replay time bounded.
+    #
+    # Snapshots are numbered. The snapshot is {'generation': n, 'rooms':
+    # [...]} and each journal starts with a {'generation': n} line for the
+    # snapshot it follows. A crash after a snapshot is saved but before the
+    # journal is restarted leaves a journal of the generation before it,
+    # which load() skips: the snapshot already has its events. A journal or
+    # snapshot without a generation is generation 0.
+    def __init__(self, path, snapshot_source=None, flush_interval=JOURNAL_FLUSH_INTERVAL,
+                 compact_records=JOURNAL_COMPACT_RECORDS):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.snapshot_source = snapshot_source
+        self.flush_interval = flush_interval
+        self.compact_records = compact_records
+        self.records_since_snapshot = 0
+        self.generation = 0
+        # Whether run() starts a new journal rather than appending; set by
+        # load().
+        self._restart = False
+        self._pending = []
+        self._wakeup = None
+        self._file = None
+
+    def record(self, event):
+        self._pending.append(event)
+        if self._wakeup is not None and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def load(self):
+        snapshot = []
+        self.generation = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            if isinstance(snapshot, dict):
+                self.generation = snapshot['generation']
+                snapshot = snapshot['rooms']
+
+        events = []
+        generation = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-write.
+                        break
+                    if generation is None:
+                        generation = event.get('generation', 0)
+                        if 'e' not in event:
+                            continue
+                    events.append(event)
+        if generation is not None and generation != self.generation:
+            events = []
+        self._restart = generation != self.generation
+        self.records_since_snapshot = len(events)
+        return snapshot, events
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self._restart:
+            self._start_journal()
+        else:
+            self._file = open(self.path, 'a')
+        try:
+            while True:
+                await self._wakeup.wait()
+                await asyncio.sleep(self.flush_interval)
+                self._wakeup.clear()
+                await self._flush(loop)
+        finally:
+            if self._pending:
+                self._write(self._pending, None)
+            self._file.close()
+
+    async def _flush(self, loop):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.records_since_snapshot += len(batch)
+        snapshot = None
+        if self.snapshot_source and self.records_since_snapshot >= self.compact_records:
+            # Taken on the event loop, so it covers exactly the events in
+            # this batch and nothing recorded after it.
+            snapshot = self.snapshot_source()
+            self.records_since_snapshot = 0
+        await loop.run_in_executor(None, self._write, batch, snapshot)
+
+    def _write(self, batch, snapshot):
+        self._file.write(''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        if snapshot is not None:
+            self.generation += 1
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'generation': self.generation, 'rooms': snapshot}, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._file.close()
+            self._start_journal()
+
+    def _start_journal(self):
+        self._file = open(self.path, 'w')
+        self._file.write(json.dumps({'generation': self.generation}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
@@ -0,0 +1,55 @@
+import asyncio
+
+LOBBY_UPDATE_INTERVAL = 0.1
+
+
+class Lobby:
+    # Tracks the sockets that are not in any room and pushes room changes to
+    # them. Changes arriving within LOBBY_UPDATE_INTERVAL are merged into a
+    # single room_update diff. When sharded, the diff is also handed to
+    # publish so the other shards can forward it to their lobbies.
+    def __init__(self, send, interval=LOBBY_UPDATE_INTERVAL, publish=None):
+        self.clients = set()
+        self.send = send
+        self.publish = publish
+        self.interval = interval
+        self._changed = {}
+        self._removed = set()
+        self._flush_handle = None
+
+    def enter(self, ws):
+        self.clients.add(ws)
+
+    def leave(self, ws):
+        self.clients.discard(ws)
+
+    def room_changed(self, room):
+        self._changed[room.room_id] = room
+        self._removed.discard(room.room_id)
+        self._schedule_flush()
+
+    def room_removed(self, room_id):
+        self._changed.pop(room_id, None)
+        self._removed.add(room_id)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.interval, self.flush)
+
+    def flush(self):
+        self._flush_handle = None
+        if not self._changed and not self._removed:
+            return
+        message = {
+            'type': 'room_update',
+            'rooms': [room.get_room_info() for room in self._changed.values()],
+            'removed': list(self._removed)
+        }
+        self._changed.clear()
+        self._removed.clear()
+        if self.clients:
+            self.send(self.clients, message)
+        if self.publish:
+            self.publish(message)
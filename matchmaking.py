@@ -0,0 +1,137 @@
+import asyncio
+import bisect
+
+MATCH_INTERVAL = 0.2
+RATING_BUCKET = 100
+WIDEN_AFTER = 5.0
+MAX_WIDEN = 5
+DEFAULT_RATING = 1500
+ELO_K = 32
+
+
+class Ratings:
+    # Elo ratings by user_id, kept in memory.
+    def __init__(self, default=DEFAULT_RATING, k=ELO_K):
+        self.default = default
+        self.k = k
+        self.ratings = {}
+
+    def get(self, user_id):
+        return self.ratings.get(user_id, self.default)
+
+    def record(self, winner_id, loser_id):
+        winner = self.get(winner_id)
+        loser = self.get(loser_id)
+        expected = 1 / (1 + 10 ** ((loser - winner) / 400))
+        change = round(self.k * (1 - expected))
+        self.ratings[winner_id] = winner + change
+        self.ratings[loser_id] = loser - change
+        return {winner_id: winner + change, loser_id: loser - change}
+
+
+class Matchmaker:
+    # Players waiting for quick_match, indexed by rating bucket. Each bucket
+    # is a FIFO (dicts keep insertion order) and a sorted list of occupied
+    # buckets lets a batch visit only buckets that have players in them. A
+    # batch runs every MATCH_INTERVAL while anyone is queued: players are
+    # paired oldest first within their bucket, then a player left over is
+    # paired with the one left in the next occupied bucket once both have
+    # waited long enough (WIDEN_AFTER seconds per bucket) to accept the
+    # rating gap. A batch costs one step per occupied bucket plus one per
+    # pair made, however long the queue is.
+    def __init__(self, on_match, interval=MATCH_INTERVAL, bucket_width=RATING_BUCKET,
+                 widen_after=WIDEN_AFTER, max_widen=MAX_WIDEN):
+        self.on_match = on_match
+        self.interval = interval
+        self.bucket_width = bucket_width
+        self.widen_after = widen_after
+        self.max_widen = max_widen
+        self.entries = {}
+        self.users = {}
+        self.buckets = {}
+        self.occupied = []
+        self.matched = 0
+        self._match_handle = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def enqueue(self, ws, user_id, user_name, rating):
+        self.leave(ws)
+        if user_id in self.users:
+            self.leave(self.users[user_id])
+        bucket = int(rating // self.bucket_width)
+        entry = {
+            'ws': ws,
+            'user_id': user_id,
+            'user_name': user_name,
+            'rating': rating,
+            'bucket': bucket,
+            'queued_at': asyncio.get_running_loop().time()
+        }
+        self.entries[ws] = entry
+        self.users[user_id] = ws
+        members = self.buckets.get(bucket)
+        if members is None:
+            members = self.buckets[bucket] = {}
+            bisect.insort(self.occupied, bucket)
+        members[ws] = entry
+        self._schedule_match()
+        return entry
+
+    def leave(self, ws):
+        entry = self.entries.pop(ws, None)
+        if entry is None:
+            return False
+        del self.users[entry['user_id']]
+        members = self.buckets[entry['bucket']]
+        del members[ws]
+        if not members:
+            self._drop_bucket(entry['bucket'])
+        return True
+
+    def _drop_bucket(self, bucket):
+        del self.buckets[bucket]
+        del self.occupied[bisect.bisect_left(self.occupied, bucket)]
+
+    def _pop_oldest(self, members):
+        entry = members.pop(next(iter(members)))
+        del self.entries[entry['ws']]
+        del self.users[entry['user_id']]
+        return entry
+
+    def _widen(self, entry, now):
+        return min(self.max_widen, int((now - entry['queued_at']) / self.widen_after))
+
+    def _schedule_match(self):
+        if self._match_handle is None and self.entries:
+            loop = asyncio.get_running_loop()
+            self._match_handle = loop.call_later(self.interval, self.match)
+
+    def match(self):
+        self._match_handle = None
+        now = asyncio.get_running_loop().time()
+        pairs = []
+        leftover = None
+        for bucket in list(self.occupied):
+            members = self.buckets[bucket]
+            while len(members) >= 2:
+                pairs.append((self._pop_oldest(members), self._pop_oldest(members)))
+            if members:
+                entry = next(iter(members.values()))
+                if leftover and bucket - leftover['bucket'] <= min(self._widen(leftover, now), self._widen(entry, now)):
+                    self.leave(leftover['ws'])
+                    pairs.append((leftover, self._pop_oldest(members)))
+                    leftover = None
+                else:
+                    leftover = entry
+            if not members:
+                self._drop_bucket(bucket)
+
+        self.matched += len(pairs)
+        for first, second in pairs:
+            result = self.on_match(first, second)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        self._schedule_match()
+        return pairs
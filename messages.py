@@ -0,0 +1,386 @@
+import json
+import math
+import re
+
+from board import BOARD_SIZE, MAX_BOARD_SIZE, MIN_BOARD_SIZE
+from clock import TimeControl
+from rules import DEFAULT_RULE, OPENINGS, RULES
+
+# Largest frame the server accepts (websockets closes the connection with
+# 1009 beyond it); each message type may set a smaller limit.
+MAX_FRAME_SIZE = 4096
+CHAT_MAX_LENGTH = 500
+NAME_MAX_LENGTH = 64
+ID_MAX_LENGTH = 64
+# Rows and columns travel in 7 bits in the sync history and archive.
+MAX_COORD = 127
+MAX_SEQ = 2 ** 32 - 1
+
+# Clients build frames with json.dumps({'type': ..., ...}), so the type is
+# almost always first. Reading it with a regex lets a frame of an unknown
+# type, or one too big for its type, be refused before it is parsed.
+TYPE_PREFIX = re.compile(r'\s*\{\s*"type"\s*:\s*"(\w{1,32})"')
+
+REQUIRED = object()
+
+
+class InvalidMessage(ValueError):
+    # The text is sent back to the client in an error message.
+    pass
+
+
+# Field checks: each returns (check, default). A check returns the value to
+# store or raises ValueError saying what was expected. A missing field, or
+# null, takes the default; REQUIRED makes it an error.
+
+def integer(lo, hi, default=REQUIRED):
+    def check(value):
+        # bool is an int subclass but never a valid number here.
+        if type(value) is not int or not lo <= value <= hi:
+            raise ValueError(f"must be an integer from {lo} to {hi}")
+        return value
+    return check, default
+
+
+def number(default=REQUIRED):
+    def check(value):
+        if type(value) not in (int, float) or not math.isfinite(value):
+            raise ValueError("must be a number")
+        return value
+    return check, default
+
+
+def text(max_length, default=REQUIRED):
+    def check(value):
+        if type(value) is not str or len(value) > max_length:
+            raise ValueError(f"must be a string of at most {max_length} characters")
+        return value
+    return check, default
+
+
+def flag(default=False):
+    def check(value):
+        if type(value) is not bool:
+            raise ValueError("must be true or false")
+        return value
+    return check, default
+
+
+def one_of(options, default=REQUIRED):
+    def check(value):
+        if value not in options:
+            raise ValueError(f"must be one of: {', '.join(options)}")
+        return value
+    return check, default
+
+
+def time_control(default=REQUIRED):
+    # A clock.TimeControl name such as '300+5'; the name is stored.
+    def check(value):
+        if type(value) is not str:
+            raise ValueError("must be a string such as '300+5' or '600+3x30'")
+        TimeControl(value)
+        return value
+    return check, default
+
+
+def cell(default=REQUIRED):
+    # {'r': row, 'c': col} -> (row, col)
+    def check(value):
+        if type(value) is not dict:
+            raise ValueError("must be an object with 'r' and 'c'")
+        r, c = value.get('r'), value.get('c')
+        if type(r) is not int or type(c) is not int or not (0 <= r <= MAX_COORD and 0 <= c <= MAX_COORD):
+            raise ValueError(f"must have integer 'r' and 'c' from 0 to {MAX_COORD}")
+        return r, c
+    return check, default
+
+
+class Message:
+    # A validated client message. Subclasses set type, their fields as
+    # {name: (check, default)} with a slot for each, and optionally a
+    # smaller max_size for the frame.
+    __slots__ = ()
+    type = None
+    fields = {}
+    max_size = MAX_FRAME_SIZE
+    # Optional regex for the whole frame exactly as json.dumps writes it,
+    # tried before anything else. A frame it matches is built by from_match
+    # without being parsed; any other spelling goes through json.loads.
+    fast_pattern = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._checks = tuple((name, check, default) for name, (check, default) in cls.fields.items())
+
+    @classmethod
+    def from_dict(cls, data):
+        message = cls.__new__(cls)
+        for name, check, default in cls._checks:
+            value = data.get(name)
+            if value is None:
+                if default is REQUIRED:
+                    raise InvalidMessage(f"{cls.type}: '{name}' is required.")
+                value = default
+            else:
+                try:
+                    value = check(value)
+                except ValueError as e:
+                    raise InvalidMessage(f"{cls.type}: '{name}' {e}.") from None
+            setattr(message, name, value)
+        return message
+
+    def to_dict(self):
+        data = {'type': self.type}
+        for name in self.fields:
+            data[name] = getattr(self, name)
+        return data
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)
+        return f'{type(self).__name__}({values})'
+
+
+class Move(Message):
+    type = 'move'
+    fields = {'move': cell()}
+    __slots__ = tuple(fields)
+    max_size = 128
+    fast_pattern = re.compile(r'\{"type": ?"move", ?"move": ?\{"r": ?(\d{1,3}), ?"c": ?(\d{1,3})\}\}')
+
+    @classmethod
+    def from_match(cls, match):
+        r, c = int(match[1]), int(match[2])
+        if r > MAX_COORD or c > MAX_COORD:
+            raise InvalidMessage(f"move: 'move' must have integer 'r' and 'c' from 0 to {MAX_COORD}.")
+        message = object.__new__(cls)
+        message.move = (r, c)
+        return message
+
+
+class Chat(Message):
+    type = 'chat'
+    fields = {'message': text(CHAT_MAX_LENGTH, '')}
+    __slots__ = tuple(fields)
+
+
+class SpectatorChat(Message):
+    type = 'spectator_chat'
+    fields = {'message': text(CHAT_MAX_LENGTH, '')}
+    __slots__ = tuple(fields)
+
+
+class Sync(Message):
+    type = 'sync'
+    fields = {'last_seq': integer(0, MAX_SEQ, None)}
+    __slots__ = tuple(fields)
+    max_size = 128
+
+
+class Pong(Message):
+    # The answer to a heartbeat ping.
+    type = 'pong'
+    fields = {'id': integer(0, MAX_SEQ)}
+    __slots__ = tuple(fields)
+    max_size = 128
+    fast_pattern = re.compile(r'\{"type": ?"pong", ?"id": ?(\d{1,10})\}')
+
+    @classmethod
+    def from_match(cls, match):
+        ping_id = int(match[1])
+        if ping_id > MAX_SEQ:
+            raise InvalidMessage(f"pong: 'id' must be an integer from 0 to {MAX_SEQ}.")
+        message = object.__new__(cls)
+        message.id = ping_id
+        return message
+
+
+class Choose(Message):
+    # A colour choice in a swap2 opening.
+    type = 'choose'
+    fields = {'choice': one_of(('black', 'white', 'place2'))}
+    __slots__ = tuple(fields)
+    max_size = 128
+
+
+class LeaveRoom(Message):
+    __slots__ = ()
+    type = 'leave_room'
+    max_size = 128
+
+
+class ListRooms(Message):
+    type = 'list_rooms'
+    fields = {
+        'game_state': text(ID_MAX_LENGTH, None),
+        'free_seat': flag(),
+        'prefix': text(NAME_MAX_LENGTH, ''),
+        'cursor': text(ID_MAX_LENGTH, None),
+        'limit': integer(1, 1000, None)
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class CreateRoom(Message):
+    type = 'create_room'
+    fields = {
+        'name': text(NAME_MAX_LENGTH, 'New Room'),
+        'user_id': text(ID_MAX_LENGTH, 'Player'),
+        'user_name': text(NAME_MAX_LENGTH, 'Player'),
+        'bot': flag(),
+        'size': integer(MIN_BOARD_SIZE, MAX_BOARD_SIZE, BOARD_SIZE),
+        'rule': one_of(tuple(RULES), DEFAULT_RULE),
+        'opening': one_of(tuple(OPENINGS), None),
+        'time_control': time_control(None)
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class JoinRoom(Message):
+    type = 'join_room'
+    fields = {
+        'room_id': text(ID_MAX_LENGTH),
+        'user_id': text(ID_MAX_LENGTH, 'Player'),
+        'user_name': text(NAME_MAX_LENGTH, 'Player')
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class SpectateRoom(Message):
+    type = 'spectate_room'
+    fields = {
+        'room_id': text(ID_MAX_LENGTH),
+        'user_id': text(ID_MAX_LENGTH, None),
+        'user_name': text(NAME_MAX_LENGTH, None)
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class QuickMatch(Message):
+    type = 'quick_match'
+    fields = {
+        'user_id': text(ID_MAX_LENGTH),
+        'user_name': text(NAME_MAX_LENGTH, 'Player')
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class CancelMatch(Message):
+    __slots__ = ()
+    type = 'cancel_match'
+    max_size = 128
+
+
+class ListGames(Message):
+    type = 'list_games'
+    fields = {
+        'room_id': text(ID_MAX_LENGTH, None),
+        'user_id': text(ID_MAX_LENGTH, None),
+        'before': number(None),
+        'limit': integer(1, 1000, None)
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class Replay(Message):
+    type = 'replay'
+    fields = {
+        'game_id': integer(0, 2 ** 63 - 1),
+        'speed': number(1)
+    }
+    __slots__ = tuple(fields)
+    max_size = 256
+
+
+class StopReplay(Message):
+    __slots__ = ()
+    type = 'stop_replay'
+    max_size = 128
+
+
+class Reconnect(Message):
+    type = 'reconnect'
+    fields = {
+        'user_id': text(ID_MAX_LENGTH),
+        'token': text(ID_MAX_LENGTH, None),
+        'room_id': text(ID_MAX_LENGTH, None),
+        'last_seq': integer(0, MAX_SEQ, None)
+    }
+    __slots__ = tuple(fields)
+    max_size = 1024
+
+
+class Dispatcher:
+    # The table of client message types: for each type its Message class
+    # and the handler for it, one table for connections in a room and one
+    # for connections in the lobby. A type missing from the table a
+    # connection is in is ignored, as a move sent from the lobby always was.
+    #
+    # decode(frame) turns a frame into a Message or raises InvalidMessage:
+    # frames over max_size, of an unknown type or over their type's
+    # max_size are refused from the type prefix alone, before any parsing.
+    def __init__(self, max_size=MAX_FRAME_SIZE):
+        self.max_size = max_size
+        self.types = {}
+        self.fast = []
+        self.room_handlers = {}
+        self.lobby_handlers = {}
+
+    def on(self, message_class, in_room=False):
+        # Decorator registering a handler for message_class. A type may
+        # have a handler in each table.
+        def register(handler):
+            if message_class.fast_pattern is not None and message_class.type not in self.types:
+                self.fast.append((message_class.fast_pattern.fullmatch, message_class.from_match))
+            self.types[message_class.type] = message_class
+            table = self.room_handlers if in_room else self.lobby_handlers
+            table[message_class.type] = handler
+            return handler
+        return register
+
+    def decode(self, frame):
+        if len(frame) > self.max_size:
+            raise InvalidMessage("Message too large.")
+        if not isinstance(frame, str):
+            try:
+                frame = frame.decode()
+            except UnicodeDecodeError:
+                raise InvalidMessage("Messages must be UTF-8 JSON.") from None
+
+        for fullmatch, from_match in self.fast:
+            match = fullmatch(frame)
+            if match:
+                return from_match(match)
+
+        cls = None
+        prefix = TYPE_PREFIX.match(frame)
+        if prefix:
+            cls = self.message_class(prefix[1], len(frame))
+
+        try:
+            data = json.loads(frame)
+        except ValueError:
+            raise InvalidMessage("Malformed message.") from None
+        if type(data) is not dict:
+            raise InvalidMessage("A message must be a JSON object.")
+        msg_type = data.get('type')
+        if cls is None or msg_type != cls.type:
+            # The type was not first, or a later "type" key replaced it.
+            if type(msg_type) is not str:
+                raise InvalidMessage("A message needs a 'type'.")
+            cls = self.message_class(msg_type, len(frame))
+        return cls.from_dict(data)
+
+    def message_class(self, msg_type, size):
+        cls = self.types.get(msg_type)
+        if cls is None:
+            raise InvalidMessage(f"Unknown message type: {msg_type[:32]}")
+        if size > cls.max_size:
+            raise InvalidMessage(f"{msg_type} message too large.")
+        return cls
@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'label', 'values')
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, label=None, amount=1):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def samples(self):
+        if self.label is None:
+            return [(self.name, '', self.values.get(None, 0))]
+        return [(self.name, f'{{{self.label}="{label}"}}', value) for label, value in sorted(self.values.items())]
+
+
+class Histogram:
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'sum', 'count')
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        samples = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            samples.append((self.name + '_bucket', f'{{le="{format_value(bound)}"}}', total))
+        samples.append((self.name + '_sum', '', self.sum))
+        samples.append((self.name + '_count', '', self.count))
+        return samples
+
+
+class Distribution(Histogram):
+    # A histogram rebuilt at scrape time from the values collect() returns.
+    __slots__ = ('collect',)
+
+    def __init__(self, name, help, collect, buckets=SIZE_BUCKETS):
+        super().__init__(name, help, buckets)
+        self.collect = collect
+
+    def samples(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        for value in self.collect():
+            self.observe(value)
+        return super().samples()
+
+
+class Gauge:
+    # Read at scrape time from collect(), which returns a number, or a dict
+    # of label value -> number when the gauge has a label.
+    __slots__ = ('name', 'help', 'label', 'collect')
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.collect = collect
+
+    def samples(self):
+        value = self.collect()
+        if self.label is None:
+            return [(self.name, '', value)]
+        return [(self.name, f'{{{self.label}="{label}"}}', v) for label, v in sorted(value.items())]
+
+
+class CollectedCounter(Gauge):
+    # A counter kept elsewhere (say, on the object that counts the events)
+    # and read at scrape time like a gauge.
+    __slots__ = ()
+    kind = 'counter'
+
+
+class Metrics:
+    # Metrics registry rendered in the Prometheus text format. The server
+    # only creates one with --metrics-port; with it unset every
+    # instrumentation point is skipped behind an `if METRICS:` check.
+    def __init__(self):
+        self.metrics = []
+        self.messages = self.add(Counter('gomoku_messages_received_total', 'Client messages received, by type.', 'type'))
+        self.move_seconds = self.add(Histogram('gomoku_move_seconds', 'Time spent handling a move.'))
+        self.fanout_size = self.add(Histogram('gomoku_fanout_recipients', 'Recipients per broadcast.', SIZE_BUCKETS))
+        self.fanout_seconds = self.add(Histogram('gomoku_fanout_seconds', 'Time spent encoding and queueing a broadcast.'))
+        self.encode_seconds = self.add(Histogram('gomoku_encode_seconds', 'Time spent encoding one outgoing message.'))
+        self.decode_seconds = self.add(Histogram('gomoku_decode_seconds', 'Time spent decoding one incoming message.'))
+        self.chat_limited = self.add(Counter('gomoku_chat_rate_limited_total', 'Chat messages refused by the rate limit.'))
+        self.loop_lag_seconds = self.add(Histogram('gomoku_event_loop_lag_seconds', 'Delay of a timer callback past its deadline.'))
+        self.rtt_seconds = self.add(Histogram('gomoku_heartbeat_rtt_seconds', 'Round trip from a heartbeat ping to its pong.'))
+        self.heartbeat_timeouts = self.add(Counter('gomoku_heartbeat_timeouts_total', 'Connections dropped for missed heartbeats.'))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, collect, label=None):
+        return self.add(Gauge(name, help, collect, label))
+
+    def collected_counter(self, name, help, collect, label=None):
+        return self.add(CollectedCounter(name, help, collect, label))
+
+    def distribution(self, name, help, collect, buckets=SIZE_BUCKETS):
+        return self.add(Distribution(name, help, collect, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    async def watch_loop_lag(self, interval=LOOP_LAG_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.loop_lag_seconds.observe(max(0, loop.time() - deadline))
+
+    async def handle_http(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1] == b'/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        # GET /metrics on a plain HTTP port, next to the websocket server.
+        asyncio.ensure_future(self.watch_loop_lag())
+        return await asyncio.start_server(self.handle_http, host, port)
@@ -0,0 +1,76 @@
+import asyncio
+from collections import deque
+
+import websockets
+
+OUTBOX_LIMIT = 256
+# Frames of these types may be dropped from a full outbox, oldest first.
+DROPPABLE_TYPES = ('chat', 'spectator_chat', 'chat_batch')
+
+
+class Outboxes:
+    # Bounded send queues, one per connection that has fallen behind. A
+    # frame is written straight to the socket while nothing is queued for
+    # the connection and its transport buffer is under buffer_limit;
+    # otherwise it waits in the connection's outbox, which a task drains as
+    # fast as the client reads. An outbox holds at most limit frames. Past
+    # that the oldest chat frame is dropped, and if there is no chat left to
+    # drop the client is disconnected instead of losing a game message
+    # (a player can reconnect and resync within the reconnection window).
+    def __init__(self, buffer_limit, limit=OUTBOX_LIMIT):
+        self.buffer_limit = buffer_limit
+        self.limit = limit
+        self.queues = {}
+        self.dropped = 0
+        self.disconnected = 0
+        self._closing = set()
+
+    def __len__(self):
+        return len(self.queues)
+
+    def ready(self, ws):
+        transport = ws.transport
+        return (ws not in self.queues and ws not in self._closing and transport is not None
+                and transport.get_write_buffer_size() <= self.buffer_limit)
+
+    def backlogged(self, ws):
+        return ws in self.queues
+
+    def put(self, ws, frame, droppable):
+        if ws in self._closing:
+            return
+        queue = self.queues.get(ws)
+        if queue is None:
+            queue = self.queues[ws] = deque()
+            asyncio.get_running_loop().create_task(self._drain(ws, queue))
+        queue.append((frame, droppable))
+        if len(queue) <= self.limit:
+            return
+        for i, entry in enumerate(queue):
+            if entry[1]:
+                del queue[i]
+                self.dropped += 1
+                return
+        queue.clear()
+        self.disconnected += 1
+        self._closing.add(ws)
+        asyncio.get_running_loop().create_task(self._close(ws))
+
+    async def _close(self, ws):
+        try:
+            await ws.close(1013, 'Send queue full')
+        finally:
+            self._closing.discard(ws)
+
+    async def _drain(self, ws, queue):
+        # ws.send waits while the socket is over its write limit, so frames
+        # leave the queue at the pace the client reads them.
+        try:
+            while queue:
+                frame, _ = queue.popleft()
+                await ws.send(frame)
+        except websockets.exceptions.ConnectionClosed:
+            queue.clear()
+        finally:
+            if self.queues.get(ws) is queue:
+                del self.queues[ws]
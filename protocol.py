@@ -0,0 +1,133 @@
+import json
+import struct
+
+# Negotiated as a WebSocket subprotocol when the connection is opened. A
+# client that offers no subprotocol gets plain JSON text frames.
+JSON = 'gomoku.json'
+COMPACT = 'gomoku.compact'
+SUBPROTOCOLS = [COMPACT, JSON]
+
+# Compact frames are binary; the first byte is a tag.
+TAG_JSON = 0
+TAG_MOVE = 1
+TAG_TURN_CHANGE = 2
+TAG_GAME_STATE = 3
+# A turn_change with the players' clocks (timed games).
+TAG_TURN_CLOCKS = 4
+# A move with the players' clocks (timed games).
+TAG_MOVE_CLOCKS = 5
+
+_MOVE = struct.Struct('!BBBBI')
+_TURN_CHANGE = struct.Struct('!BI')
+_GAME_STATE = struct.Struct('!BBI')
+# seq, then time and periods for the player to move and the other player,
+# then the length of the first id; the two ids follow.
+_TURN_CLOCKS = struct.Struct('!BIIBIBH')
+# The move, then clocks as in _TURN_CLOCKS, the mover's first.
+_MOVE_CLOCKS = struct.Struct('!BBBBIIBIBH')
+
+
+def select_subprotocol(connection, subprotocols):
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+def _pack_board(rows):
+    # Two bits per cell, four cells per byte, row-major.
+    out = bytearray((len(rows) * len(rows) + 3) // 4)
+    i = 0
+    for row in rows:
+        for cell in row:
+            if cell:
+                out[i >> 2] |= cell << ((i & 3) * 2)
+            i += 1
+    return bytes(out)
+
+
+def _unpack_board(data, size):
+    rows = []
+    i = 0
+    for _ in range(size):
+        row = []
+        for _ in range(size):
+            row.append((data[i >> 2] >> ((i & 3) * 2)) & 3)
+            i += 1
+        rows.append(row)
+    return rows
+
+
+def encode_json(message):
+    return json.dumps(message)
+
+
+def encode_compact(message):
+    msg_type = message.get('type')
+    if msg_type == 'move' and 'clocks' in message and 'seq' in message:
+        mover = message['player_id']
+        other = next(uid for uid in message['clocks'] if uid != mover)
+        mine, theirs = message['clocks'][mover], message['clocks'][other]
+        mover_id = mover.encode()
+        return (_MOVE_CLOCKS.pack(TAG_MOVE_CLOCKS, message['r'], message['c'], message['stone'], message['seq'],
+                                  mine['time'], mine['periods'], theirs['time'], theirs['periods'], len(mover_id))
+                + mover_id + other.encode())
+    if msg_type == 'move' and 'seq' in message:
+        return _MOVE.pack(TAG_MOVE, message['r'], message['c'], message['stone'], message['seq'])
+    if msg_type == 'turn_change' and 'clocks' in message and 'seq' in message:
+        current = message['current_turn']
+        other = next(uid for uid in message['clocks'] if uid != current)
+        mine, theirs = message['clocks'][current], message['clocks'][other]
+        current_id = current.encode()
+        return (_TURN_CLOCKS.pack(TAG_TURN_CLOCKS, message['seq'], mine['time'], mine['periods'], theirs['time'],
+                                  theirs['periods'], len(current_id)) + current_id + other.encode())
+    if msg_type == 'turn_change' and 'seq' in message:
+        return _TURN_CHANGE.pack(TAG_TURN_CHANGE, message['seq']) + message['current_turn'].encode()
+    if msg_type == 'game_state':
+        board = message['board']
+        rest = {k: v for k, v in message.items() if k not in ('type', 'board', 'seq')}
+        return (_GAME_STATE.pack(TAG_GAME_STATE, len(board), message['seq'])
+                + _pack_board(board) + json.dumps(rest, separators=(',', ':')).encode())
+    return bytes((TAG_JSON,)) + json.dumps(message, separators=(',', ':')).encode()
+
+
+def encode(message, encoding=None):
+    if encoding == COMPACT:
+        return encode_compact(message)
+    return encode_json(message)
+
+
+def decode(frame):
+    if isinstance(frame, str):
+        return json.loads(frame)
+
+    tag = frame[0]
+    if tag == TAG_MOVE:
+        _, r, c, stone, seq = _MOVE.unpack_from(frame)
+        return {'type': 'move', 'r': r, 'c': c, 'stone': stone, 'seq': seq}
+    if tag == TAG_TURN_CHANGE:
+        _, seq = _TURN_CHANGE.unpack_from(frame)
+        current_turn = bytes(frame[_TURN_CHANGE.size:]).decode()
+        return {'type': 'turn_change', 'current_turn': current_turn, 'seq': seq}
+    if tag == TAG_TURN_CLOCKS:
+        _, seq, time, periods, other_time, other_periods, length = _TURN_CLOCKS.unpack_from(frame)
+        ids = bytes(frame[_TURN_CLOCKS.size:])
+        current, other = ids[:length].decode(), ids[length:].decode()
+        clocks = {current: {'time': time, 'periods': periods}, other: {'time': other_time, 'periods': other_periods}}
+        return {'type': 'turn_change', 'current_turn': current, 'clocks': clocks, 'seq': seq}
+    if tag == TAG_MOVE_CLOCKS:
+        _, r, c, stone, seq, time, periods, other_time, other_periods, length = _MOVE_CLOCKS.unpack_from(frame)
+        ids = bytes(frame[_MOVE_CLOCKS.size:])
+        mover, other = ids[:length].decode(), ids[length:].decode()
+        clocks = {mover: {'time': time, 'periods': periods}, other: {'time': other_time, 'periods': other_periods}}
+        return {'type': 'move', 'r': r, 'c': c, 'stone': stone, 'clocks': clocks, 'seq': seq}
+    if tag == TAG_GAME_STATE:
+        _, size, seq = _GAME_STATE.unpack_from(frame)
+        board_end = _GAME_STATE.size + (size * size + 3) // 4
+        message = {'type': 'game_state', 'board': _unpack_board(frame[_GAME_STATE.size:board_end], size)}
+        message.update(json.loads(frame[board_end:]))
+        message['seq'] = seq
+        return message
+    if tag == TAG_JSON:
+        return json.loads(frame[1:])
+    raise ValueError(f"Unknown frame tag: {tag}")
@@ -0,0 +1,113 @@
+import asyncio
+
+import websockets
+
+SPECTATOR_BATCH_INTERVAL = 0.1
+SPECTATOR_CHUNK = 500
+SPECTATOR_BUFFER_LIMIT = 256 * 1024
+# Sequenced deltas, merged into one sync message per batch.
+DELTA_TYPES = ('move', 'turn_change')
+
+
+def batch_messages(messages, current_turn):
+    # Runs of two or more consecutive deltas become one sync message, the
+    # same one a client gets when it asks to catch up; everything else
+    # (chat, game_state, game_over, ...) keeps its place in the order.
+    batch = []
+    run = []
+    for message in messages + [None]:
+        if message is not None and message.get('type') in DELTA_TYPES and 'seq' in message:
+            run.append(message)
+            continue
+        if len(run) == 1:
+            batch.append(run[0])
+        elif run:
+            turn = current_turn
+            for event in run:
+                if event['type'] == 'turn_change':
+                    turn = event['current_turn']
+            batch.append({'type': 'sync', 'events': run, 'current_turn': turn, 'seq': run[-1]['seq']})
+        run = []
+        if message is not None:
+            batch.append(message)
+    return batch
+
+
+class SpectatorRelay:
+    # Delivery tier for spectators. A room writes to its players at once
+    # and queues the same messages here for its spectators; every interval
+    # each room's queue is flushed as one batch (see batch_messages), encoded
+    # once per encoding and written to the audience SPECTATOR_CHUNK sockets
+    # at a time with the loop free to serve other work between chunks. So
+    # however large the audience, handling a move only costs the players'
+    # writes plus a list append.
+    #
+    # A spectator whose send buffer is over buffer_limit, or that has frames
+    # waiting elsewhere (backlogged(ws)), gets nothing more and is marked
+    # lagging; once it has caught up it is sent the room's current
+    # game_state instead of the backlog.
+    def __init__(self, encode, interval=SPECTATOR_BATCH_INTERVAL, chunk=SPECTATOR_CHUNK,
+                 buffer_limit=SPECTATOR_BUFFER_LIMIT, backlogged=None):
+        self.encode = encode
+        self.backlogged = backlogged
+        self.interval = interval
+        self.chunk = chunk
+        self.buffer_limit = buffer_limit
+        self.lagging = set()
+        self._pending = {}
+        self._flush_handle = None
+
+    def push(self, room, message):
+        queue = self._pending.get(room)
+        if queue is None:
+            queue = self._pending[room] = []
+        queue.append(message)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.interval, self.flush)
+
+    def forget(self, ws):
+        self.lagging.discard(ws)
+
+    def flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        for room, messages in pending.items():
+            if room.spectators:
+                self.deliver(room, batch_messages(messages, room.current_turn_uid))
+
+    def deliver(self, room, batch):
+        groups = {}
+        resync = []
+        for ws in room.spectators:
+            transport = ws.transport
+            if transport is None:
+                continue
+            backlogged = self.backlogged is not None and self.backlogged(ws)
+            if ws in self.lagging:
+                if transport.get_write_buffer_size() == 0 and not backlogged:
+                    self.lagging.discard(ws)
+                    resync.append(ws)
+            elif backlogged or transport.get_write_buffer_size() > self.buffer_limit:
+                self.lagging.add(ws)
+            else:
+                groups.setdefault(ws.subprotocol, []).append(ws)
+
+        for encoding, group in groups.items():
+            frames = [self.encode(message, encoding) for message in batch]
+            self._send(group, frames, 0)
+        if resync:
+            # The snapshot already includes this batch.
+            state = room.get_full_game_state()
+            frames = {}
+            for ws in resync:
+                if ws.subprotocol not in frames:
+                    frames[ws.subprotocol] = self.encode(state, ws.subprotocol)
+                websockets.broadcast([ws], frames[ws.subprotocol])
+
+    def _send(self, group, frames, start):
+        chunk = group[start:start + self.chunk]
+        for frame in frames:
+            websockets.broadcast(chunk, frame)
+        if start + self.chunk < len(group):
+            asyncio.get_running_loop().call_soon(self._send, group, frames, start + self.chunk)
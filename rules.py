@@ -0,0 +1,153 @@
+from board import BLOCKED, BOARD_SIZE, Board
+
+DEFAULT_RULE = 'freestyle'
+# Opening name -> the phase a game with that opening starts in.
+OPENINGS = {'swap2': 'place3'}
+# Swap2: the first player places three stones (black, white, black). The
+# second player then plays black, plays white, or places two more (white,
+# black) and leaves the choice of colour to the first player. White moves
+# next in every case. A placing phase ends after a number of stones and
+# passes the turn to the player who chooses.
+SWAP2_PLACING = {'place3': (3, 'choose'), 'place2': (5, 'choose2')}
+SWAP2_CHOICES = {'choose': ('black', 'white', 'place2'), 'choose2': ('black', 'white')}
+
+
+class Rule:
+    # How a game is won and which moves are forbidden. A rule holds no
+    # per-game state, so one object of each serves every room; the board
+    # passed in carries the position.
+    name = None
+    # Whether forbidden() can refuse moves. handle_move only calls it when
+    # set, so rules without restrictions add nothing to a move.
+    restricts_moves = False
+    # Whether boards need cells (Board.line) for forbidden().
+    needs_cells = False
+    check_win = staticmethod(Board.check_win)
+
+    def new_board(self, size=BOARD_SIZE):
+        return Board(size, cells=self.needs_cells)
+
+    def forbidden(self, board, r, c, stone):
+        # Why stone may not be played at (r, c), or None. (r, c) is empty.
+        return None
+
+
+class Freestyle(Rule):
+    # Five or more in a row wins.
+    name = 'freestyle'
+
+
+class ExactFive(Rule):
+    # Exactly five in a row wins; six or more does not, for either colour.
+    name = 'exact'
+    check_win = staticmethod(Board.check_exact_win)
+
+
+# Renju line shapes, as (five, overline, fours, open_three) for the line
+# through a black move. Lines are the Board.line cells seen from black's
+# side: 0 empty, 1 black, BLOCKED for white or off the board. Every line
+# that shows up is classified once and looked up from then on; there are
+# at most 3 ** (2 * board.LINE_REACH) of them.
+_BLACK_VIEW = bytes.maketrans(b'\x02', bytes((BLOCKED,)))
+_SHAPES = {}
+
+
+def _run(cells, i):
+    # The ends of the run of black stones through i.
+    lo = hi = i
+    while lo > 0 and cells[lo - 1] == 1:
+        lo -= 1
+    while hi < len(cells) - 1 and cells[hi + 1] == 1:
+        hi += 1
+    return lo, hi
+
+
+def _makes_five(cells, e, centre):
+    # Whether a black stone at e makes exactly five through the centre, and
+    # the stones of that five other than e.
+    cells[e] = 1
+    lo, hi = _run(cells, centre)
+    cells[e] = 0
+    if hi - lo + 1 == 5:
+        return frozenset(i for i in range(lo, hi + 1) if i != e)
+    return None
+
+
+def _classify(line):
+    cells = bytearray(line)
+    centre = len(cells) // 2
+    cells[centre] = 1
+    lo, hi = _run(cells, centre)
+    if hi - lo + 1 == 5:
+        return True, False, 0, False
+    if hi - lo + 1 > 5:
+        return False, True, 0, False
+
+    # A four is four stones that one more makes exactly five; a straight
+    # four (two ways to finish the same stones) counts once.
+    empty = [i for i, cell in enumerate(cells) if cell == 0]
+    fours = set()
+    for e in empty:
+        stones = _makes_five(cells, e, centre)
+        if stones:
+            fours.add(stones)
+    if fours:
+        return False, False, len(fours), False
+
+    # An open three is one move from a straight four: four in a row with an
+    # empty cell at each end, each of which makes exactly five. Whether that
+    # move would itself be forbidden is not checked.
+    for e in empty:
+        cells[e] = 1
+        lo, hi = _run(cells, centre)
+        straight = (hi - lo + 1 == 4 and lo <= e <= hi and cells[lo - 1] == 0 and cells[hi + 1] == 0
+                    and _makes_five(cells, lo - 1, centre) and _makes_five(cells, hi + 1, centre))
+        cells[e] = 0
+        if straight:
+            return False, False, 0, True
+    return False, False, 0, False
+
+
+def line_shape(line):
+    shape = _SHAPES.get(line)
+    if shape is None:
+        shape = _SHAPES[line] = _classify(line)
+    return shape
+
+
+class Renju(Rule):
+    # Black must make exactly five and may not play a double three, a
+    # double four or an overline unless the move also makes five. White
+    # wins with five or more and has no restrictions.
+    name = 'renju'
+    restricts_moves = True
+    needs_cells = True
+
+    @staticmethod
+    def check_win(board, r, c, stone):
+        if stone == 1:
+            return board.check_exact_win(r, c, stone)
+        return board.check_win(r, c, stone)
+
+    def forbidden(self, board, r, c, stone):
+        if stone != 1:
+            return None
+        overline = False
+        fours = threes = 0
+        for d in board.shifts:
+            five, over, line_fours, three = line_shape(board.line(r, c, d).translate(_BLACK_VIEW))
+            if five:
+                return None
+            overline = overline or over
+            fours += line_fours
+            threes += three
+        if overline:
+            return 'overline'
+        if fours > 1:
+            return 'double four'
+        if threes > 1:
+            return 'double three'
+        return None
+
+
+RULES = {rule.name: rule() for rule in (Freestyle, ExactFive, Renju)}
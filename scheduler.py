@@ -0,0 +1,105 @@
+import asyncio
+import heapq
+import math
+
+TIMER_TICK = 0.1
+
+
+class TimerHandle:
+    __slots__ = ('scheduler', 'tick', 'callback', 'args')
+
+    def __init__(self, scheduler, tick, callback, args):
+        self.scheduler = scheduler
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        if self.scheduler is not None:
+            self.scheduler._cancel(self)
+
+    def cancelled(self):
+        return self.scheduler is None
+
+
+class Scheduler:
+    # A hashed timer wheel shared by every room. Deadlines are rounded up to
+    # TIMER_TICK and kept in one bucket per tick, so arming and cancelling a
+    # timer are set operations. A heap of the occupied ticks tells us when
+    # the next bucket is due and the event loop is only woken for that tick.
+    def __init__(self, tick=TIMER_TICK):
+        self.tick = tick
+        self.wakeups = 0
+        self.fired = 0
+        self._buckets = {}
+        self._ticks = []
+        self._wakeup = None
+        self._wakeup_tick = None
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def call_later(self, delay, callback, *args):
+        loop = asyncio.get_running_loop()
+        return self.call_at(loop.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        tick = math.ceil(when / self.tick)
+        handle = TimerHandle(self, tick, callback, args)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = set()
+            heapq.heappush(self._ticks, tick)
+        bucket.add(handle)
+        if self._wakeup_tick is None or tick < self._wakeup_tick:
+            self._arm()
+        return handle
+
+    def _cancel(self, handle):
+        handle.scheduler = None
+        bucket = self._buckets.get(handle.tick)
+        if bucket is not None:
+            bucket.discard(handle)
+            if not bucket:
+                # The stale heap entry is skipped when it reaches the top.
+                del self._buckets[handle.tick]
+
+    def _arm(self):
+        while self._ticks and self._ticks[0] not in self._buckets:
+            heapq.heappop(self._ticks)
+
+        next_tick = self._ticks[0] if self._ticks else None
+        if next_tick == self._wakeup_tick:
+            return
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        self._wakeup_tick = next_tick
+        if next_tick is not None:
+            loop = asyncio.get_running_loop()
+            self._wakeup = loop.call_at(next_tick * self.tick, self._run)
+
+    def _run(self):
+        self.wakeups += 1
+        self._wakeup = None
+        self._wakeup_tick = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        while self._ticks and self._ticks[0] * self.tick <= now:
+            bucket = self._buckets.pop(heapq.heappop(self._ticks), None)
+            if not bucket:
+                continue
+            for handle in bucket:
+                # Cancelled by a callback run earlier from this bucket.
+                if handle.scheduler is None:
+                    continue
+                handle.scheduler = None
+                self.fired += 1
+                try:
+                    result = handle.callback(*handle.args)
+                    if asyncio.iscoroutine(result):
+                        asyncio.ensure_future(result)
+                except Exception as e:
+                    print(f"Timer error: {e}")
+        self._arm()
@@ -1,440 +1,1483 @@
+import argparse
 import asyncio
-import json
 import websockets
+import multiprocessing
+import os
 import random
 import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+import messages
+import protocol
+from archive import GAME_LIST_LIMIT, GAME_LIST_MAX, Archive, decode_moves, encode_move
+from backplane import Backplane
+from board import BOARD_SIZE
+from chat import ChatBatcher, ChatLimiter
+from clock import TimeControl
+from cluster import Cluster, RemoteRoom, run_workers
+from directory import ROOM_STATES, RoomDirectory
+from heartbeat import HEARTBEAT_INTERVAL, HEARTBEAT_MISSES, Heartbeat
+from journal import Journal
+from lobby import Lobby
+from matchmaking import Matchmaker, Ratings
+from messages import MAX_FRAME_SIZE, Dispatcher, InvalidMessage
+from metrics import Metrics
+from outbox import DROPPABLE_TYPES, Outboxes
+from relay import SPECTATOR_BATCH_INTERVAL, SpectatorRelay
+from rules import DEFAULT_RULE, OPENINGS, RULES, SWAP2_CHOICES, SWAP2_PLACING
+from scheduler import Scheduler
 
 GAME_ROOMS = {}
 RECONNECTION_TIME = 30
 MOVE_TIMER_DURATION = 30
+MOVE_TIMER_WARNING = 10
+SYNC_HISTORY_LIMIT = 512
+# A sync event is two bytes: a move as the row (with the stone in the top
+# bit) and column, or TURN_EVENT and the index of the player to move.
+TURN_EVENT = 0xFF
+# Rooms nobody is playing in are removed after this many seconds without a
+# change (see GameRoom.arm_reaper).
+ROOM_TTLS = {'WAITING': 30 * 60, 'FINISHED': 5 * 60}
+SEND_BUFFER_LIMIT = 256 * 1024
+# The bot's search budget per move; well inside the move timer so a busy
+# engine pool still answers before the turn is skipped.
+BOT_MOVE_TIME = 2.0
+BOT_WORKERS = 2
+BOT_NAME = 'Bot'
+# Replays sleep at most this long between moves, however long the player
+# thought, and run at 1/4 to 64 times real time.
+REPLAY_MAX_DELAY = 3.0
+REPLAY_SPEEDS = (0.25, 64)
+
+class Player:
+    # A seat in a room. reconnect_timer is armed while the player is
+    # disconnected from a game in progress.
+    __slots__ = ('id', 'name', 'stone', 'ws', 'token', 'reconnect_timer')
+
+    def __init__(self, user_id, name, stone, ws=None, token=None):
+        self.id = user_id
+        self.name = name
+        self.stone = stone
+        self.ws = ws
+        self.token = token
+        self.reconnect_timer = None
 
 class GameRoom:
-    def __init__(self, room_id, name):
+    # Rooms are kept compact since a busy server holds many of them: slotted
+    # attributes, bitboards, Player records, and the sync history and move
+    # list as byte strings rather than message dicts.
+    __slots__ = ('room_id', 'name', 'players', 'spectators', 'board', 'rule', 'opening', 'phase', 'current_turn_uid',
+                 'game_state', 'win_line', 'move_timer', 'seq', 'events', 'rated', 'bot_uid', 'moves', 'started_at',
+                 'last_move_at', 'reap_timer', 'time_control', 'clocks', 'turn_started')
+
+    def __init__(self, room_id, name, size=BOARD_SIZE, rule=DEFAULT_RULE, opening=None, time_control=None):
         self.room_id = room_id
         self.name = name
         self.players = {}
         self.spectators = {}
-        self.board = [[0 for _ in range(15)] for _ in range(15)]
+        self.rule = RULES[rule]
+        self.board = self.rule.new_board(size)
+        # The opening played (see rules.OPENINGS) and, while it lasts, its
+        # current phase; stones placed in the opening alternate colours
+        # whoever places them.
+        self.opening = opening
+        self.phase = None
         self.current_turn_uid = None
         self.game_state = 'WAITING'
         self.win_line = []
-        self.timer_task = None
-        self.player_tokens = {}
-        self.reconnection_timers = {}
+        self.move_timer = None
+        self.seq = 0
+        # The last SYNC_HISTORY_LIMIT move and turn_change events, two bytes
+        # each (see TURN_EVENT); get_sync turns them back into messages.
+        self.events = bytearray()
+        # Quick match games update the players' ratings when they end.
+        self.rated = False
+        # Player id of the server-side bot, if one holds a seat.
+        self.bot_uid = None
+        # Moves so far, encoded for the archive (archive.encode_move).
+        self.moves = bytearray()
+        self.started_at = None
+        self.last_move_at = None
+        self.reap_timer = None
+        # With a time control (clock.TimeControl), each player's clock by
+        # id, charged up to turn_started (time.monotonic()); without one a
+        # turn is skipped after MOVE_TIMER_DURATION.
+        self.time_control = TimeControl(time_control) if time_control else None
+        self.clocks = {}
+        self.turn_started = None
+
+    def snapshot(self):
+        return {
+            'room_id': self.room_id,
+            'name': self.name,
+            'players': [[uid, p.name, p.stone, p.token] for uid, p in self.players.items()],
+            'size': self.board.size,
+            'rule': self.rule.name,
+            'opening': self.opening,
+            'phase': self.phase,
+            'board': [self.board.black, self.board.white],
+            'current_turn': self.current_turn_uid,
+            'game_state': self.game_state,
+            'win_line': self.win_line,
+            'seq': self.seq,
+            'rated': self.rated,
+            'bot': self.bot_uid,
+            'moves': self.moves.hex(),
+            'started': self.started_at,
+            'time_control': self.time_control and self.time_control.name,
+            'clocks': self.clocks
+        }
+
+    @classmethod
+    def from_snapshot(cls, state):
+        room = cls(state['room_id'], state['name'], state.get('size', BOARD_SIZE), state.get('rule', DEFAULT_RULE),
+                   state.get('opening'), state.get('time_control'))
+        room.phase = state.get('phase')
+        for uid, name, stone, token in state['players']:
+            room.players[uid] = Player(uid, name, stone, token=token)
+        room.board.load(*state['board'])
+        room.current_turn_uid = state['current_turn']
+        room.game_state = state['game_state']
+        room.win_line = [tuple(cell) for cell in state['win_line']]
+        room.seq = state['seq']
+        room.rated = state['rated']
+        room.bot_uid = state.get('bot')
+        room.moves = bytearray.fromhex(state.get('moves', ''))
+        room.started_at = state.get('started')
+        room.clocks = state.get('clocks', {})
+        return room
 
     def get_room_info(self):
-        player_names = [p['name'] for p in self.players.values()]
+        player_names = [p.name for p in self.players.values()]
         return {
             'room_id': self.room_id,
             'name': self.name,
             'player_count': len(self.players),
-            'spectator_count': len(self.spectators),
+            'spectator_count': len(self.spectators) + remote_spectators(self.room_id),
             'player_names': player_names,
-            'game_state': self.game_state
+            'game_state': self.game_state,
+            'size': self.board.size,
+            'rule': self.rule.name,
+            'opening': self.opening,
+            'time_control': self.time_control and self.time_control.name
         }
 
     def get_full_game_state(self):
-        return {
+        state = {
             'type': 'game_state',
-            'board': self.board,
+            'board': self.board.to_rows(),
             'current_turn': self.current_turn_uid,
             'game_state': self.game_state,
-            'players': {uid: p['name'] for uid, p in self.players.items()},
-            'win_line': self.win_line
+            'players': {uid: p.name for uid, p in self.players.items()},
+            'stones': {uid: p.stone for uid, p in self.players.items()},
+            'rule': self.rule.name,
+            'opening': self.opening,
+            'phase': self.phase,
+            'win_line': self.win_line,
+            'seq': self.seq
         }
+        if self.time_control:
+            state['time_control'] = self.time_control.name
+            state['clocks'] = self.clock_views()
+        return state
 
-    async def broadcast_room_info(self):
-        info = self.get_room_info()
-        lobby_clients = [c for c in ALL_CLIENTS.values() if c['room_id'] is None]
-        await broadcast_message(lobby_clients, {'type': 'room_update', 'room': info})
+    def clock_views(self):
+        # Every player's clock as of now, for clients to count down from.
+        elapsed = time.monotonic() - self.turn_started if self.game_state == 'IN_PROGRESS' else 0.0
+        return {uid: self.time_control.view(clock, elapsed if uid == self.current_turn_uid else 0.0)
+                for uid, clock in self.clocks.items()}
 
-    async def broadcast(self, message, include_spectators=True, exclude_ws=None):
+    def record_event(self, message):
+        self.seq += 1
+        message['seq'] = self.seq
+        if message['type'] == 'move':
+            self.events += bytes(((message['stone'] - 1) << 7 | message['r'], message['c']))
+        else:
+            self.events += bytes((TURN_EVENT, list(self.players).index(message['current_turn'])))
+        if len(self.events) > 2 * SYNC_HISTORY_LIMIT:
+            del self.events[:2]
+        return message
+
+    def get_sync(self, last_seq):
+        missed = self.seq - last_seq if isinstance(last_seq, int) else -1
+        # Events in an opening do not say whose stones they were.
+        if self.game_state != 'IN_PROGRESS' or self.phase or missed < 0 or missed > len(self.events) // 2:
+            return self.get_full_game_state()
+        player_uids = list(self.players)
+        stones = {p.stone: uid for uid, p in self.players.items()}
+        events = []
+        seq = self.seq - missed
+        for i in range(len(self.events) - 2 * missed, len(self.events), 2):
+            seq += 1
+            first, second = self.events[i], self.events[i + 1]
+            if first == TURN_EVENT:
+                events.append({'type': 'turn_change', 'current_turn': player_uids[second], 'seq': seq})
+            else:
+                stone = (first >> 7) + 1
+                events.append({'type': 'move', 'player_id': stones[stone], 'r': first & 0x7F, 'c': second, 'stone': stone, 'seq': seq})
+        sync = {
+            'type': 'sync',
+            'events': events,
+            'current_turn': self.current_turn_uid,
+            'seq': self.seq
+        }
+        if self.time_control:
+            sync['clocks'] = self.clock_views()
+        return sync
+
+    def broadcast_room_info(self):
+        LOBBY.room_changed(self)
+        DIRECTORY.room_changed(self)
+        self.arm_reaper()
+
+    def arm_reaper(self):
+        # Called on every change to the room. Games in progress end through
+        # their own move and reconnection timers.
+        if self.reap_timer:
+            self.reap_timer.cancel()
+            self.reap_timer = None
+        ttl = ROOM_TTLS.get(self.game_state)
+        if ttl:
+            self.reap_timer = SCHEDULER.call_later(ttl, self.reap)
+
+    def reap(self):
+        # Everyone still here goes back to the lobby. A finished game was
+        # archived when it ended.
+        self.reap_timer = None
+        if GAME_ROOMS.get(self.room_id) is not self:
+            return
+        clients = [p.ws for p in self.players.values() if p.ws] + list(self.spectators)
+        fan_out(clients, {'type': 'room_closed', 'room_id': self.room_id})
+        for ws in clients:
+            RELAY.forget(ws)
+            if ws in ALL_CLIENTS:
+                set_client_room(ws, None, None)
+        self.spectators.clear()
+        print(f"Room {self.room_id} closed after {ROOM_TTLS[self.game_state]} seconds {self.game_state.lower()}")
+        remove_room(self.room_id)
+
+    def broadcast(self, message, include_spectators=True, exclude_ws=None):
+        # Players are written to now, spectators after them.
         clients = []
         for p in self.players.values():
-            if p['ws'] and p['ws'] != exclude_ws:
-                clients.append(p['ws'])
-        
-        if include_spectators:
-            for ws in self.spectators.keys():
-                if ws != exclude_ws:
-                    clients.append(ws)
+            if p.ws and p.ws != exclude_ws:
+                clients.append(p.ws)
+        fan_out(clients, message)
 
-        tasks = [send_message(client, message) for client in clients]
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        if include_spectators:
+            self.broadcast_to_spectators(message)
 
-    async def broadcast_to_spectators(self, message, exclude_ws=None):
-        clients = []
-        for ws in self.spectators.keys():
-            if ws != exclude_ws:
-                clients.append(ws)
-        tasks = [send_message(client, message) for client in clients]
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+    def broadcast_to_spectators(self, message):
+        # Through the relay's next batch, or right away with
+        # --spectator-delay 0. Other nodes watching the room get it through
+        # the broker.
+        if WATCHERS and self.room_id in WATCHERS:
+            BACKPLANE.publish_room(self.room_id, message)
+        if not self.spectators:
+            return
+        if RELAY.interval:
+            RELAY.push(self, message)
+        else:
+            fan_out(list(self.spectators), message)
 
     async def add_player(self, ws, user_id, user_name):
         if len(self.players) >= 2:
-            await ws.send(json.dumps({'type': 'error', 'message': 'This room is full.'}))
+            await send_message(ws, {'type': 'error', 'message': 'This room is full.'})
             return
 
-        token = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-        self.player_tokens[user_id] = token
-        
-        self.players[user_id] = {'ws': ws, 'name': user_name, 'id': user_id, 'stone': 0}
-        
-        if len(self.players) == 1:
-            self.players[user_id]['stone'] = 1
-        else:
-            self.players[user_id]['stone'] = 2
-        
-        await ws.send(json.dumps({'type': 'join_success', 'room_id': self.room_id, 'token': token, 'your_stone': self.players[user_id]['stone']}))
-        await self.broadcast_room_info()
+        player = self.seat_player(ws, user_id, user_name)
+        await send_message(ws, {'type': 'join_success', 'room_id': self.room_id, 'token': player.token, 'your_stone': player.stone})
+        self.broadcast_room_info()
         
         if len(self.players) == 2:
             await self.start_game()
 
+    def seat_player(self, ws, user_id, user_name):
+        token = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
+        register_session(self.room_id, user_id, token)
+        journal_event({'e': 'join', 'room_id': self.room_id, 'user_id': user_id, 'user_name': user_name, 'token': token, 't': time.time()})
+        player = self.players[user_id] = Player(user_id, user_name, len(self.players) + 1, ws, token)
+        return player
+
+    def add_bot(self):
+        self.bot_uid = f'bot-{self.room_id}'
+        journal_event({'e': 'join', 'room_id': self.room_id, 'user_id': self.bot_uid, 'user_name': BOT_NAME, 'token': None, 'bot': True,
+                       't': time.time()})
+        self.players[self.bot_uid] = Player(self.bot_uid, BOT_NAME, len(self.players) + 1)
+
+    def is_empty(self):
+        return not self.spectators and all(uid == self.bot_uid for uid in self.players)
+
+    def remove_player(self, user_id):
+        player = self.players.pop(user_id)
+        unregister_session(self.room_id, user_id, player.token)
+        journal_event({'e': 'leave', 'room_id': self.room_id, 'user_id': user_id})
+
     async def add_spectator(self, ws, user_id=None, user_name=None):
         self.spectators[ws] = {
             'user_id': user_id or f'spec_{id(ws) % 10000}',
             'user_name': user_name or f'Spectator-{id(ws) % 1000}'
         }
-        await ws.send(json.dumps({'type': 'spectate_success', 'room_id': self.room_id}))
-        await ws.send(json.dumps(self.get_full_game_state()))
-        await self.broadcast_room_info()
+        await send_message(ws, {'type': 'spectate_success', 'room_id': self.room_id})
+        await send_message(ws, self.get_full_game_state())
+        self.broadcast_room_info()
 
-    async def handle_reconnection(self, ws, user_id, token=None):
-        if user_id not in self.players:
-            await ws.send(json.dumps({'type': 'error', 'message': 'Invalid user ID for this room.'}))
+    async def handle_reconnection(self, ws, user_id, token=None, last_seq=None):
+        if user_id not in self.players or user_id == self.bot_uid:
+            await send_message(ws, {'type': 'error', 'message': 'Invalid user ID for this room.'})
             return
         
+        player = self.players[user_id]
         if token:
-            if user_id not in self.player_tokens or self.player_tokens[user_id] != token:
-                await ws.send(json.dumps({'type': 'error', 'message': 'Invalid reconnection token.'}))
+            if player.token != token:
+                await send_message(ws, {'type': 'error', 'message': 'Invalid reconnection token.'})
                 return
         else:
-            if self.game_state != 'IN_PROGRESS' or self.players[user_id]['ws'] is not None:
-                if user_id not in self.reconnection_timers:
-                    await ws.send(json.dumps({'type': 'error', 'message': 'No active reconnection session found. Please provide token.'}))
+            if self.game_state != 'IN_PROGRESS' or player.ws is not None:
+                if player.reconnect_timer is None:
+                    await send_message(ws, {'type': 'error', 'message': 'No active reconnection session found. Please provide token.'})
                     return
 
-        if user_id in self.reconnection_timers:
-            self.reconnection_timers[user_id].cancel()
-            del self.reconnection_timers[user_id]
+        if player.reconnect_timer:
+            player.reconnect_timer.cancel()
+            player.reconnect_timer = None
             
-        self.players[user_id]['ws'] = ws
-        ALL_CLIENTS[ws] = {'room_id': self.room_id, 'user_id': user_id}
+        player.ws = ws
+        set_client_room(ws, self.room_id, user_id)
         
-        await ws.send(json.dumps({'type': 'reconnect_success', 'room_id': self.room_id, 'your_stone': self.players[user_id]['stone']}))
-        await ws.send(json.dumps(self.get_full_game_state()))
+        await send_message(ws, {'type': 'reconnect_success', 'room_id': self.room_id, 'your_stone': player.stone})
+        await send_message(ws, self.get_sync(last_seq))
         
-        player_name = self.players[user_id]['name']
-        await self.broadcast({'type': 'chat', 'sender': 'System', 'message': f'Player {player_name} has reconnected.'}, exclude_ws=ws)
+        self.broadcast({'type': 'chat', 'sender': 'System', 'message': f'Player {player.name} has reconnected.'}, exclude_ws=ws)
         print(f"Player {user_id} reconnected to room {self.room_id}")
 
     async def start_game(self):
         self.game_state = 'IN_PROGRESS'
+        self.started_at = self.last_move_at = time.time()
         player_uids = list(self.players.keys())
         self.current_turn_uid = player_uids[0]
+        self.phase = OPENINGS.get(self.opening)
+        if self.time_control:
+            self.clocks = {uid: self.time_control.new_clock() for uid in player_uids}
+            self.turn_started = time.monotonic()
         
         message = self.get_full_game_state()
-        await self.broadcast(message)
-        await self.broadcast_room_info()
-        await self.start_move_timer()
+        self.broadcast(message)
+        self.broadcast_room_info()
+        self.start_move_timer()
+        self.schedule_bot_move()
         print(f"Game started in room {self.room_id}")
 
-    async def start_move_timer(self):
-        if self.timer_task and not self.timer_task.done():
-            self.timer_task.cancel()
-            try:
-                await self.timer_task
-            except asyncio.CancelledError:
-                pass
-            
-        self.timer_task = asyncio.create_task(self.move_timer_logic())
+    def cancel_move_timer(self):
+        if self.move_timer:
+            self.move_timer.cancel()
+            self.move_timer = None
 
-    async def move_timer_logic(self):
-        try:
-            if self.current_turn_uid not in self.players:
+    def start_move_timer(self):
+        self.cancel_move_timer()
+        if self.time_control:
+            # The player's clock runs from now; nothing counts it down, the
+            # only timer is for the moment their flag would fall.
+            self.turn_started = time.monotonic()
+            clock = self.clocks[self.current_turn_uid]
+            self.move_timer = SCHEDULER.call_later(self.time_control.left(clock), self.flag_fell)
+            return
+        self.move_timer = SCHEDULER.call_later(MOVE_TIMER_DURATION - MOVE_TIMER_WARNING, self.move_timer_warning)
+
+    def move_timer_warning(self):
+        if self.game_state != 'IN_PROGRESS' or self.current_turn_uid not in self.players:
+            self.move_timer = None
+            return
+        current_player_name = self.players[self.current_turn_uid].name
+        self.broadcast({'type': 'timer_notification', 'player': self.current_turn_uid, 'time_left': MOVE_TIMER_WARNING, 'player_name': current_player_name})
+        self.move_timer = SCHEDULER.call_later(MOVE_TIMER_WARNING, self.move_timer_expired)
+
+    def move_timer_expired(self):
+        self.move_timer = None
+        if self.game_state == 'IN_PROGRESS' and self.current_turn_uid in self.players:
+            current_player_name = self.players[self.current_turn_uid].name
+            if self.phase:
+                # Skipping a turn would leave the opening unfinished.
+                self.broadcast({'type': 'chat', 'sender': 'System', 'message': f"Player {current_player_name} ran out of time in the opening."})
+                self.forfeit(self.current_turn_uid)
+                self.broadcast_room_info()
                 return
-            current_player_name = self.players[self.current_turn_uid]['name']
-            for i in range(MOVE_TIMER_DURATION, -1, -1):
-                if self.game_state != 'IN_PROGRESS' or self.current_turn_uid not in self.players:
-                    return
-                if i == 10:
-                    await self.broadcast({'type': 'timer_notification', 'player': self.current_turn_uid, 'time_left': i, 'player_name': current_player_name})
-                await asyncio.sleep(1)
-            
-            if self.game_state == 'IN_PROGRESS' and self.current_turn_uid in self.players:
-                await self.broadcast({'type': 'chat', 'sender': 'System', 'message': f"Player {current_player_name} ran out of time. Turn skipped."})
-                await self.next_turn()
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            print(f"Timer error: {e}")
+            self.broadcast({'type': 'chat', 'sender': 'System', 'message': f"Player {current_player_name} ran out of time. Turn skipped."})
+            journal_event({'e': 'skip', 'room_id': self.room_id})
+            self.next_turn()
 
-    def check_win(self, r, c, stone):
-        directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
-        for dr, dc in directions:
-            count = 1
-            line = [(r, c)]
-            
-            for i in range(1, 5):
-                nr, nc = r + dr * i, c + dc * i
-                if 0 <= nr < 15 and 0 <= nc < 15 and self.board[nr][nc] == stone:
-                    count += 1
-                    line.append((nr, nc))
-                else:
-                    break
-                    
-            for i in range(1, 5):
-                nr, nc = r - dr * i, c - dc * i
-                if 0 <= nr < 15 and 0 <= nc < 15 and self.board[nr][nc] == stone:
-                    count += 1
-                    line.append((nr, nc))
-                else:
-                    break
-            
-            if count >= 5:
-                return line
-        return None
+    def charge_clock(self, user_id):
+        # With a move or choice from the player on turn: charges them the
+        # time since their turn started. False, and the game lost, if their
+        # flag fell before it arrived.
+        now = time.monotonic()
+        clock = self.time_control.charge(self.clocks[user_id], now - self.turn_started)
+        if clock is None:
+            self.flag_fell()
+            return False
+        self.clocks[user_id] = clock
+        self.turn_started = now
+        return True
+
+    def journal_clock(self, event, user_id):
+        if self.time_control:
+            clock = self.clocks[user_id]
+            event['clock'] = [round(clock[0], 3), clock[1]]
+        journal_event(event)
 
-    async def handle_move(self, user_id, move):
+    def flag_fell(self):
+        self.move_timer = None
+        if self.game_state != 'IN_PROGRESS' or self.current_turn_uid not in self.players:
+            return
+        left = self.time_control.left(self.clocks[self.current_turn_uid], time.monotonic() - self.turn_started)
+        if left > 0:
+            # Timers fire on the scheduler's tick; not quite yet.
+            self.move_timer = SCHEDULER.call_later(left, self.flag_fell)
+            return
+        current_player_name = self.players[self.current_turn_uid].name
+        self.broadcast({'type': 'chat', 'sender': 'System', 'message': f"Player {current_player_name} ran out of time."})
+        self.forfeit(self.current_turn_uid)
+        self.broadcast_room_info()
+
+    async def handle_move(self, user_id, r, c):
         if user_id != self.current_turn_uid:
             return
         
         if self.game_state != 'IN_PROGRESS':
             return
             
-        try:
-            r, c = int(move['r']), int(move['c'])
-            if not (0 <= r < 15 and 0 <= c < 15 and self.board[r][c] == 0):
+        if not (self.board.in_bounds(r, c) and self.board.is_empty(r, c)):
+            return
+
+        if self.phase:
+            if self.phase not in SWAP2_PLACING:
+                return
+            stone = 1 + self.board.stones % 2
+        else:
+            stone = self.players[user_id].stone
+        if self.rule.restricts_moves:
+            reason = self.rule.forbidden(self.board, r, c, stone)
+            if reason:
+                if self.players[user_id].ws:
+                    await send_message(self.players[user_id].ws, {'type': 'error', 'message': f'Forbidden move: {reason}.'})
                 return
-        except:
+        if self.time_control and not self.charge_clock(user_id):
             return
 
-        if self.timer_task and not self.timer_task.done():
-            self.timer_task.cancel()
-            try:
-                await self.timer_task
-            except asyncio.CancelledError:
-                pass
+        self.cancel_move_timer()
 
-        stone = self.players[user_id]['stone']
-        self.board[r][c] = stone
+        self.board.place(r, c, stone)
+        now = time.time()
+        elapsed = now - (self.last_move_at or now)
+        self.last_move_at = now
+        self.moves += encode_move(r, c, stone, elapsed)
+        self.journal_clock({'e': 'move', 'room_id': self.room_id, 'r': r, 'c': c, 'dt': round(elapsed, 2)}, user_id)
         
-        win_line = self.check_win(r, c, stone)
+        win_line = self.rule.check_win(self.board, r, c, stone)
         
         if win_line:
             self.game_state = 'FINISHED'
             self.win_line = win_line
             
-            winner_name = self.players[user_id]['name']
+            winner_name = self.players[user_id].name
             message = self.get_full_game_state()
-            await self.broadcast(message)
-            await self.broadcast({'type': 'game_over', 'winner_name': winner_name, 'winner_id': user_id, 'line': win_line})
-            await self.broadcast_room_info()
+            self.broadcast(message)
+            self.broadcast({'type': 'game_over', 'winner_name': winner_name, 'winner_id': user_id, 'line': win_line})
+            self.record_result(user_id)
+            self.archive_game(user_id)
+            self.broadcast_room_info()
             print(f"Game ended in room {self.room_id}. Winner: {winner_name}")
         else:
-            await self.broadcast({'type': 'move', 'player_id': user_id, 'r': r, 'c': c, 'stone': stone})
-            await self.next_turn()
+            message = {'type': 'move', 'player_id': user_id, 'r': r, 'c': c, 'stone': stone}
+            if self.time_control:
+                # In a swap2 placing phase no turn_change follows.
+                message['clocks'] = self.clock_views()
+            self.broadcast(self.record_event(message))
+            if self.phase:
+                if self.end_placing():
+                    self.broadcast(self.get_full_game_state())
+                self.start_move_timer()
+                self.schedule_bot_move()
+            else:
+                self.next_turn()
+
+    def other_player(self, user_id):
+        return next((uid for uid in self.players if uid != user_id), None)
+
+    def end_placing(self):
+        # After a stone placed in a swap2 placing phase: once the phase has
+        # all its stones, the other player is to choose colours. The seq
+        # moves on and the event history restarts, so a client that missed
+        # this gets the full game state when it syncs.
+        stones, next_phase = SWAP2_PLACING[self.phase]
+        if self.board.stones < stones:
+            return False
+        self.phase = next_phase
+        self.current_turn_uid = self.other_player(self.current_turn_uid)
+        self.seq += 1
+        self.events.clear()
+        return True
+
+    def apply_choice(self, user_id, choice):
+        # Returns an error message, or None once the choice is made.
+        if self.game_state != 'IN_PROGRESS' or self.phase not in SWAP2_CHOICES or user_id != self.current_turn_uid:
+            return 'There is no colour to choose now.'
+        if choice not in SWAP2_CHOICES[self.phase]:
+            return f"Choose one of: {', '.join(SWAP2_CHOICES[self.phase])}."
+        if choice == 'place2':
+            self.phase = 'place2'
+        else:
+            chooser, other = self.players[user_id], self.players[self.other_player(user_id)]
+            chooser.stone = 1 if choice == 'black' else 2
+            other.stone = 3 - chooser.stone
+            self.phase = None
+            self.current_turn_uid = chooser.id if chooser.stone == 2 else other.id
+        self.seq += 1
+        self.events.clear()
+        return None
+
+    async def handle_choice(self, ws, user_id, choice):
+        # A choice is a move on the clock.
+        if (self.time_control and self.game_state == 'IN_PROGRESS' and user_id == self.current_turn_uid
+                and choice in SWAP2_CHOICES.get(self.phase, ()) and not self.charge_clock(user_id)):
+            return
+        error = self.apply_choice(user_id, choice)
+        if error:
+            if ws:
+                await send_message(ws, {'type': 'error', 'message': error})
+            return
+        self.journal_clock({'e': 'choose', 'room_id': self.room_id, 'user_id': user_id, 'choice': choice}, user_id)
+        self.broadcast(self.get_full_game_state())
+        self.start_move_timer()
+        self.schedule_bot_move()
 
-    async def next_turn(self):
+    def next_turn(self):
         player_uids = list(self.players.keys())
         if self.current_turn_uid == player_uids[0]:
             self.current_turn_uid = player_uids[1]
         else:
             self.current_turn_uid = player_uids[0]
             
-        await self.broadcast({'type': 'turn_change', 'current_turn': self.current_turn_uid})
-        await self.start_move_timer()
+        message = {'type': 'turn_change', 'current_turn': self.current_turn_uid}
+        if self.time_control:
+            message['clocks'] = self.clock_views()
+        self.broadcast(self.record_event(message))
+        self.start_move_timer()
+        self.schedule_bot_move()
+
+    def schedule_bot_move(self):
+        if self.bot_uid and self.current_turn_uid == self.bot_uid and self.game_state == 'IN_PROGRESS':
+            if self.phase:
+                # The engine cannot judge a swap2 position; it takes white,
+                # which moves next.
+                asyncio.ensure_future(self.handle_choice(None, self.bot_uid, 'white'))
+            else:
+                asyncio.ensure_future(self.play_bot_move())
 
-    async def handle_chat(self, user_id, message):
-        sender_name = self.players[user_id]['name']
+    async def play_bot_move(self):
+        # The search runs in the engine pool; the loop keeps serving other
+        # rooms meanwhile. The move is dropped if the turn moved on (timer
+        # skip, forfeit, room removed) before the engine answered.
+        seq = self.seq
+        stone = self.players[self.bot_uid].stone
+        think = BOT_MOVE_TIME
+        if self.time_control:
+            think = min(think, self.time_control.left(self.clocks[self.bot_uid]) / 10)
+        deadline = time.time() + think
+        try:
+            r, c, nodes, depth = await asyncio.get_running_loop().run_in_executor(
+                engine_pool(), engine.search_move, self.room_id, self.board.black, self.board.white, stone, deadline, self.board.size)
+        except Exception as e:
+            print(f"Bot search failed in room {self.room_id}: {e}")
+            return
+        if self.seq != seq or self.current_turn_uid != self.bot_uid or GAME_ROOMS.get(self.room_id) is not self:
+            return
+        await self.handle_move(self.bot_uid, r, c)
+
+    async def handle_chat(self, ws, user_id, message):
+        if not CHAT_LIMITER.allow(user_id):
+            await send_chat_limited(ws)
+            return
+        sender_name = self.players[user_id].name
         chat_msg = {'type': 'chat', 'sender': sender_name, 'message': message}
-        await self.broadcast(chat_msg)
+        CHAT.push(self, chat_msg)
         
     async def handle_spectator_chat(self, ws, message):
         if ws not in self.spectators:
             await send_message(ws, {'type': 'error', 'message': 'Only spectators can use spectator chat.'})
             return
+        if not CHAT_LIMITER.allow(self.spectators[ws]['user_id']):
+            await send_chat_limited(ws)
+            return
         
         sender_name = self.spectators[ws]['user_name']
         chat_msg = {'type': 'spectator_chat', 'sender': sender_name, 'message': message}
-        await self.broadcast_to_spectators(chat_msg, exclude_ws=None)
+        CHAT.push(self, chat_msg)
 
     async def handle_client_disconnect(self, ws, user_id):
         if user_id in self.players:
-            player_name = self.players[user_id]['name']
-            self.players[user_id]['ws'] = None
+            player = self.players[user_id]
+            player.ws = None
             
             if self.game_state == 'IN_PROGRESS':
-                await self.broadcast({'type': 'chat', 'sender': 'System', 'message': f'Player {player_name} has disconnected. They have {RECONNECTION_TIME} seconds to reconnect.'}, exclude_ws=ws)
+                self.broadcast({'type': 'chat', 'sender': 'System', 'message': f'Player {player.name} has disconnected. They have {RECONNECTION_TIME} seconds to reconnect.'}, exclude_ws=ws)
                 
-                timer = asyncio.create_task(self.start_reconnection_timer(user_id))
-                self.reconnection_timers[user_id] = timer
+                player.reconnect_timer = SCHEDULER.call_later(RECONNECTION_TIME, self.expire_reconnection, user_id)
             else:
-                del self.players[user_id]
-                del self.player_tokens[user_id]
-                await self.broadcast_room_info()
+                self.remove_player(user_id)
+                self.broadcast_room_info()
 
         elif ws in self.spectators:
             del self.spectators[ws]
-            await self.broadcast_room_info()
+            RELAY.forget(ws)
+            self.broadcast_room_info()
         
         print(f"Client {user_id or id(ws)} disconnected from room {self.room_id}")
 
-    async def start_reconnection_timer(self, user_id):
-        try:
-            await asyncio.sleep(RECONNECTION_TIME)
+    def record_result(self, winner_id):
+        if not self.rated:
+            return
+        loser_id = next(uid for uid in self.players if uid != winner_id)
+        ratings = RATINGS.record(winner_id, loser_id)
+        self.broadcast({'type': 'rating_update', 'ratings': ratings}, include_spectators=False)
+        if CLUSTER:
+            CLUSTER.publish({'type': 'ratings', 'ratings': ratings})
+
+    def archive_game(self, winner_id):
+        if not ARCHIVE:
+            return
+        black, white = sorted(self.players.values(), key=lambda p: p.stone)
+        ARCHIVE.record({
+            'room_id': self.room_id,
+            'name': self.name,
+            'black': black.id,
+            'white': white.id,
+            'black_name': black.name,
+            'white_name': white.name,
+            'winner': winner_id,
+            'size': self.board.size,
+            'started': self.started_at,
+            'ended': time.time(),
+            'moves': bytes(self.moves)
+        })
+
+    def forfeit(self, user_id):
+        # The other player wins, with no line.
+        other_player_id = self.other_player(user_id)
+        other_player_name = self.players[other_player_id].name
+        journal_event({'e': 'forfeit', 'room_id': self.room_id, 'user_id': user_id})
+        self.game_state = 'FINISHED'
+        self.phase = None
+        self.win_line = []
+        self.cancel_move_timer()
+        self.broadcast({'type': 'game_over', 'winner_name': other_player_name, 'winner_id': other_player_id, 'line': []})
+        self.record_result(other_player_id)
+        self.archive_game(other_player_id)
+
+    def expire_reconnection(self, user_id):
+        player = self.players.get(user_id)
+        if player:
+            player.reconnect_timer = None
+
+        if player and player.ws is None:
+            self.broadcast({'type': 'chat', 'sender': 'System', 'message': f'Player {player.name} failed to reconnect. Game over.'})
             
-            if user_id in self.players and self.players[user_id]['ws'] is None:
-                player_name = self.players[user_id]['name']
-                await self.broadcast({'type': 'chat', 'sender': 'System', 'message': f'Player {player_name} failed to reconnect. Game over.'})
-                
-                other_player_id = None
-                for pid in self.players:
-                    if pid != user_id:
-                        other_player_id = pid
-                        break
-                
-                if other_player_id:
-                    other_player_name = self.players[other_player_id]['name']
-                    self.game_state = 'FINISHED'
-                    self.win_line = []
-                    await self.broadcast({'type': 'game_over', 'winner_name': other_player_name, 'winner_id': other_player_id, 'line': []})
-                
-                await self.broadcast_room_info()
-                
-        except asyncio.CancelledError:
-            pass
-        finally:
-            if user_id in self.reconnection_timers:
-                del self.reconnection_timers[user_id]
-            if user_id in self.players and self.players[user_id]['ws'] is None and self.game_state != 'IN_PROGRESS':
-                 del self.players[user_id]
-                 if user_id in self.player_tokens:
-                    del self.player_tokens[user_id]
+            other_player_id = None
+            for pid in self.players:
+                if pid != user_id:
+                    other_player_id = pid
+                    break
+
+            if other_player_id:
+                self.forfeit(user_id)
+
+            self.broadcast_room_info()
+
+            if self.game_state != 'IN_PROGRESS':
+                self.remove_player(user_id)
+                if self.is_empty() and GAME_ROOMS.get(self.room_id) is self:
+                    remove_room(self.room_id)
+
+
+class MirrorRoom:
+    # A room owned by another node (--broker), for spectators connected to
+    # this one. While the mirror has spectators the owner publishes what it
+    # sends its own; the mirror keeps a copy of the game state up to date
+    # from those messages and hands them to the relay like a local room.
+    # Spectator chat goes to the owner and comes back with everything else.
+    __slots__ = ('room_id', 'owner', 'spectators', 'state', 'stale')
+
+    def __init__(self, room_id, owner):
+        self.room_id = room_id
+        self.owner = owner
+        self.spectators = {}
+        self.state = None
+        self.stale = False
+
+    @property
+    def current_turn_uid(self):
+        return self.state['current_turn'] if self.state else None
+
+    def get_full_game_state(self):
+        return self.state
+
+    def get_sync(self, last_seq):
+        return self.state or {'type': 'error', 'message': 'The game state has not arrived yet.'}
+
+    def announce(self):
+        # Tells the owner how many spectators watch from here; 0 stops it
+        # publishing for this node.
+        BACKPLANE.send(self.owner, {'type': 'watch', 'node': BACKPLANE.node, 'room_id': self.room_id,
+                                    'count': len(self.spectators)})
+
+    def request_state(self):
+        self.stale = True
+        BACKPLANE.send(self.owner, {'type': 'state_request', 'node': BACKPLANE.node, 'room_id': self.room_id})
+
+    def relay(self, message):
+        kind = message['type']
+        if kind == 'game_state':
+            self.state = dict(message, board=[row[:] for row in message['board']])
+            self.stale = False
+        elif self.state is None:
+            # Nothing means much to a spectator before the first game_state.
+            return
+        elif kind in ('move', 'turn_change'):
+            if message['seq'] <= self.state['seq']:
+                return
+            if message['seq'] > self.state['seq'] + 1:
+                # Something was lost; spectators carry on with the deltas
+                # and the fresh game_state puts everyone right.
+                if not self.stale:
+                    self.request_state()
+            else:
+                if kind == 'move':
+                    self.state['board'][message['r']][message['c']] = message['stone']
+                else:
+                    self.state['current_turn'] = message['current_turn']
+                self.state['seq'] = message['seq']
+                # Clocks as of the move or turn change; a spectator who
+                # arrives later counts down from there.
+                if 'clocks' in message:
+                    self.state['clocks'] = message['clocks']
+        elif kind == 'game_over':
+            self.state['game_state'] = 'FINISHED'
+            self.state['win_line'] = message['line']
+
+        if not self.spectators:
+            return
+        if RELAY.interval:
+            RELAY.push(self, message)
+        else:
+            fan_out(list(self.spectators), message)
+
+    async def add_spectator(self, ws, user_id=None, user_name=None):
+        self.spectators[ws] = {
+            'user_id': user_id or f'spec_{id(ws) % 10000}',
+            'user_name': user_name or f'Spectator-{id(ws) % 1000}'
+        }
+        await send_message(ws, {'type': 'spectate_success', 'room_id': self.room_id})
+        if self.state:
+            await send_message(ws, self.state)
+        self.announce()
+
+    async def handle_client_disconnect(self, ws, user_id):
+        if ws in self.spectators:
+            del self.spectators[ws]
+            RELAY.forget(ws)
+            self.announce()
+        if not self.spectators:
+            self.close()
+
+    def close(self):
+        if self.spectators:
+            fan_out(list(self.spectators), {'type': 'room_closed', 'room_id': self.room_id})
+            for ws in self.spectators:
+                RELAY.forget(ws)
+                if ws in ALL_CLIENTS:
+                    set_client_room(ws, None, None)
+            self.spectators.clear()
+        if MIRRORS.get(self.room_id) is self:
+            del MIRRORS[self.room_id]
+            BACKPLANE.unwatch(self.room_id)
+
+    def is_empty(self):
+        # A mirror closes itself when its last spectator leaves.
+        return False
+
+    async def handle_spectator_chat(self, ws, message):
+        if ws not in self.spectators:
+            return
+        if not CHAT_LIMITER.allow(self.spectators[ws]['user_id']):
+            await send_chat_limited(ws)
+            return
+        BACKPLANE.send(self.owner, {'type': 'spectator_chat', 'room_id': self.room_id,
+                                    'sender': self.spectators[ws]['user_name'], 'message': message})
+
+    async def handle_chat(self, ws, user_id, message):
+        await send_message(ws, {'type': 'error', 'message': 'Only players can chat; spectators use spectator_chat.'})
+
+    async def handle_move(self, user_id, r, c):
+        pass
+
+    async def handle_choice(self, ws, user_id, choice):
+        pass
+
+
+def remote_spectators(room_id):
+    watchers = WATCHERS.get(room_id)
+    return sum(watchers.values()) if watchers else 0
 
 
 ALL_CLIENTS = {}
+# Set in each worker process when running sharded (--workers N), or to
+# the broker link with --broker.
+CLUSTER = None
+# With --broker: the same object as CLUSTER, plus remote rooms watched by
+# spectators here (room_id -> MirrorRoom) and local rooms watched from
+# other nodes (room_id -> {node: spectators there}).
+BACKPLANE = None
+MIRRORS = {}
+WATCHERS = {}
+SCHEDULER = Scheduler()
+# user_id -> room_id and reconnection token -> room_id for every seated player.
+USER_SESSIONS = {}
+TOKEN_SESSIONS = {}
+# Set by --journal.
+JOURNAL = None
+# Created on the first bot game.
+ENGINE_POOL = None
+# Set by --archive.
+ARCHIVE = None
+# ws -> task streaming a replay to that connection.
+REPLAYS = {}
+# Set by --metrics-port.
+METRICS = None
+
+def encode(message, encoding):
+    if not METRICS:
+        return protocol.encode(message, encoding)
+    started = time.perf_counter()
+    frame = protocol.encode(message, encoding)
+    METRICS.encode_seconds.observe(time.perf_counter() - started)
+    return frame
+
+def decode(frame):
+    if not METRICS:
+        return DISPATCH.decode(frame)
+    started = time.perf_counter()
+    try:
+        return DISPATCH.decode(frame)
+    finally:
+        METRICS.decode_seconds.observe(time.perf_counter() - started)
+
+async def send_frame(ws, frame, droppable=False):
+    if not OUTBOXES.ready(ws):
+        OUTBOXES.put(ws, frame, droppable)
+        return
+    try:
+        await ws.send(frame)
+    except websockets.exceptions.ConnectionClosed:
+        pass
 
 async def send_message(ws, message):
+    await send_frame(ws, encode(message, ws.subprotocol), message['type'] in DROPPABLE_TYPES)
+
+def fan_out(clients, message):
+    # Encode once per negotiated encoding and write the shared frame to every
+    # recipient without awaiting. A connection that has fallen behind (its
+    # transport buffer is over SEND_BUFFER_LIMIT, or frames are already
+    # queued for it) gets the frame through its bounded outbox instead, so
+    # it never stalls everyone else.
+    if METRICS:
+        started = time.perf_counter()
+    groups = {}
+    behind = []
+    for ws in clients:
+        if ws.transport is None:
+            continue
+        if OUTBOXES.ready(ws):
+            groups.setdefault(ws.subprotocol, []).append(ws)
+        else:
+            behind.append(ws)
+
+    frames = {}
+    for encoding, group in groups.items():
+        frames[encoding] = encode(message, encoding)
+        websockets.broadcast(group, frames[encoding])
+    if behind:
+        droppable = message['type'] in DROPPABLE_TYPES
+        for ws in behind:
+            frame = frames.get(ws.subprotocol)
+            if frame is None:
+                frame = frames[ws.subprotocol] = encode(message, ws.subprotocol)
+            OUTBOXES.put(ws, frame, droppable)
+    if METRICS:
+        METRICS.fanout_size.observe(len(clients))
+        METRICS.fanout_seconds.observe(time.perf_counter() - started)
+
+def send_chat(room, kind, message):
+    if GAME_ROOMS.get(room.room_id) is not room:
+        return
+    if kind == 'spectator_chat':
+        room.broadcast_to_spectators(message)
+    else:
+        room.broadcast(message)
+
+async def send_chat_limited(ws):
+    if METRICS:
+        METRICS.chat_limited.inc()
+    await send_message(ws, {'type': 'error', 'message': 'You are sending chat messages too fast.'})
+
+def drop_dead_connection(ws):
+    # Aborted rather than closed: a peer that stopped answering will not
+    # answer a close either. handle_connection then cleans up as for any
+    # other disconnect, which starts a player's reconnection clock.
+    print(f"Client {ws.remote_address} missed {HEARTBEAT.misses} heartbeats; dropping it")
+    if METRICS:
+        METRICS.heartbeat_timeouts.inc()
+    if ws.transport is not None:
+        ws.transport.abort()
+
+def probe_connection(ws):
+    # A websocket ping for a client that does not answer the heartbeat's;
+    # every websocket client answers those.
+    return asyncio.ensure_future(protocol_ping(ws))
+
+async def protocol_ping(ws):
     try:
-        await ws.send(json.dumps(message))
+        await (await ws.ping())
     except websockets.exceptions.ConnectionClosed:
         pass
 
-async def broadcast_message(clients, message):
-    tasks = [send_message(c['ws'], message) for c in clients if c.get('ws')]
-    if tasks:
-        await asyncio.wait(tasks)
-
-async def send_room_list(ws):
-    room_list = [room.get_room_info() for room in GAME_ROOMS.values()]
-    await send_message(ws, {'type': 'room_list', 'rooms': room_list})
-
-def find_room_by_user_id(user_id):
-    for room_id, room in GAME_ROOMS.items():
-        if user_id in room.players:
-            if room.game_state == 'IN_PROGRESS' and (room.players[user_id]['ws'] is None or user_id in room.reconnection_timers):
-                return room_id, room
-            elif user_id in room.player_tokens:
-                return room_id, room
+OUTBOXES = Outboxes(SEND_BUFFER_LIMIT)
+LOBBY = Lobby(fan_out)
+RELAY = SpectatorRelay(encode, backlogged=OUTBOXES.backlogged)
+CHAT = ChatBatcher(send_chat)
+CHAT_LIMITER = ChatLimiter()
+DIRECTORY = RoomDirectory(protocol.encode)
+HEARTBEAT = Heartbeat(SCHEDULER, fan_out, drop_dead_connection, probe_connection)
+RATINGS = Ratings()
+
+def engine_pool():
+    # Spawned rather than forked so the engine processes do not inherit the
+    # listening sockets.
+    global ENGINE_POOL
+    if ENGINE_POOL is None:
+        ENGINE_POOL = ProcessPoolExecutor(BOT_WORKERS, multiprocessing.get_context('spawn'),
+                                          initializer=engine.init_worker, initargs=(os.getpid(),))
+    return ENGINE_POOL
+
+def set_client_room(ws, room_id, user_id):
+    client_info = ALL_CLIENTS[ws]
+    client_info['room_id'] = room_id
+    client_info['user_id'] = user_id
+    if room_id is None:
+        LOBBY.enter(ws)
+    else:
+        LOBBY.leave(ws)
+        MATCHMAKER.leave(ws)
+        stop_replay(ws)
+
+async def send_room_list(ws, query):
+    state = query.game_state if query.game_state in ROOM_STATES else None
+    await send_frame(ws, DIRECTORY.page(state, query.free_seat, query.prefix, query.cursor, query.limit, ws.subprotocol))
+
+async def send_game_list(ws, query):
+    limit = min(query.limit or GAME_LIST_LIMIT, GAME_LIST_MAX)
+    games = await ARCHIVE.find(query.room_id, query.user_id, query.before, limit)
+    await send_message(ws, {'type': 'game_list', 'games': games})
+
+async def stream_replay(ws, game_id, speed):
+    # Plays an archived game back with the usual move messages, numbered
+    # from 1, at `speed` times the pace it was played.
+    game = await ARCHIVE.get(game_id)
+    if game is None:
+        await send_message(ws, {'type': 'error', 'message': 'Game not found.'})
+        return
+    players = {1: game['black'], 2: game['white']}
+    await send_message(ws, {
+        'type': 'replay_start',
+        'game_id': game_id,
+        'name': game['name'],
+        'players': {game['black']: game['black_name'], game['white']: game['white_name']},
+        'size': game['size'],
+        'moves': game['move_count'],
+        'started': game['started'],
+        'ended': game['ended'],
+        'speed': speed
+    })
+    for seq, (r, c, stone, elapsed) in enumerate(decode_moves(game['moves']), 1):
+        await asyncio.sleep(min(elapsed, REPLAY_MAX_DELAY) / speed)
+        await send_message(ws, {'type': 'move', 'player_id': players[stone], 'r': r, 'c': c, 'stone': stone, 'seq': seq})
+    winner_name = {game['black']: game['black_name'], game['white']: game['white_name']}.get(game['winner'])
+    await send_message(ws, {'type': 'replay_end', 'game_id': game_id, 'winner_id': game['winner'], 'winner_name': winner_name})
+
+def start_replay(ws, game_id, speed):
+    stop_replay(ws)
+    task = REPLAYS[ws] = asyncio.ensure_future(stream_replay(ws, game_id, speed))
+    task.add_done_callback(lambda done: REPLAYS.pop(ws, None) if REPLAYS.get(ws) is done else None)
+
+def stop_replay(ws):
+    task = REPLAYS.pop(ws, None)
+    if task is None:
+        return False
+    task.cancel()
+    return True
+
+def new_room_id():
+    while True:
+        room_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+        if room_id not in GAME_ROOMS and (CLUSTER is None or CLUSTER.can_host(room_id)):
+            return room_id
+
+async def redirect_to_owner(ws, room_id, message):
+    if CLUSTER is None or room_id is None or CLUSTER.owns(room_id):
+        return False
+    url = CLUSTER.url_of(room_id)
+    if url is None:
+        return False
+    await send_message(ws, {'type': 'redirect', 'url': url, 'message': dict(message.to_dict(), room_id=room_id)})
+    return True
+
+# register_session and unregister_session are for this node's rooms and
+# tell the others; remember_session and forget_session only keep track of
+# what they are told, so a session event is never published back.
+def register_session(room_id, user_id, token):
+    remember_session(room_id, user_id, token)
+    if CLUSTER:
+        CLUSTER.publish({'type': 'session', 'room_id': room_id, 'user_id': user_id, 'token': token})
+
+def unregister_session(room_id, user_id, token=None):
+    forget_session(room_id, user_id, token)
+    if CLUSTER:
+        CLUSTER.publish({'type': 'session_removed', 'room_id': room_id, 'user_id': user_id, 'token': token})
+
+def remember_session(room_id, user_id, token):
+    USER_SESSIONS[user_id] = room_id
+    TOKEN_SESSIONS[token] = room_id
+
+def forget_session(room_id, user_id, token=None):
+    if USER_SESSIONS.get(user_id) == room_id:
+        del USER_SESSIONS[user_id]
+    if token is not None and TOKEN_SESSIONS.get(token) == room_id:
+        del TOKEN_SESSIONS[token]
+
+def handle_cluster_event(event):
+    if event['type'] == 'room_update':
+        for info in event['rooms']:
+            DIRECTORY.room_changed(RemoteRoom(info))
+        for room_id in event['removed']:
+            DIRECTORY.room_removed(room_id)
+            if room_id in MIRRORS:
+                MIRRORS[room_id].close()
+        if LOBBY.clients:
+            fan_out(LOBBY.clients, event)
+    elif event['type'] == 'room_event':
+        mirror = MIRRORS.get(event['room_id'])
+        if mirror:
+            mirror.relay(event['message'])
+    elif event['type'] == 'session':
+        remember_session(event['room_id'], event['user_id'], event['token'])
+    elif event['type'] == 'session_removed':
+        forget_session(event['room_id'], event['user_id'], event['token'])
+    elif event['type'] == 'ratings':
+        RATINGS.ratings.update(event['ratings'])
+    else:
+        handle_node_event(event)
+
+def all_rooms_update():
+    return {'type': 'room_update', 'rooms': [room.get_room_info() for room in GAME_ROOMS.values()], 'removed': []}
+
+def handle_node_event(event):
+    # Events between nodes linked by a broker (--broker). A node that
+    # connects announces its rooms and is sent everyone else's.
+    if event['type'] == 'connected':
+        if GAME_ROOMS:
+            BACKPLANE.publish(all_rooms_update())
+    elif event['type'] == 'hello':
+        if GAME_ROOMS:
+            BACKPLANE.send(event['node'], all_rooms_update())
+    elif event['type'] == 'watch':
+        room = GAME_ROOMS.get(event['room_id'])
+        if room is None:
+            return
+        watchers = WATCHERS.setdefault(room.room_id, {})
+        if event['count']:
+            watchers[event['node']] = event['count']
+        else:
+            watchers.pop(event['node'], None)
+            if not watchers:
+                del WATCHERS[room.room_id]
+        room.broadcast_room_info()
+    elif event['type'] == 'state_request':
+        room = GAME_ROOMS.get(event['room_id'])
+        if room:
+            BACKPLANE.send(event['node'], {'type': 'room_state', 'room_id': room.room_id, 'state': room.get_full_game_state()})
+        else:
+            BACKPLANE.send(event['node'], {'type': 'room_update', 'rooms': [], 'removed': [event['room_id']]})
+    elif event['type'] == 'room_state':
+        mirror = MIRRORS.get(event['room_id'])
+        if mirror:
+            mirror.relay(event['state'])
+    elif event['type'] == 'spectator_chat':
+        room = GAME_ROOMS.get(event['room_id'])
+        if room:
+            CHAT.push(room, {'type': 'spectator_chat', 'sender': event['sender'], 'message': event['message']})
+    elif event['type'] == 'node_down':
+        for room_id in list(WATCHERS):
+            if WATCHERS[room_id].pop(event['node'], None):
+                if not WATCHERS[room_id]:
+                    del WATCHERS[room_id]
+                GAME_ROOMS[room_id].broadcast_room_info()
+    elif event['type'] == 'disconnected':
+        # The other nodes have dropped this one and its watchers with it.
+        rooms = [GAME_ROOMS[room_id] for room_id in WATCHERS if room_id in GAME_ROOMS]
+        WATCHERS.clear()
+        for room in rooms:
+            room.broadcast_room_info()
+
+def remove_room(room_id):
+    room = GAME_ROOMS.pop(room_id)
+    if room.reap_timer:
+        room.reap_timer.cancel()
+        room.reap_timer = None
+    for user_id, player in room.players.items():
+        unregister_session(room_id, user_id, player.token)
+    WATCHERS.pop(room_id, None)
+    LOBBY.room_removed(room_id)
+    DIRECTORY.room_removed(room_id)
+    journal_event({'e': 'remove', 'room_id': room_id})
+
+async def start_match(first, second):
+    # Runs a moment after the pairing, by when either player may have gone:
+    # the one still here goes back in the queue, keeping their place.
+    # Otherwise both are seated before the first await, so a disconnect
+    # from here on is handled by the room.
+    gone = [entry for entry in (first, second) if entry['ws'] not in ALL_CLIENTS]
+    if gone:
+        for entry in (first, second):
+            if entry not in gone:
+                MATCHMAKER.enqueue(entry['ws'], entry['user_id'], entry['user_name'], entry['rating'])['queued_at'] = entry['queued_at']
+        return
+    room_id = new_room_id()
+    room = GAME_ROOMS[room_id] = GameRoom(room_id, f"{first['user_name']} vs {second['user_name']}")
+    room.rated = True
+    journal_event({'e': 'create', 'room_id': room_id, 'name': room.name, 'rated': True})
+    for entry in (first, second):
+        set_client_room(entry['ws'], room_id, entry['user_id'])
+        room.seat_player(entry['ws'], entry['user_id'], entry['user_name'])
+    for entry in (first, second):
+        player = room.players[entry['user_id']]
+        await send_message(entry['ws'], {'type': 'join_success', 'room_id': room_id, 'token': player.token, 'your_stone': player.stone})
+    room.broadcast_room_info()
+    if len(room.players) == 2:
+        await room.start_game()
+    print(f"Matched {first['user_id']} ({first['rating']}) with {second['user_id']} ({second['rating']}) in room {room_id}")
+
+MATCHMAKER = Matchmaker(start_match)
+
+def journal_event(event):
+    if JOURNAL:
+        JOURNAL.record(event)
+
+def journal_snapshot():
+    return [room.snapshot() for room in GAME_ROOMS.values()]
+
+def replay_journal_event(event):
+    kind = event['e']
+    if kind == 'create':
+        room = GAME_ROOMS[event['room_id']] = GameRoom(event['room_id'], event['name'], event.get('size', BOARD_SIZE),
+                                                       event.get('rule', DEFAULT_RULE), event.get('opening'),
+                                                       event.get('time_control'))
+        room.rated = event.get('rated', False)
+        return
+
+    room = GAME_ROOMS.get(event['room_id'])
+    if room is None:
+        return
+    if kind == 'join':
+        user_id = event['user_id']
+        room.players[user_id] = Player(user_id, event['user_name'], len(room.players) + 1, token=event['token'])
+        if event.get('bot'):
+            room.bot_uid = user_id
+        if len(room.players) == 2:
+            room.game_state = 'IN_PROGRESS'
+            room.current_turn_uid = next(iter(room.players))
+            room.started_at = event.get('t')
+            room.phase = OPENINGS.get(room.opening)
+            if room.time_control:
+                room.clocks = {uid: room.time_control.new_clock() for uid in room.players}
+    elif kind == 'move':
+        if 'clock' in event:
+            room.clocks[room.current_turn_uid] = event['clock']
+        stone = 1 + room.board.stones % 2 if room.phase else room.players[room.current_turn_uid].stone
+        room.board.place(event['r'], event['c'], stone)
+        room.moves += encode_move(event['r'], event['c'], stone, event.get('dt', 0))
+        win_line = room.rule.check_win(room.board, event['r'], event['c'], stone)
+        if win_line:
+            room.game_state = 'FINISHED'
+            room.win_line = win_line
+        elif room.phase:
+            room.seq += 1
+            room.end_placing()
+        else:
+            room.seq += 1
+            replay_journal_event({'e': 'skip', 'room_id': room.room_id})
+    elif kind == 'choose':
+        if 'clock' in event:
+            room.clocks[event['user_id']] = event['clock']
+        room.apply_choice(event['user_id'], event['choice'])
+    elif kind == 'skip':
+        player_uids = list(room.players)
+        room.current_turn_uid = player_uids[1] if room.current_turn_uid == player_uids[0] else player_uids[0]
+        room.seq += 1
+    elif kind == 'forfeit':
+        # The leave event that follows removes the player.
+        room.game_state = 'FINISHED'
+        room.phase = None
+        room.win_line = []
+    elif kind == 'leave':
+        room.players.pop(event['user_id'], None)
+    elif kind == 'remove':
+        del GAME_ROOMS[room.room_id]
+
+def recover_rooms(journal):
+    # Rebuild the rooms from the last snapshot plus the journal tail. Only
+    # games still in progress are kept; their players get the usual
+    # reconnection window to come back with the reconnect message.
+    snapshot, events = journal.load()
+    for state in snapshot:
+        GAME_ROOMS[state['room_id']] = GameRoom.from_snapshot(state)
+    for event in events:
+        replay_journal_event(event)
+
+    for room_id, room in list(GAME_ROOMS.items()):
+        if room.game_state != 'IN_PROGRESS' or len(room.players) < 2:
+            del GAME_ROOMS[room_id]
+            journal_event({'e': 'remove', 'room_id': room_id})
+            continue
+        for user_id, player in room.players.items():
+            if user_id == room.bot_uid:
+                continue
+            register_session(room_id, user_id, player.token)
+            player.reconnect_timer = SCHEDULER.call_later(RECONNECTION_TIME, room.expire_reconnection, user_id)
+        # Clocks carry on from the last move journaled; the time the server
+        # was down is not charged to anyone.
+        room.last_move_at = time.time()
+        room.start_move_timer()
+        room.schedule_bot_move()
+        room.broadcast_room_info()
+    print(f"Recovered {len(GAME_ROOMS)} games from {journal.path} ({len(snapshot)} snapshot rooms, {len(events)} journal events)")
+
+def session_room_id(user_id, token=None):
+    room_id = TOKEN_SESSIONS.get(token) if token else None
+    if room_id is None:
+        room_id = USER_SESSIONS.get(user_id)
+    return room_id
+
+def find_room_by_user_id(user_id, token=None):
+    room_id = session_room_id(user_id, token)
+    room = GAME_ROOMS.get(room_id)
+    player = room.players.get(user_id) if room else None
+    if player is None:
+        return None, None
+    if room.game_state == 'IN_PROGRESS' and (player.ws is None or player.reconnect_timer):
+        return room_id, room
+    elif player.token:
+        return room_id, room
     return None, None
 
+DISPATCH = Dispatcher()
+
+@DISPATCH.on(messages.Move, in_room=True)
+async def on_move(ws, room, user_id, message):
+    if METRICS:
+        started = time.perf_counter()
+        await room.handle_move(user_id, *message.move)
+        METRICS.move_seconds.observe(time.perf_counter() - started)
+    else:
+        await room.handle_move(user_id, *message.move)
+
+@DISPATCH.on(messages.Chat, in_room=True)
+async def on_chat(ws, room, user_id, message):
+    await room.handle_chat(ws, user_id, message.message)
+
+@DISPATCH.on(messages.SpectatorChat, in_room=True)
+async def on_spectator_chat(ws, room, user_id, message):
+    await room.handle_spectator_chat(ws, message.message)
+
+@DISPATCH.on(messages.Sync, in_room=True)
+async def on_sync(ws, room, user_id, message):
+    await send_message(ws, room.get_sync(message.last_seq))
+
+@DISPATCH.on(messages.Choose, in_room=True)
+async def on_choose(ws, room, user_id, message):
+    await room.handle_choice(ws, user_id, message.choice)
+
+@DISPATCH.on(messages.LeaveRoom, in_room=True)
+async def on_leave_room(ws, room, user_id, message):
+    await room.handle_client_disconnect(ws, user_id)
+    set_client_room(ws, None, None)
+    if room.is_empty():
+        remove_room(room.room_id)
+
+def record_pong(ws, message):
+    rtt = HEARTBEAT.pong(ws, message.id)
+    if METRICS and rtt is not None:
+        METRICS.rtt_seconds.observe(rtt)
+
+@DISPATCH.on(messages.Pong, in_room=True)
+async def on_pong(ws, room, user_id, message):
+    record_pong(ws, message)
+
+@DISPATCH.on(messages.Pong)
+async def on_lobby_pong(ws, message):
+    record_pong(ws, message)
+
+@DISPATCH.on(messages.ListRooms)
+async def on_list_rooms(ws, message):
+    await send_room_list(ws, message)
+
+@DISPATCH.on(messages.CreateRoom)
+async def on_create_room(ws, message):
+    room_id = new_room_id()
+    GAME_ROOMS[room_id] = GameRoom(room_id, message.name, message.size, message.rule, message.opening,
+                                   message.time_control)
+    journal_event({'e': 'create', 'room_id': room_id, 'name': message.name, 'size': message.size, 'rule': message.rule,
+                   'opening': message.opening, 'time_control': message.time_control})
+
+    set_client_room(ws, room_id, message.user_id)
+    await GAME_ROOMS[room_id].add_player(ws, message.user_id, message.user_name)
+    if message.bot and room_id in GAME_ROOMS:
+        GAME_ROOMS[room_id].add_bot()
+        await GAME_ROOMS[room_id].start_game()
+
+@DISPATCH.on(messages.JoinRoom)
+async def on_join_room(ws, message):
+    room_id = message.room_id
+    if await redirect_to_owner(ws, room_id, message):
+        return
+    if room_id in GAME_ROOMS:
+        set_client_room(ws, room_id, message.user_id)
+        await GAME_ROOMS[room_id].add_player(ws, message.user_id, message.user_name)
+    else:
+        await send_message(ws, {'type': 'error', 'message': 'Room not found.'})
+
+@DISPATCH.on(messages.SpectateRoom)
+async def on_spectate_room(ws, message):
+    room_id = message.room_id
+    if BACKPLANE and BACKPLANE.url_of(room_id):
+        await spectate_remote(ws, message)
+        return
+    if await redirect_to_owner(ws, room_id, message):
+        return
+    if room_id in GAME_ROOMS:
+        set_client_room(ws, room_id, message.user_id)
+        await GAME_ROOMS[room_id].add_spectator(ws, message.user_id, message.user_name)
+    else:
+        await send_message(ws, {'type': 'error', 'message': 'Room not found.'})
+
+async def spectate_remote(ws, message):
+    # Spectators stay on this node and watch through a mirror; only players
+    # are redirected to the node that owns the room.
+    mirror = MIRRORS.get(message.room_id)
+    if mirror is None:
+        mirror = MIRRORS[message.room_id] = MirrorRoom(message.room_id, BACKPLANE.url_of(message.room_id))
+        BACKPLANE.watch(mirror.room_id)
+    set_client_room(ws, mirror.room_id, message.user_id)
+    await mirror.add_spectator(ws, message.user_id, message.user_name)
+    if mirror.state is None and not mirror.stale:
+        mirror.request_state()
+
+@DISPATCH.on(messages.QuickMatch)
+async def on_quick_match(ws, message):
+    entry = MATCHMAKER.enqueue(ws, message.user_id, message.user_name, RATINGS.get(message.user_id))
+    await send_message(ws, {'type': 'match_queued', 'rating': entry['rating'], 'queued': len(MATCHMAKER)})
+
+@DISPATCH.on(messages.CancelMatch)
+async def on_cancel_match(ws, message):
+    if MATCHMAKER.leave(ws):
+        await send_message(ws, {'type': 'match_cancelled'})
+
+@DISPATCH.on(messages.ListGames)
+async def on_list_games(ws, message):
+    if not ARCHIVE:
+        await send_message(ws, {'type': 'error', 'message': 'The game archive is not enabled on this server.'})
+        return
+    await send_game_list(ws, message)
+
+@DISPATCH.on(messages.Replay)
+async def on_replay(ws, message):
+    if not ARCHIVE:
+        await send_message(ws, {'type': 'error', 'message': 'The game archive is not enabled on this server.'})
+        return
+    start_replay(ws, message.game_id, min(max(message.speed, REPLAY_SPEEDS[0]), REPLAY_SPEEDS[1]))
+
+@DISPATCH.on(messages.StopReplay)
+async def on_stop_replay(ws, message):
+    if stop_replay(ws):
+        await send_message(ws, {'type': 'replay_end', 'stopped': True})
+
+@DISPATCH.on(messages.Reconnect)
+async def on_reconnect(ws, message):
+    user_id = message.user_id
+    token = message.token
+    room_id = message.room_id
+
+    if await redirect_to_owner(ws, room_id or session_room_id(user_id, token), message):
+        return
+
+    if room_id and room_id in GAME_ROOMS:
+        target_room = GAME_ROOMS[room_id]
+    else:
+        found_room_id, target_room = find_room_by_user_id(user_id, token)
+        if target_room:
+            room_id = found_room_id
+        else:
+            await send_message(ws, {'type': 'error', 'message': f'No active game session found for user ID: {user_id}'})
+            return
+
+    set_client_room(ws, room_id, user_id)
+
+    await target_room.handle_reconnection(ws, user_id, token, message.last_seq)
+
+async def handle_frame(websocket, frame):
+    try:
+        message = decode(frame)
+    except InvalidMessage as e:
+        if METRICS:
+            METRICS.messages.inc('invalid')
+        await send_message(websocket, {'type': 'error', 'message': str(e)})
+        return
+    if METRICS:
+        METRICS.messages.inc(message.type)
+
+    client_info = ALL_CLIENTS[websocket]
+    room = GAME_ROOMS.get(client_info['room_id'])
+    if room is None and MIRRORS:
+        room = MIRRORS.get(client_info['room_id'])
+    if room is not None:
+        handler = DISPATCH.room_handlers.get(message.type)
+        if handler:
+            await handler(websocket, room, client_info['user_id'], message)
+    else:
+        handler = DISPATCH.lobby_handlers.get(message.type)
+        if handler:
+            await handler(websocket, message)
+
 async def handle_connection(websocket):
     ALL_CLIENTS[websocket] = {'room_id': None, 'user_id': None}
+    LOBBY.enter(websocket)
+    HEARTBEAT.add(websocket)
     print(f"New client connected: {websocket.remote_address}")
     
     try:
-        async for message in websocket:
+        async for frame in websocket:
             try:
-                data = json.loads(message)
-                msg_type = data.get('type')
-                
-                client_info = ALL_CLIENTS[websocket]
-                room_id = client_info.get('room_id')
-                user_id = client_info.get('user_id')
-                
-                if room_id and room_id in GAME_ROOMS:
-                    room = GAME_ROOMS[room_id]
-                    
-                    if msg_type == 'move':
-                        await room.handle_move(user_id, data.get('move'))
-                    elif msg_type == 'chat':
-                        await room.handle_chat(user_id, data.get('message'))
-                    elif msg_type == 'spectator_chat':
-                        await room.handle_spectator_chat(websocket, data.get('message'))
-                    elif msg_type == 'leave_room':
-                        await room.handle_client_disconnect(websocket, user_id)
-                        client_info['room_id'] = None
-                        client_info['user_id'] = None
-
-                else:
-                    if msg_type == 'list_rooms':
-                        await send_room_list(websocket)
-                    
-                    elif msg_type == 'create_room':
-                        room_name = data.get('name', 'New Room')
-                        user_id = data.get('user_id', 'Player')
-                        user_name = data.get('user_name', 'Player')
-                        
-                        room_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-                        GAME_ROOMS[room_id] = GameRoom(room_id, room_name)
-                        
-                        client_info['room_id'] = room_id
-                        client_info['user_id'] = user_id
-                        await GAME_ROOMS[room_id].add_player(websocket, user_id, user_name)
-
-                    elif msg_type == 'join_room':
-                        room_id = data.get('room_id')
-                        user_id = data.get('user_id', 'Player')
-                        user_name = data.get('user_name', 'Player')
-                        
-                        if room_id in GAME_ROOMS:
-                            client_info['room_id'] = room_id
-                            client_info['user_id'] = user_id
-                            await GAME_ROOMS[room_id].add_player(websocket, user_id, user_name)
-                        else:
-                            await send_message(websocket, {'type': 'error', 'message': 'Room not found.'})
-
-                    elif msg_type == 'spectate_room':
-                        room_id = data.get('room_id')
-                        user_id = data.get('user_id')
-                        user_name = data.get('user_name')
-                        if room_id in GAME_ROOMS:
-                            client_info['room_id'] = room_id
-                            client_info['user_id'] = user_id
-                            await GAME_ROOMS[room_id].add_spectator(websocket, user_id, user_name)
-                        else:
-                            await send_message(websocket, {'type': 'error', 'message': 'Room not found.'})
-
-                    elif msg_type == 'reconnect':
-                        user_id = data.get('user_id')
-                        token = data.get('token')
-                        room_id = data.get('room_id')
-                        
-                        if not user_id:
-                            await send_message(websocket, {'type': 'error', 'message': 'User ID is required for reconnection.'})
-                            continue
-                        
-                        if room_id and room_id in GAME_ROOMS:
-                            target_room = GAME_ROOMS[room_id]
-                        else:
-                            found_room_id, target_room = find_room_by_user_id(user_id)
-                            if target_room:
-                                room_id = found_room_id
-                            else:
-                                await send_message(websocket, {'type': 'error', 'message': f'No active game session found for user ID: {user_id}'})
-                                continue
-                        
-                        client_info['room_id'] = room_id
-                        client_info['user_id'] = user_id
-                        
-                        await target_room.handle_reconnection(websocket, user_id, token)
-
-            except json.JSONDecodeError:
-                print(f"Invalid JSON from {websocket.remote_address}")
+                await handle_frame(websocket, frame)
             except Exception as e:
                 print(f"Error processing message: {e}")
 
@@ -449,18 +1492,144 @@ async def handle_connection(websocket):
             user_id = client_info.get('user_id')
             if room_id and room_id in GAME_ROOMS:
                 await GAME_ROOMS[room_id].handle_client_disconnect(websocket, user_id)
-                if not GAME_ROOMS[room_id].players and not GAME_ROOMS[room_id].spectators:
-                    del GAME_ROOMS[room_id]
+                if GAME_ROOMS[room_id].is_empty():
+                    remove_room(room_id)
                     print(f"Room {room_id} is empty and has been deleted.")
-                    await broadcast_message(ALL_CLIENTS.values(), {'type': 'room_removed', 'room_id': room_id})
+            elif room_id in MIRRORS:
+                await MIRRORS[room_id].handle_client_disconnect(websocket, user_id)
 
         if websocket in ALL_CLIENTS:
             del ALL_CLIENTS[websocket]
+        HEARTBEAT.remove(websocket)
+        LOBBY.leave(websocket)
+        MATCHMAKER.leave(websocket)
+        stop_replay(websocket)
+
+def rooms_by_state():
+    counts = dict.fromkeys(ROOM_STATES, 0)
+    for room in GAME_ROOMS.values():
+        counts[room.game_state] += 1
+    return counts
+
+def enable_metrics():
+    global METRICS
+    METRICS = Metrics()
+    METRICS.gauge('gomoku_connected_clients', 'Open websocket connections.', lambda: len(ALL_CLIENTS))
+    METRICS.gauge('gomoku_lobby_clients', 'Connections in the lobby.', lambda: len(LOBBY.clients))
+    METRICS.gauge('gomoku_rooms', 'Rooms owned by this server, by game state.', rooms_by_state, 'game_state')
+    METRICS.distribution('gomoku_room_spectators', 'Spectators per room.', lambda: [len(room.spectators) for room in GAME_ROOMS.values()])
+    METRICS.gauge('gomoku_reconnection_timers', 'Players inside their reconnection window.',
+                  lambda: sum(1 for room in GAME_ROOMS.values() for p in room.players.values() if p.reconnect_timer))
+    METRICS.gauge('gomoku_scheduler_timers', 'Pending move and reconnection timers.', lambda: len(SCHEDULER))
+    METRICS.gauge('gomoku_match_queue', 'Players waiting for a quick match.', lambda: len(MATCHMAKER))
+    METRICS.gauge('gomoku_mirror_rooms', 'Rooms of other nodes watched by spectators here (--broker).', lambda: len(MIRRORS))
+    METRICS.gauge('gomoku_lagging_spectators', 'Spectators skipped until their send buffer drains.', lambda: len(RELAY.lagging))
+    METRICS.gauge('gomoku_backlogged_connections', 'Connections with frames waiting in their outbox.', lambda: len(OUTBOXES))
+    METRICS.collected_counter('gomoku_outbox_overflows_total', 'Full outboxes, by what was done about it.',
+                              lambda: {'dropped_chat': OUTBOXES.dropped, 'disconnected': OUTBOXES.disconnected}, 'action')
+
+async def serve(host, port, metrics_port=None):
+    # Compression is disabled so one encoded frame can be shared by every
+    # recipient of a broadcast instead of being deflated per connection.
+    # Frames over MAX_FRAME_SIZE close the connection before they are
+    # buffered in full.
+    options = {'select_subprotocol': protocol.select_subprotocol, 'compression': None, 'max_size': MAX_FRAME_SIZE}
+    if HEARTBEAT.interval:
+        # Replaces the websockets keepalive, which runs a task per connection.
+        options['ping_interval'] = None
+        HEARTBEAT.start()
+    if CLUSTER:
+        CLUSTER.start(handle_cluster_event)
+        LOBBY.publish = CLUSTER.publish
+    # Background writers, stopped when the server does; a cancelled writer
+    # still writes out what it has queued.
+    writers = []
+    if JOURNAL:
+        recover_rooms(JOURNAL)
+        writers.append(asyncio.create_task(JOURNAL.run()))
+    if ARCHIVE:
+        writers.append(asyncio.create_task(ARCHIVE.run()))
+    if METRICS:
+        await METRICS.serve(host, metrics_port)
+        print(f"Metrics on http://{host}:{metrics_port}/metrics")
+    try:
+        if CLUSTER and not BACKPLANE:
+            await websockets.serve(handle_connection, host, port, reuse_port=True, **options)
+            await websockets.serve(handle_connection, host, CLUSTER.port, **options)
+            await CLUSTER.closed
+        else:
+            await websockets.serve(handle_connection, host, port, **options)
+            await asyncio.Future()
+    finally:
+        # Left to the interpreter's exit handlers, the pool shutdown hangs
+        # when the worker exits on SIGTERM.
+        if ENGINE_POOL:
+            ENGINE_POOL.shutdown(cancel_futures=True)
+        for writer in writers:
+            writer.cancel()
+        if writers:
+            await asyncio.wait(writers)
+
+def run_worker(shard, shards, conn, host, port, journal_path=None, metrics_port=None, archive_path=None,
+               spectator_delay=SPECTATOR_BATCH_INTERVAL, heartbeat=HEARTBEAT_INTERVAL, heartbeat_misses=HEARTBEAT_MISSES):
+    global CLUSTER, JOURNAL, ARCHIVE
+    CLUSTER = Cluster(shard, shards, conn, host, port)
+    RELAY.interval = spectator_delay
+    HEARTBEAT.interval = heartbeat
+    HEARTBEAT.misses = heartbeat_misses
+    if journal_path:
+        JOURNAL = Journal(f"{journal_path}.{shard}", journal_snapshot)
+    if archive_path:
+        # Shards share one archive so any of them can replay any game.
+        ARCHIVE = Archive(archive_path)
+    if metrics_port:
+        enable_metrics()
+        metrics_port += shard
+    print(f"Worker {shard} serving rooms on ws://{host}:{CLUSTER.port}")
+    asyncio.run(serve(host, port, metrics_port))
+
+def main():
+    global CLUSTER, BACKPLANE, JOURNAL, ARCHIVE
+    parser = argparse.ArgumentParser(description='Gomoku WebSocket server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=1, help='number of shard processes, each owning a partition of the rooms')
+    parser.add_argument('--journal', metavar='PATH', help='journal games to PATH and resume them after a restart')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on http://HOST:PORT/metrics (PORT + shard per worker)')
+    parser.add_argument('--archive', metavar='PATH', help='store finished games in the SQLite database at PATH for replays')
+    parser.add_argument('--spectator-delay', type=float, default=SPECTATOR_BATCH_INTERVAL, metavar='SECONDS',
+                        help='batch updates to spectators over this interval; 0 sends them with the players\' (default %(default)s)')
+    parser.add_argument('--heartbeat', type=float, default=HEARTBEAT_INTERVAL, metavar='SECONDS',
+                        help='ping every connection this often and report its round trip; 0 leaves it to websockets\' keepalive (default %(default)s)')
+    parser.add_argument('--heartbeat-misses', type=int, default=HEARTBEAT_MISSES, metavar='N',
+                        help='drop a connection that leaves more than N pings in a row unanswered (default %(default)s)')
+    parser.add_argument('--broker', metavar='HOST:PORT',
+                        help='share rooms with the other servers connected to the broker.py at HOST:PORT')
+    parser.add_argument('--public-url', metavar='URL',
+                        help='with --broker, where other servers send players of rooms created here (default ws://HOST:PORT)')
+    args = parser.parse_args()
+    if args.broker and args.workers > 1:
+        parser.error('--broker links single-process servers; run more of them instead of --workers')
 
-async def main():
-    print("Starting Gomoku server on ws://localhost:8765")
-    async with websockets.serve(handle_connection, "localhost", 8765):
-        await asyncio.Future()
+    print(f"Starting Gomoku server on ws://{args.host}:{args.port}")
+    if args.workers > 1:
+        run_workers(args.workers, run_worker, args.host, args.port, args.journal, args.metrics_port, args.archive,
+                    args.spectator_delay, args.heartbeat, args.heartbeat_misses)
+    else:
+        if args.journal:
+            JOURNAL = Journal(args.journal, journal_snapshot)
+        if args.metrics_port:
+            enable_metrics()
+        if args.archive:
+            ARCHIVE = Archive(args.archive)
+        if args.broker:
+            broker_host, _, broker_port = args.broker.rpartition(':')
+            CLUSTER = BACKPLANE = Backplane(broker_host or 'localhost', int(broker_port),
+                                            args.public_url or f"ws://{args.host}:{args.port}", GAME_ROOMS)
+        RELAY.interval = args.spectator_delay
+        HEARTBEAT.interval = args.heartbeat
+        HEARTBEAT.misses = args.heartbeat_misses
+        asyncio.run(serve(args.host, args.port, args.metrics_port))
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import shutil
+import signal
+import sys
+
+FRAME_INTERVAL = 1 / 30
+STONE_CHARS = '.BW'
+# Rows above the board: status line, column numbers and the top border.
+BOARD_TOP = 4
+
+
+class Screen:
+    # Full-screen terminal view drawn with ANSI escape codes: a status line,
+    # the board, a scrolling message log and the input line at the bottom.
+    # Nothing is written when state changes; changes are collected and
+    # written as one frame at most every interval seconds, so a burst of
+    # moves costs one write. Only board cells that differ from what is on
+    # screen are redrawn, and the cells changed by the last update are shown
+    # in reverse video.
+    def __init__(self, out, interval=FRAME_INTERVAL):
+        self.out = out
+        self.interval = interval
+        self.width, self.height = shutil.get_terminal_size()
+        self._board = []
+        self._drawn = {}
+        self._recent = set()
+        self._dirty = set()
+        self._status = ''
+        self._prompt = '> '
+        self._lines = []
+        self._new_lines = 0
+        self._full = True
+        self._started = False
+        self._flush_handle = None
+
+    @property
+    def log_top(self):
+        return BOARD_TOP + len(self._board) + 2
+
+    def start(self):
+        # Alternate screen buffer, restored by stop().
+        if self._started:
+            return
+        self._started = True
+        self.out.write('\x1b[?1049h')
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGWINCH, self.resize)
+        except (NotImplementedError, RuntimeError):
+            pass
+        self._schedule()
+
+    def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.out.write('\x1b[r\x1b[?1049l')
+        self.out.flush()
+
+    def resize(self):
+        self.width, self.height = shutil.get_terminal_size()
+        self._full = True
+        self._schedule()
+
+    def board(self, rows):
+        if len(rows) != len(self._board):
+            self._full = True
+        self._board = [list(row) for row in rows]
+        if self._full:
+            self._recent = set()
+        else:
+            changed = set()
+            for r, row in enumerate(self._board):
+                for c, stone in enumerate(row):
+                    if self._drawn.get((r, c), 0) != stone:
+                        changed.add((r, c))
+            if changed:
+                self._dirty |= changed | self._recent
+                self._recent = changed
+        self._schedule()
+
+    def status(self, text):
+        if text != self._status:
+            self._status = text
+            self._dirty.add('status')
+            self._schedule()
+
+    def prompt(self, text):
+        if text != self._prompt:
+            self._prompt = text
+            self._dirty.add('prompt')
+            self._schedule()
+
+    def entered(self):
+        # The terminal echoed a line onto the input line; clear it.
+        self._dirty.add('prompt')
+        self._schedule()
+
+    def log(self, text):
+        for line in text.split('\n'):
+            if line.strip():
+                self._lines.append(line)
+                self._new_lines += 1
+        del self._lines[:-self.height]
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def _cell(self, r, c):
+        stone = self._board[r][c]
+        self._drawn[(r, c)] = stone
+        char = STONE_CHARS[stone]
+        if (r, c) in self._recent and stone:
+            char = f'\x1b[7m{char}\x1b[0m'
+        return f'\x1b[{BOARD_TOP + r};{5 + 2 * c}H{char}'
+
+    def flush(self):
+        self._flush_handle = None
+        log_top, log_bottom = self.log_top, self.height - 1
+        # Save the cursor so text being typed on the input line stays put.
+        parts = ['\x1b7']
+        if self._full:
+            size = len(self._board)
+            parts.append(f'\x1b[r\x1b[2J\x1b[{log_top};{log_bottom}r')
+            if size:
+                parts.append('\x1b[2;1H   ' + ' '.join(f'{i:2}' for i in range(size)))
+                parts.append('\x1b[3;1H  +' + '--' * size + '-')
+                for r in range(size):
+                    parts.append(f'\x1b[{BOARD_TOP + r};1H{r:2}|')
+            self._drawn = {}
+            self._dirty = {(r, c) for r in range(size) for c in range(size)} | {'status', 'prompt'}
+            self._new_lines = len(self._lines)
+            self._full = False
+        for key in self._dirty:
+            if key == 'status':
+                parts.append(f'\x1b[1;1H\x1b[2K\x1b[1m{self._status[:self.width]}\x1b[0m')
+            elif key != 'prompt' and key[0] < len(self._board):
+                parts.append(self._cell(*key))
+        if self._new_lines and log_bottom > log_top:
+            # Each line scrolls the log region up by one; anything that
+            # would scroll straight off again is skipped.
+            for line in self._lines[-min(self._new_lines, log_bottom - log_top + 1):]:
+                parts.append(f'\x1b[{log_bottom};1H\n\x1b[2K{line[:self.width]}')
+            self._new_lines = 0
+        parts.append('\x1b8')
+        if 'prompt' in self._dirty:
+            parts.append(f'\x1b[{self.height};1H\x1b[2K{self._prompt}')
+        self._dirty = set()
+        self.out.write(''.join(parts))
+        self.out.flush()
+
+
+def stdin_lines():
+    # Returns a queue of lines typed on stdin ('' at end of input), read on
+    # the event loop without a thread. The callback only runs when input is
+    # waiting, so stdin can stay in blocking mode; a terminal's stdin and
+    # stdout usually share one file description and making stdin
+    # non-blocking would make writes to stdout fail when the terminal is
+    # slow. Returns None if stdin cannot be watched (a regular file).
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    lines = asyncio.Queue()
+    pending = bytearray()
+
+    def on_readable():
+        data = os.read(fd, 4096)
+        if not data:
+            loop.remove_reader(fd)
+            if pending:
+                lines.put_nowait(pending.decode(errors='replace'))
+            lines.put_nowait('')
+            return
+        pending.extend(data)
+        while True:
+            end = pending.find(b'\n')
+            if end < 0:
+                break
+            lines.put_nowait(pending[:end + 1].decode(errors='replace'))
+            del pending[:end + 1]
+
+    try:
+        loop.add_reader(fd, on_readable)
+    except (PermissionError, ValueError, NotImplementedError):
+        return None
+    return lines